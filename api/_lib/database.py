@@ -74,7 +74,31 @@ def increment_global_stats():
 
 def check_can_chat(identifier: str) -> dict:
     """
-    Core Logic using REST API
+    Quota check + increment in one round trip.
+    Calls the check_can_chat Postgres function (supabase/migrations/check_can_chat_rpc.sql),
+    which resolves the user, resets the day, checks both limits and bumps both
+    counters atomically. Falls back to the REST chain if the function is missing.
+    Identifier can be IP address or Email
+    """
+    # Fail OPEN if no keys configured
+    if not SUPABASE_URL or "your_" in SUPABASE_URL:
+        return {'allowed': True, 'plan': 'dev', 'remaining': 999}
+
+    result = supabase_request("POST", "rpc/check_can_chat", data={
+        "p_identifier": identifier,
+        "p_daily_limit": DAILY_FREE_LIMIT,
+        "p_global_cap": GLOBAL_SAFETY_CAP,
+    })
+    if isinstance(result, dict) and "allowed" in result:
+        return result
+
+    print("check_can_chat RPC unavailable, falling back to REST chain")
+    return check_can_chat_rest(identifier)
+
+def check_can_chat_rest(identifier: str) -> dict:
+    """
+    Core Logic using REST API (up to seven sequential calls, not atomic).
+    Kept as the fallback until the RPC migration is applied everywhere.
     Identifier can be IP address or Email
     """
     # Fail OPEN if no keys configured
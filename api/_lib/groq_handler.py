@@ -1,6 +1,7 @@
 import os
 from groq import Groq
 from dotenv import load_dotenv
+from api._lib.response_validator import validate_response
 
 load_dotenv()
 
@@ -11,29 +12,6 @@ api_key = os.getenv("GROQ_API_KEY")
 if api_key:
     client = Groq(api_key=api_key)
 
-def validate_response(text: str, rules: dict) -> str:
-    """
-    Validates and cleans the response based on rules.
-    1. Truncate to max_words
-    2. Check prompt compliance (basic)
-    """
-    max_words = rules.get("max_words", 150)
-    
-    # 1. Check word count
-    words = text.split()
-    if len(words) > max_words:
-        # Hard cut
-        text = " ".join(words[:max_words]) + "..."
-        
-    # 2. Naive forbidden phrase check/strip could go here
-    forbidden = rules.get("forbidden_phrases", [])
-    for phrase in forbidden:
-        if phrase.lower() in text.lower():
-             # Basic redaction or removal
-             text = text.replace(phrase, "")
-             
-    return text
-
 def call_groq(system_prompt: str, user_message: str, rules: dict = {}) -> str:
     """
     Calls Groq API with Antigravity first-principles prompt.
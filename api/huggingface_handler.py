@@ -1,6 +1,7 @@
 import os
 import requests
 from dotenv import load_dotenv
+from api._lib.response_validator import validate_response
 
 load_dotenv()
 
@@ -9,29 +10,6 @@ api_key = os.getenv("HUGGINGFACE_API_KEY")
 # Using Mistral-7B-Instruct-v0.2 (7B params, has active Inference API)
 API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
 
-def validate_response(text: str, rules: dict) -> str:
-    """
-    Validates and cleans the response based on rules.
-    1. Truncate to max_words
-    2. Check prompt compliance (basic)
-    """
-    max_words = rules.get("max_words", 150)
-    
-    # 1. Check word count
-    words = text.split()
-    if len(words) > max_words:
-        # Hard cut
-        text = " ".join(words[:max_words]) + "..."
-        
-    # 2. Naive forbidden phrase check/strip could go here
-    forbidden = rules.get("forbidden_phrases", [])
-    for phrase in forbidden:
-        if phrase.lower() in text.lower():
-             # Basic redaction or removal
-             text = text.replace(phrase, "")
-             
-    return text
-
 def call_huggingface(system_prompt: str, user_message: str, rules: dict = {}) -> str:
     """
     Calls Hugging Face Inference API with Mixtral-8x7B.
@@ -0,0 +1,250 @@
+"""
+Async Supabase data access for the FastAPI endpoints.
+Same REST/RPC/Auth calls as database.py, but over one shared httpx.AsyncClient,
+so awaiting a query yields the event loop instead of blocking it. Independent
+queries can run side by side with gather(); max_connections caps how many
+requests are open against Supabase at once (extra calls queue for a slot).
+
+Typed helpers below cover users, transactions, global_stats and
+contact_submissions. Return contracts match database.py: rows or None on errors,
+so a Supabase outage degrades the same way in both paths.
+"""
+import asyncio
+import random
+from typing import Any, List, Optional, Tuple, TypedDict
+
+import httpx
+
+import database
+from supabase_session import (IDEMPOTENT_METHODS, RETRY_STATUSES, SUPABASE_CONNECT_TIMEOUT, SUPABASE_DEBUG,
+                              SUPABASE_POOL_SIZE, SUPABASE_READ_TIMEOUT, SUPABASE_RETRIES,
+                              SUPABASE_RETRY_BACKOFF, _RetryableStatus, supabase_headers)
+
+
+# Row types
+class UserRow(TypedDict, total=False):
+    id: str
+    email: Optional[str]
+    ip_address: Optional[str]
+    plan: str
+    msg_count: int
+    last_active_date: str
+    created_at: str
+    subscription_end_date: Optional[str]
+    gumroad_sale_id: Optional[str]
+    payment_provider: Optional[str]
+
+
+class TransactionRow(TypedDict, total=False):
+    id: str
+    user_ip: Optional[str]
+    razorpay_order_id: Optional[str]
+    razorpay_payment_id: Optional[str]
+    gumroad_sale_id: Optional[str]
+    payment_provider: Optional[str]
+    amount: int
+    status: str
+    created_at: str
+
+
+class GlobalStatsRow(TypedDict):
+    date: str
+    total_requests: int
+
+
+class ContactSubmissionRow(TypedDict, total=False):
+    id: str
+    name: str
+    email: str
+    message: str
+    ip_address: Optional[str]
+    user_agent: Optional[str]
+    submitted_at: str
+
+
+class AsyncSupabase:
+    """
+    Async counterpart of SupabaseSession: pooled keep-alive connections, per-call
+    timeouts and the same retry rules (connect failures retried for every method,
+    other errors and 429/502/503/504 only for idempotent methods).
+
+    httpx clients belong to the event loop that created them, so one client is
+    kept per running loop and rebuilt if the loop changes (tests, scripts).
+    """
+
+    def __init__(self, max_connections: int = SUPABASE_POOL_SIZE,
+                 connect_timeout: float = SUPABASE_CONNECT_TIMEOUT, read_timeout: float = SUPABASE_READ_TIMEOUT,
+                 retries: int = SUPABASE_RETRIES, backoff: float = SUPABASE_RETRY_BACKOFF, verify=True):
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=None)
+        self.retries = retries
+        self.backoff = backoff
+        self.verify = verify
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+
+    @property
+    def configured(self) -> bool:
+        url = database.SUPABASE_URL
+        return bool(url and database.SUPABASE_KEY and "your_supabase" not in url)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # The old client's connections belong to a dead loop; drop it without awaiting
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout, verify=self.verify)
+            self._loop = loop
+        return self._client
+
+    async def send(self, method: str, url: str, params=None, json=None,
+                   prefer: Optional[str] = "return=representation") -> httpx.Response:
+        """Sends one call, retrying per the class rules. Raises the last error if all attempts fail."""
+        method = method.upper()
+        headers = supabase_headers(database.SUPABASE_KEY, prefer)
+        client = self._get_client()
+        self.calls += 1
+        if SUPABASE_DEBUG:
+            print(f"Supabase Request: {method} {url}")
+
+        attempt = 0
+        while True:
+            try:
+                resp = await client.request(method, url, headers=headers, params=params, json=json)
+                if resp.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS and attempt < self.retries:
+                    raise _RetryableStatus(resp.status_code)
+                return resp
+            except (httpx.TransportError, _RetryableStatus) as e:
+                resend_safe = method in IDEMPOTENT_METHODS or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt >= self.retries or not resend_safe:
+                    self.failures += 1
+                    raise
+                self.retried += 1
+                # Full jitter, as in SupabaseSession
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                attempt += 1
+
+    async def rest(self, method: str, endpoint: str, data=None, params=None) -> Optional[Any]:
+        """Async supabase_request: parsed JSON, or None if unconfigured or the call failed."""
+        if not self.configured:
+            return None
+        try:
+            resp = await self.send(method, f"{database.SUPABASE_URL}/rest/v1/{endpoint}", params=params, json=data)
+            if resp.status_code >= 300:
+                print(f"Supabase Error: {method} {endpoint} -> {resp.status_code} {resp.text}")
+                return None
+            return resp.json()
+        except Exception as e:
+            print(f"Supabase HTTP Error: {e}")
+            return None
+
+    async def rpc(self, function: str, args: dict) -> Optional[Any]:
+        return await self.rest("POST", f"rpc/{function}", data=args)
+
+    async def auth(self, path: str, payload: dict) -> Tuple[int, dict]:
+        """POST to /auth/v1/<path>. Returns (status, body); raises on transport errors."""
+        resp = await self.send("POST", f"{database.SUPABASE_URL}/auth/v1/{path}", json=payload, prefer=None)
+        return resp.status_code, resp.json()
+
+    def stats(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "calls": self.calls,
+            "retried": self.retried,
+            "failures": self.failures,
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async_supabase = AsyncSupabase()
+
+
+async def gather(*queries):
+    """Runs independent queries concurrently; results come back in argument order."""
+    return await asyncio.gather(*queries)
+
+
+def _first(rows) -> Optional[dict]:
+    return rows[0] if rows else None
+
+
+# --- users ---------------------------------------------------------------
+
+async def get_user_by_email(email: str, columns: str = "*") -> Optional[UserRow]:
+    return _first(await async_supabase.rest("GET", "users", params={"email": f"eq.{email}", "select": columns}))
+
+
+async def get_user_by_ip(ip_address: str, columns: str = "*") -> Optional[UserRow]:
+    return _first(await async_supabase.rest("GET", "users", params={"ip_address": f"eq.{ip_address}",
+                                                                    "select": columns}))
+
+
+async def create_user(user: UserRow) -> Optional[UserRow]:
+    return _first(await async_supabase.rest("POST", "users", data=user))
+
+
+async def update_user_by_email(email: str, changes: UserRow) -> List[UserRow]:
+    return await async_supabase.rest("PATCH", "users", params={"email": f"eq.{email}"}, data=changes) or []
+
+
+async def update_user_by_ip(ip_address: str, changes: UserRow) -> List[UserRow]:
+    return await async_supabase.rest("PATCH", "users", params={"ip_address": f"eq.{ip_address}"}, data=changes) or []
+
+
+# --- transactions --------------------------------------------------------
+
+async def create_transaction(transaction: TransactionRow) -> Optional[TransactionRow]:
+    return _first(await async_supabase.rest("POST", "transactions", data=transaction))
+
+
+async def get_transactions(user_ip: str) -> List[TransactionRow]:
+    return await async_supabase.rest("GET", "transactions", params={"user_ip": f"eq.{user_ip}",
+                                                                    "order": "created_at.desc"}) or []
+
+
+async def update_transactions(column: str, value: str, changes: TransactionRow) -> List[TransactionRow]:
+    """PATCH every transaction where column equals value (razorpay_order_id, gumroad_sale_id, ...)."""
+    return await async_supabase.rest("PATCH", "transactions", params={column: f"eq.{value}"}, data=changes) or []
+
+
+# --- global_stats --------------------------------------------------------
+
+async def get_global_stats(day: Optional[str] = None) -> Optional[GlobalStatsRow]:
+    day = day or database.get_today_str()
+    return _first(await async_supabase.rest("GET", "global_stats", params={"date": f"eq.{day}"}))
+
+
+async def increment_global_stats(amount: int = 1, day: Optional[str] = None) -> Optional[int]:
+    """Atomic add through the increment_global_stats RPC; returns the new total."""
+    result = await async_supabase.rpc("increment_global_stats", {"p_date": day or database.get_today_str(),
+                                                                 "p_amount": amount})
+    return result if isinstance(result, int) else None
+
+
+# --- contact_submissions -------------------------------------------------
+
+async def save_contact_submission(name: str, email: str, message: str, ip_address: str = None,
+                                  user_agent: str = None) -> dict:
+    """Async database.save_contact_submission, same return shape."""
+    if not async_supabase.configured:
+        return {"success": False, "error": "Database not configured"}
+
+    submission: ContactSubmissionRow = {
+        "name": name,
+        "email": email,
+        "message": message,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+    }
+    row = _first(await async_supabase.rest("POST", "contact_submissions", data=submission))
+    if row:
+        return {"success": True, "id": row.get("id")}
+    return {"success": False, "error": "Failed to save submission"}
@@ -4,6 +4,7 @@ import jwt
 import os
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
+from password_hasher import HasherOverloaded, password_context, password_hasher
 from database import supabase_request, SUPABASE_URL, SUPABASE_KEY
 
 # Configuration
@@ -37,7 +38,9 @@ def generate_jwt(email: str) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
 
 # Use pbkdf2_sha256 to avoid bcrypt DLL issues on Windows/Python 3.14
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Cost comes from PASSWORD_HASH_ROUNDS. These sync helpers are for scripts;
+# endpoints must go through password_hasher (process pool) instead.
+pwd_context = password_context()
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -46,7 +49,9 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 # Endpoints
-import requests
+from async_database import async_supabase, create_user, gather, get_user_by_email, get_user_by_ip, update_user_by_email
+from session_tokens import (clear_session_cookies, new_token_version, note_token_version, read_access,
+                            read_refresh, session_user, set_access_cookie, set_session_cookies)
 # ... existing imports ...
 from database import supabase_request, SUPABASE_URL, SUPABASE_KEY
 
@@ -60,13 +65,6 @@ async def signup(user: UserSignup, request: Request, response: Response):
 
     # 1. Admin Auto-Confirm Signup (Bypass Email Rate Limit)
     # Using Service Key to Force Create User
-    auth_url = f"{SUPABASE_URL}/auth/v1/admin/users"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "email": user.email,
         "password": user.password,
@@ -75,13 +73,12 @@ async def signup(user: UserSignup, request: Request, response: Response):
     }
     
     try:
-        # Note: requests.post is blocking, but fast enough for this MVP step
-        auth_res = requests.post(auth_url, headers=headers, json=payload)
-        auth_data = auth_res.json()
+        status, auth_data = await async_supabase.auth("admin/users", payload)
         
-        if auth_res.status_code >= 400:
+        if status >= 400:
             msg = auth_data.get("msg") or auth_data.get("error_description") or "Signup failed"
-            if "already registered" in str(msg):
+            # GoTrue: "A user with this email address has already been registered"
+            if "already been registered" in str(msg) or "already registered" in str(msg):
                 raise HTTPException(status_code=400, detail="User already exists")
             raise Exception(msg)
             
@@ -97,7 +94,7 @@ async def signup(user: UserSignup, request: Request, response: Response):
                 "created_at": datetime.utcnow().isoformat(),
                 "plan": "free" 
             }
-            db_res = supabase_request("POST", "users", data=new_user)
+            await create_user(new_user)
 
     except HTTPException as he:
         raise he
@@ -105,20 +102,10 @@ async def signup(user: UserSignup, request: Request, response: Response):
         print(f"Signup Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-    # 3. Auto-Login: Generate Session
-    token = generate_jwt(user.email)
-    
-    # 4. Set Cookie
-    response.set_cookie(
-        key="auth_token",
-        value=token,
-        httponly=True,
-        max_age=JWT_EXPIRATION_DAYS * 24 * 60 * 60,
-        samesite="lax",
-        secure=False
-    )
-
-    # 5. Return Success (With Token, No Verification Required)
+    # 3. Auto-Login: access + refresh cookies
+    token = set_session_cookies(response, {"email": user.email, "plan": "free"})
+
+    # 4. Return Success (With Token, No Verification Required)
     return {
         "user": {"email": user.email, "plan": "free"},
         "token": token,
@@ -128,20 +115,17 @@ async def signup(user: UserSignup, request: Request, response: Response):
 @router.post("/login")
 async def login(user: UserLogin, response: Response):
     # 1. Native Supabase Login
-    auth_url = f"{SUPABASE_URL}/auth/v1/token?grant_type=password"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {"email": user.email, "password": user.password}
     
     try:
-        auth_res = requests.post(auth_url, headers=headers, json=payload)
-        auth_data = auth_res.json()
+        # Password check and plan lookup don't depend on each other: run both at once.
+        # The plan is only returned once the password check passed.
+        (status, auth_data), db_user = await gather(
+            async_supabase.auth("token?grant_type=password", payload),
+            get_user_by_email(user.email),
+        )
         
-        if auth_res.status_code >= 400:
+        if status >= 400:
              msg = auth_data.get("error_description") or "Invalid credentials"
              raise HTTPException(status_code=400, detail=msg)
              
@@ -153,22 +137,25 @@ async def login(user: UserLogin, response: Response):
         print(f"Login Error: {e}")
         raise HTTPException(status_code=500, detail="Login failed")
 
-    # 2. Get User Plan from DB
-    users = supabase_request("GET", "users", params={"email": f"eq.{user.email}"})
-    db_user = users[0] if users and len(users) > 0 else {"email": user.email, "plan": "free"}
-
-    # 3. Generate Session
-    token = generate_jwt(user.email)
-
-    # 4. Set Cookie
-    response.set_cookie(
-        key="auth_token",
-        value=token,
-        httponly=True,
-        max_age=JWT_EXPIRATION_DAYS * 24 * 60 * 60,
-        samesite="lax",
-        secure=False 
-    )
+    # 2. User Plan from DB (fetched above)
+    db_user = db_user or {"email": user.email, "plan": "free"}
+
+    # Legacy local password_hash: re-hash at the current cost when it changed.
+    # needs_update is a cheap parse; the PBKDF2 work itself runs in the hashing pool.
+    # Hashes in other formats are left as they are: Supabase already checked the password.
+    stored_hash = db_user.get("password_hash")
+    if stored_hash and password_hasher.needs_update(stored_hash):
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(user.password, stored_hash)
+            if valid and new_hash:
+                await update_user_by_email(user.email, {"password_hash": new_hash})
+        except HasherOverloaded:
+            pass  # Not needed for this login; retried on the next one
+        except ValueError as e:
+            print(f"Password Rehash Skipped: {e}")
+
+    # 3. Session: the access token carries plan, expiry and token_version
+    token = set_session_cookies(response, db_user)
 
     return {
         "user": {
@@ -179,50 +166,69 @@ async def login(user: UserLogin, response: Response):
     }
 
 @router.post("/logout")
-async def logout(response: Response):
-    response.delete_cookie("auth_token")
+async def logout(request: Request, response: Response):
+    # Revokes both tokens: a copied cookie stops working now, not at exp
+    clear_session_cookies(request, response)
     return {"message": "Logged out"}
 
-@router.get("/me")
-async def get_current_user(request: Request):
-    token = request.cookies.get("auth_token")
-    if not token:
+async def refresh_session(request: Request, response: Response):
+    """New access token from the current users row. None if there is no usable session."""
+    claims = read_access(request) or read_refresh(request)
+    if not claims:
         return None
-    
+    user = await get_user_by_email(claims["email"])
+    if not user:
+        return None
+    set_access_cookie(response, user)
+    if not read_refresh(request):
+        # Cookie from before refresh tokens existed: move it onto the new scheme
+        set_session_cookies(response, user)
+    return {"email": user["email"], "plan": user.get("plan") or "free",
+            "subscription_end_date": user.get("subscription_end_date")}
+
+@router.get("/me")
+async def get_current_user(request: Request, response: Response):
+    # Common case: a current access token already says everything; no DB read
+    claims = read_access(request)
+    if claims and "plan" in claims:
+        return session_user(claims)
+
+    # Expired, stale (plan changed) or legacy token: rebuild it from the DB
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        email = payload.get("email")
-        
-        # Get fresh data from DB
-        users = supabase_request("GET", "users", params={"email": f"eq.{email}"})
-        if users and len(users) > 0:
-            user = users[0]
-            return {"email": user["email"], "plan": user.get("plan", "free")}
-    except:
+        return await refresh_session(request, response)
+    except Exception as e:
+        print(f"Session Refresh Error: {e}")
         return None
-        
-    return None
 
-@router.post("/migrate-premium")
-async def migrate_premium(migration: MigrationRequest, request: Request):
-    token = request.cookies.get("auth_token")
-    if not token:
+@router.post("/refresh")
+async def refresh(request: Request, response: Response):
+    user = await refresh_session(request, response)
+    if not user:
         raise HTTPException(status_code=401, detail="Not logged in")
-        
+    return {"user": user}
+
+@router.post("/migrate-premium")
+async def migrate_premium(migration: MigrationRequest, request: Request, response: Response):
     # Verify current user matches request
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    payload = read_access(request) or read_refresh(request)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Not logged in")
     if payload["email"] != migration.email:
         raise HTTPException(status_code=403, detail="User mismatch")
 
     ip_address = request.client.host
     
     # 1. Verify IP has premium
-    ip_users = supabase_request("GET", "users", params={"ip_address": f"eq.{ip_address}", "select": "plan"})
-    if not ip_users or len(ip_users) == 0 or ip_users[0]["plan"] != "pro":
+    ip_user = await get_user_by_ip(ip_address, columns="plan")
+    if not ip_user or ip_user["plan"] != "pro":
         raise HTTPException(status_code=400, detail="No premium status found on this IP")
         
     # 2. Transfer Premium
-    # PATCH /users?email=eq.email
-    supabase_request("PATCH", "users", params={"email": f"eq.{migration.email}"}, data={"plan": "pro"})
+    # PATCH /users?email=eq.email; the new token_version retires access tokens that still say "free"
+    version = new_token_version()
+    updated = await update_user_by_email(migration.email, {"plan": "pro", "token_version": version})
+    note_token_version(migration.email, version)
+    set_access_cookie(response, updated[0] if updated else {"email": migration.email, "plan": "pro",
+                                                             "token_version": version})
     
     return {"success": True, "message": "Premium transferred"}
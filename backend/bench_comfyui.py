@@ -0,0 +1,85 @@
+"""
+ComfyUI client benchmark against the local stand-in (mock_comfyui.py).
+Sends `prompts` concurrent chats two ways:
+- poll: the old loop, one thread per request, POST /prompt then
+  time.sleep(1) + GET /history until the result shows up
+- events: ComfyUIClient, all prompts over one websocket
+
+ComfyUI runs one prompt at a time; each run takes RUN_TIME seconds.
+
+Usage: python bench_comfyui.py [prompts]
+"""
+import asyncio
+import contextlib
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from comfyui_handler import OUTPUT_NODE, ComfyUIClient, build_prompt
+from mock_comfyui import MockComfyUI
+
+RUN_TIME = 0.05
+
+
+def poll_chat(server, message: str) -> tuple:
+    """The pre-websocket chat_with_comfyui loop. Returns (latency, requests)."""
+    started = time.perf_counter()
+    resp = requests.post(f"{server.url}/prompt", json={"prompt": build_prompt(message), "client_id": "poll"})
+    prompt_id = resp.json()["prompt_id"]
+    calls = 1
+    for _ in range(20):
+        time.sleep(1)
+        calls += 1
+        history = requests.get(f"{server.url}/history/{prompt_id}").json()
+        if prompt_id in history and OUTPUT_NODE in history[prompt_id]["outputs"]:
+            break
+    return time.perf_counter() - started, calls
+
+
+async def event_chats(server, prompts: int) -> list:
+    client = ComfyUIClient(address=server.address)
+
+    async def one(i):
+        started = time.perf_counter()
+        await client.chat(f"question {i}")
+        return time.perf_counter() - started
+
+    try:
+        await client.chat("warm-up")  # opens the websocket
+        return await asyncio.gather(*(one(i) for i in range(prompts)))
+    finally:
+        await client.aclose()
+
+
+def report(name, latencies, elapsed, calls):
+    latencies = sorted(latencies)
+    print(f"{name:<8}{elapsed:>10.2f}{statistics.mean(latencies):>10.3f}"
+          f"{latencies[len(latencies) // 2]:>10.3f}{latencies[-1]:>10.3f}{calls:>10}")
+
+
+def main(prompts: int):
+    print(f"{prompts} concurrent prompts, {RUN_TIME * 1000:.0f} ms per run, one run at a time\n")
+    print(f"{'mode':<8}{'total s':>10}{'mean s':>10}{'p50 s':>10}{'max s':>10}{'HTTP reqs':>10}")
+
+    server = MockComfyUI(run_time=RUN_TIME).start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=prompts) as pool:
+        results = list(pool.map(lambda i: poll_chat(server, f"question {i}"), range(prompts)))
+    report("poll", [r[0] for r in results], time.perf_counter() - started, sum(r[1] for r in results))
+    server.stop()
+
+    server = MockComfyUI(run_time=RUN_TIME).start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = asyncio.run(event_chats(server, prompts))
+    report("events", latencies, time.perf_counter() - started, server.round_trips())
+    print(f"\nwebsocket connections: {server.ws_connections}, messages: {server.ws_messages}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,57 @@
+"""
+Offline IP -> country lookup cost against a synthetic table the size of the
+public country dumps (~500k IPv4 and ~300k IPv6 ranges).
+For comparison, the ipapi.co call it replaces takes tens to hundreds of ms per
+lookup (2 s timeout) and is capped at 1,000 requests a day.
+
+Usage: python bench_ip_country.py [lookups]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from ip_country_db import IPCountryDB, build
+
+V4_RANGES = 500_000
+V6_RANGES = 300_000
+COUNTRIES = ["IN", "US", "GB", "DE", "BR", "JP", "FR", "CA", "AU", "SG"]
+
+
+def synthetic_rows(rng):
+    step = (1 << 32) // V4_RANGES
+    for i in range(V4_RANGES):
+        yield i * step, i * step + step // 2, False, rng.choice(COUNTRIES)
+    base, step = 0x2000 << 112, 1 << 96
+    for i in range(V6_RANGES):
+        yield base + i * step, base + i * step + step // 2, True, rng.choice(COUNTRIES)
+
+
+def main(n: int):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ip_country.bin")
+        start = time.perf_counter()
+        build(synthetic_rows(rng), path)
+        print(f"built {V4_RANGES} IPv4 + {V6_RANGES} IPv6 ranges in {time.perf_counter() - start:.1f}s, "
+              f"{os.path.getsize(path) / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        db = IPCountryDB(path)
+        print(f"open (mmap): {(time.perf_counter() - start) * 1e3:.2f} ms\n")
+
+        v4 = [".".join(str(rng.randrange(256)) for _ in range(4)) for _ in range(n)]
+        # Synthetic IPv6 ranges are /32s from 2000:: to 2004:93df::
+        v6 = [f"200{rng.randrange(4)}:{rng.randrange(16 ** 4):x}:{rng.randrange(16 ** 4):x}::1" for _ in range(n)]
+        print(f"{'family':>6} | {'us/lookup':>9} | {'found':>6}")
+        print("-" * 28)
+        for family, ips in (("IPv4", v4), ("IPv6", v6)):
+            start = time.perf_counter()
+            found = sum(1 for ip in ips if db.lookup(ip))
+            print(f"{family:>6} | {(time.perf_counter() - start) / n * 1e6:>9.2f} | {found / n:>6.0%}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,76 @@
+"""
+Quota check benchmark against the local Supabase stand-in.
+Compares the old REST chain (check_can_chat_rest), the one-call RPC
+(check_can_chat) and the in-process quota cache in front of it, for latency,
+round trips and over-admission under concurrency.
+
+Usage: python bench_quota.py [rtt_ms]
+"""
+import contextlib
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from mock_supabase import MockSupabase
+from quota_cache import QuotaCache
+
+SEQUENTIAL = 80
+USERS = 10
+# Time between chats, so the write-behind flusher gets to run as in production
+THINK_TIME = 0.005
+CONCURRENT_CALLS = 60
+WORKERS = 20
+
+
+def cached_check():
+    cache = QuotaCache(load=database.check_can_chat, flush=database.apply_quota_increments, flush_interval=0.02)
+    cache.start()
+    return cache.check, cache.stop
+
+
+def run(variant, rtt: float):
+    server = MockSupabase(latency=rtt).start()
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "bench-key"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            check, done = variant()
+            timings = []
+            for i in range(SEQUENTIAL):
+                start = time.perf_counter()
+                check(f"10.0.0.{i % USERS}")
+                timings.append((time.perf_counter() - start) * 1000)
+                time.sleep(THINK_TIME)
+            done()
+            trips = server.round_trips() / SEQUENTIAL
+            check, done = variant()
+
+            # Same new user from many workers at once: only DAILY_FREE_LIMIT may pass
+            with ThreadPoolExecutor(WORKERS) as pool:
+                results = list(pool.map(check, ["203.0.113.7"] * CONCURRENT_CALLS))
+            done()
+        admitted = sum(1 for r in results if r.get("allowed"))
+        duplicates = sum(1 for u in server.tables["users"] if u.get("ip_address") == "203.0.113.7")
+    finally:
+        server.stop()
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1], trips, admitted, duplicates
+
+
+def main(rtt_ms: float):
+    print(f"Simulated round trip: {rtt_ms:.0f} ms, daily limit {database.DAILY_FREE_LIMIT}\n")
+    print(f"{'variant':>10} | {'p50 ms':>7} | {'p95 ms':>7} | {'trips/chk':>9} | {'admitted':>8} | {'user rows':>9}")
+    print("-" * 66)
+    variants = (
+        ("rest", lambda: (database.check_can_chat_rest, lambda: None)),
+        ("rpc", lambda: (database.check_can_chat, lambda: None)),
+        ("cache+rpc", cached_check),
+    )
+    for name, variant in variants:
+        p50, p95, trips, admitted, duplicates = run(variant, rtt_ms / 1000)
+        print(f"{name:>10} | {p50:>7.1f} | {p95:>7.1f} | {trips:>9.1f} | {admitted:>8} | {duplicates:>9}")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,84 @@
+"""
+Reconciliation benchmark against local Gumroad, Razorpay and Supabase stand-ins.
+Seeds `sales` Gumroad sales (10 per page, as the real API returns them), a
+quarter as many Razorpay payments, one user per buyer and a transaction for
+most purchases, with ~10% of plans and statuses wrong. Then runs a dry run and
+an applying run, and checks a second pass finds nothing left to fix.
+
+Usage: python bench_reconcile.py [sales]
+"""
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import database
+import gumroad_handler
+import payments
+import reconcile
+from mock_gumroad import MockGumroad
+from mock_razorpay import MockRazorpay
+from mock_supabase import MockSupabase
+
+RTT = 0.005
+CONCURRENCY = 32
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed(gumroad, razorpay, supabase, sales: int):
+    for i in range(sales):
+        refunded = i % 20 == 0
+        gumroad.add_sale(f"sale_{i}", f"g{i}@example.com", refunded=refunded,
+                         created_at=(START + timedelta(minutes=7 * i)).isoformat())
+        wrong = i % 10 == 3
+        supabase.insert("users", {"email": f"g{i}@example.com", "payment_provider": "gumroad",
+                                  "gumroad_sale_id": f"sale_{i}",
+                                  "plan": "pro" if refunded or not wrong else "free"})
+        if i % 10 != 7:
+            supabase.insert("transactions", {"gumroad_sale_id": f"sale_{i}", "status": "paid"})
+    for i in range(sales // 4):
+        razorpay.add_payment(f"pay_{i}", f"r{i}@example.com", order_id=f"order_{i}",
+                             created_at=int((START + timedelta(minutes=29 * i)).timestamp()))
+        supabase.insert("users", {"email": f"r{i}@example.com", "payment_provider": "razorpay",
+                                  "plan": "free" if i % 10 == 3 else "pro"})
+        supabase.insert("transactions", {"razorpay_order_id": f"order_{i}", "status": "created"})
+
+
+def run(**kwargs):
+    return asyncio.run(reconcile.reconcile(**kwargs))
+
+
+def main(sales: int):
+    gumroad = MockGumroad(latency=RTT).start()
+    razorpay = MockRazorpay(latency=RTT).start()
+    supabase = MockSupabase(latency=RTT).start()
+    gumroad_handler.GUMROAD_API_URL = f"{gumroad.url}/v2"
+    gumroad_handler.GUMROAD_ACCESS_TOKEN = gumroad.access_token
+    reconcile.RAZORPAY_API_URL = f"{razorpay.url}/v1"
+    payments.KEY_ID, payments.KEY_SECRET = razorpay.key_id, razorpay.key_secret
+    database.SUPABASE_URL, database.SUPABASE_KEY = supabase.url, "bench-key"
+    seed(gumroad, razorpay, supabase, sales)
+    print(f"{sales} Gumroad sales, {sales // 4} Razorpay payments, {RTT * 1000:.0f} ms per request, "
+          f"concurrency {CONCURRENCY}\n")
+
+    print(f"{'run':<10}{'total s':>10}{'fetch s':>10}{'diff s':>10}{'apply s':>10}{'API reqs':>10}{'writes':>10}"
+          f"{'upgrades':>10}{'downgr.':>10}{'txn fix':>10}")
+    until = START + timedelta(days=3000)
+    for name, write in (("dry run", False), ("apply", True), ("re-run", True)):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run(since=START, until=until, write=write, concurrency=CONCURRENCY)
+        elapsed = time.perf_counter() - started
+        fixes = sum(summary.get(k, 0) for k in ("transactions_missing", "transactions_linked", "transactions_status"))
+        print(f"{name:<10}{elapsed:>10.1f}{summary['fetch_s']:>10.1f}{summary['diff_s']:>10.2f}"
+              f"{summary['apply_s']:>10.1f}{sum(summary['api_requests'].values()):>10}{summary['write_requests']:>10}"
+              f"{summary.get('users_upgraded', 0):>10}{summary.get('users_downgraded', 0):>10}{fixes:>10}")
+
+    for server in (gumroad, razorpay, supabase):
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,54 @@
+"""
+Semantic cache scaling benchmark.
+Grows one persona index to 1M entries and reports lookup latency and index memory.
+
+Usage: python bench_semantic_cache.py [max_entries]
+"""
+import sys
+import time
+
+import numpy as np
+
+from semantic_cache import SEMANTIC_CACHE_DIM, VectorIndex, embed
+
+CHECKPOINTS = [10_000, 100_000, 250_000, 500_000, 1_000_000]
+LOOKUPS = 50
+BATCH = 50_000
+
+
+def random_unit_vectors(rng, n, dim):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def main(max_entries: int):
+    rng = np.random.default_rng(42)
+    index = VectorIndex(dim=SEMANTIC_CACHE_DIM, max_entries=max_entries)
+    probes = [embed(q) for q in ("should I add AI to my MVP", "how do I find a cofounder", "is my idea good")]
+
+    start = time.perf_counter()
+    samples = [embed(f"question number {i} about startups") for i in range(2_000)]
+    embed_us = (time.perf_counter() - start) / len(samples) * 1e6
+    print(f"embed(): {embed_us:.1f} us/question (dim={SEMANTIC_CACHE_DIM})\n")
+
+    print(f"{'entries':>10} | {'p50 ms':>8} | {'p95 ms':>8} | {'index MB':>9}")
+    print("-" * 46)
+    for target in [c for c in CHECKPOINTS if c <= max_entries]:
+        while index.count < target:
+            n = min(BATCH, target - index.count)
+            index.add_batch(random_unit_vectors(rng, n, SEMANTIC_CACHE_DIM), ["cached answer"] * n, np.full(n, 1e12))
+
+        timings = []
+        for i in range(LOOKUPS):
+            t = time.perf_counter()
+            index.search(probes[i % len(probes)], now=0)
+            timings.append((time.perf_counter() - t) * 1000)
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{index.count:>10,} | {p50:>8.2f} | {p95:>8.2f} | {index.memory_bytes() / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else CHECKPOINTS[-1])
@@ -0,0 +1,79 @@
+"""
+Supabase HTTP client benchmark: a fresh requests call per request (the old
+supabase_request) vs the pooled keep-alive SupabaseSession.
+Runs against the local Supabase stand-in over real TLS (self-signed cert made
+with the openssl CLI), with simulated network delay per request and per handshake.
+
+Usage: python bench_supabase_http.py [rtt_ms]
+"""
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_supabase import MockSupabase
+from supabase_session import SupabaseSession, supabase_headers
+
+CALLS = 100
+WORKERS = 8
+
+
+def make_cert(directory: str):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+def timed(call, n, workers):
+    timings = []
+
+    def one(i):
+        start = time.perf_counter()
+        call(i)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(one, range(n)))
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+
+def main(rtt_ms: float):
+    rtt = rtt_ms / 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_cert(tmp)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        # TCP handshake + TLS 1.3 handshake: two extra round trips on a new connection
+        server = MockSupabase(latency=rtt, handshake_latency=2 * rtt).start(ssl_context=context)
+        url = f"{server.url}/rest/v1/users"
+        headers = supabase_headers("bench-key")
+
+        def fresh(i):
+            requests.get(url, headers=headers, params={"id": f"eq.{i}"}, verify=cert, timeout=10).json()
+
+        pooled_session = SupabaseSession(pool_size=WORKERS, verify=cert)
+
+        def pooled(i):
+            pooled_session.request("GET", url, "bench-key", params={"id": f"eq.{i}"}).json()
+
+        print(f"{CALLS} GETs over TLS, {WORKERS} threads, {rtt_ms:.0f} ms simulated RTT\n")
+        print(f"{'client':>8} | {'p50 ms':>7} | {'p95 ms':>7} | {'handshakes':>10}")
+        print("-" * 44)
+        for name, call in (("fresh", fresh), ("pooled", pooled)):
+            before = server.connections
+            p50, p95 = timed(call, CALLS, WORKERS)
+            print(f"{name:>8} | {p50:>7.1f} | {p95:>7.1f} | {server.connections - before:>10}")
+        pooled_session.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 20)
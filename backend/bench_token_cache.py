@@ -0,0 +1,60 @@
+"""
+Per-request auth cost in get_user_identifier: jwt.decode on every request (old)
+vs the verified-token cache (decode once per token, then a digest lookup).
+Requests cycle over a pool of logged-in users, like /chat traffic.
+
+Usage: python bench_token_cache.py [requests]
+"""
+import sys
+import time
+from types import SimpleNamespace
+
+import jwt
+
+from middleware.auth_middleware import JWT_ALGORITHM, SECRET_KEY, VerifiedTokenCache
+
+USERS = 200
+
+
+def decode_every_time(request):
+    token = request.cookies.get("auth_token")
+    if token:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            return payload.get("email", request.client.host)
+        except Exception:
+            pass
+    return request.client.host
+
+
+def cached(cache):
+    def identify(request):
+        token = request.cookies.get("auth_token")
+        if token:
+            payload = cache.decode(token)
+            if payload:
+                return payload.get("email", request.client.host)
+        return request.client.host
+    return identify
+
+
+def main(n: int):
+    exp = time.time() + 3600
+    requests = [SimpleNamespace(cookies={"auth_token": jwt.encode({"email": f"user{i}@example.com", "exp": exp},
+                                                                  SECRET_KEY, algorithm=JWT_ALGORITHM)},
+                                client=SimpleNamespace(host="1.2.3.4"))
+                for i in range(USERS)]
+    cache = VerifiedTokenCache()
+    print(f"{n} requests over {USERS} distinct tokens\n")
+    print(f"{'variant':>10} | {'us/request':>10}")
+    print("-" * 25)
+    for name, identify in (("decode", decode_every_time), ("cached", cached(cache))):
+        start = time.perf_counter()
+        for i in range(n):
+            identify(requests[i % USERS])
+        print(f"{name:>10} | {(time.perf_counter() - start) / n * 1e6:>10.2f}")
+    print(f"\ncache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,70 @@
+"""
+Response validator microbenchmark.
+Compares the old per-phrase loop (lowercase the whole text once per phrase, then
+str.replace) with the shared single-regex validator, on growing phrase lists.
+
+Usage: python bench_validator.py [repeats]
+"""
+import random
+import sys
+import time
+
+from response_validator import validate_response
+
+PHRASE_COUNTS = [10, 100, 1000]
+TEXT_WORDS = 150
+
+
+def legacy_validate_response(text: str, rules: dict) -> str:
+    """The copy every handler used to carry."""
+    max_words = rules.get("max_words", 150)
+    words = text.split()
+    if len(words) > max_words:
+        text = " ".join(words[:max_words]) + "..."
+    for phrase in rules.get("forbidden_phrases", []):
+        if phrase.lower() in text.lower():
+            text = text.replace(phrase, "")
+    return text
+
+
+def make_phrases(rng, n):
+    vocab = ["synergy", "as an AI", "delve", "leverage", "paradigm", "honestly", "great question",
+             "circle back", "at the end of the day", "move the needle", "deep dive", "low hanging fruit"]
+    return [f"{rng.choice(vocab)} {i}" for i in range(n)]
+
+
+def make_text(rng, phrases):
+    words = ["ship", "the", "product", "cost", "per", "unit", "is", "what", "matters", "now"]
+    parts = [rng.choice(words) for _ in range(TEXT_WORDS)]
+    # A few real hits, in mixed case, so both versions do some work
+    for phrase in rng.sample(phrases, min(3, len(phrases))):
+        parts.insert(rng.randrange(len(parts)), phrase.upper())
+    return " ".join(parts)
+
+
+def time_us(fn, text, rules, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(text, rules)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main(repeats: int):
+    rng = random.Random(7)
+    print(f"{'phrases':>8} | {'legacy us':>10} | {'shared us':>10} | {'speedup':>8} | {'legacy misses':>13}")
+    print("-" * 62)
+    for n in PHRASE_COUNTS:
+        phrases = make_phrases(rng, n)
+        rules = {"max_words": TEXT_WORDS * 2, "forbidden_phrases": phrases}
+        text = make_text(rng, phrases)
+        validate_response(text, rules)  # compile once, as in production
+
+        legacy = time_us(legacy_validate_response, text, rules, repeats)
+        shared = time_us(validate_response, text, rules, repeats)
+        # Mixed-case hits the old loop detected but failed to remove
+        missed = sum(1 for p in phrases if p.lower() in legacy_validate_response(text, rules).lower())
+        print(f"{n:>8} | {legacy:>10.1f} | {shared:>10.1f} | {legacy / shared:>7.1f}x | {missed:>13}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
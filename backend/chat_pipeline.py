@@ -0,0 +1,224 @@
+"""
+Async chat pipeline.
+Keeps LLM calls off the event loop and bounds how many chats one worker runs at once.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from metrics import metrics
+from response_cache import ResponseCache, response_cache
+from semantic_cache import SemanticCache, semantic_cache
+from single_flight import SingleFlight, chat_flight
+from response_validator import StreamGuard
+from token_budget import BASELINE_MAX_TOKENS, estimate_tokens, record_generation
+
+# Config
+MAX_CONCURRENT_CHATS = int(os.getenv("MAX_CONCURRENT_CHATS", "256"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "15"))
+
+# An async provider takes (system_prompt, user_message, rules) and returns the reply text.
+AsyncProvider = Callable[[str, str, dict], Awaitable[str]]
+# A stream provider takes (system_prompt, user_message) and yields text deltas.
+StreamProvider = Callable[[str, str], AsyncIterator[str]]
+
+
+class ChatOverloaded(Exception):
+    """Raised when a chat waited longer than the queue timeout for a free slot."""
+
+
+class ChatLimiter:
+    """
+    Bounded concurrency limiter for upstream LLM calls.
+    Up to max_concurrent chats run at once, the rest wait up to queue_timeout seconds.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_CHATS, queue_timeout: float = CHAT_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ChatOverloaded(f"No free chat slot after {self.queue_timeout}s")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+# Shared limiter for the whole worker
+chat_limiter = ChatLimiter()
+
+
+def to_async(func: Callable) -> Callable[..., Awaitable]:
+    """Wraps a blocking function so it runs on a worker thread instead of the event loop."""
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    wrapper.__name__ = getattr(func, "__name__", "wrapped")
+    return wrapper
+
+
+async def run_chat(provider: AsyncProvider, system_prompt: str, user_message: str,
+                   rules: Optional[dict] = None, limiter: Optional[ChatLimiter] = None) -> str:
+    """
+    Runs one chat completion through the concurrency limiter.
+    Raises ChatOverloaded if no slot frees up in time.
+    """
+    limiter = limiter or chat_limiter
+    start = time.perf_counter()
+    async with limiter:
+        response_text = await provider(system_prompt, user_message, rules or {})
+    metrics.observe("chat_total_ms", (time.perf_counter() - start) * 1000)
+    return response_text
+
+
+def is_error_reply(text: str) -> bool:
+    """Provider handlers report failures as "Error ..." strings; those must never be cached."""
+    return not text or text.startswith("Error")
+
+
+async def generate_reply(provider: AsyncProvider, system_prompt: str, user_message: str,
+                         rules: Optional[dict] = None, cache_key: Optional[str] = None,
+                         cache: Optional[ResponseCache] = None, limiter: Optional[ChatLimiter] = None,
+                         semantic_namespace: Optional[str] = None,
+                         semantic: Optional[SemanticCache] = None,
+                         flight: Optional[SingleFlight] = None) -> str:
+    """
+    Cache-aware chat completion.
+    Tries the exact-match cache, then the near-duplicate cache, then the provider.
+    Identical concurrent misses (same cache_key) share one provider call.
+    A hit skips the provider call entirely; quota is charged by the caller either way.
+    """
+    cache = cache if cache is not None else response_cache
+    semantic = semantic if semantic is not None else semantic_cache
+    flight = flight if flight is not None else chat_flight
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if semantic_namespace:
+        # Brute-force scan releases the GIL in NumPy, so keep it off the event loop
+        similar = await asyncio.to_thread(semantic.lookup, semantic_namespace, user_message)
+        if similar is not None:
+            if cache_key:
+                cache.put(cache_key, similar)
+            return similar
+
+    async def fetch():
+        response_text = await run_chat(provider, system_prompt, user_message, rules, limiter=limiter)
+        if not is_error_reply(response_text):
+            if cache_key:
+                cache.put(cache_key, response_text)
+            if semantic_namespace:
+                semantic.insert(semantic_namespace, user_message, response_text)
+        return response_text
+
+    if not cache_key:
+        return await fetch()
+    return await flight.do(cache_key, fetch)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_chat(stream_provider: StreamProvider, system_prompt: str, user_message: str,
+                      rules: Optional[dict] = None, limiter: Optional[ChatLimiter] = None,
+                      on_complete: Optional[Callable[[str], None]] = None) -> AsyncIterator[str]:
+    """
+    Streams a chat completion as SSE events ("token", then "done" or "error").
+    Persona rules are enforced incrementally and the upstream generation is
+    cancelled as soon as the word cap is hit; the tokens that saved are recorded
+    against rules["max_tokens"].
+    on_complete receives the full emitted text when the stream finishes cleanly.
+    """
+    limiter = limiter or chat_limiter
+    rules = rules or {}
+    guard = StreamGuard(rules)
+    start = time.perf_counter()
+    ttft_ms = None
+    emitted = []
+    # Raw upstream text, before stripping, to estimate tokens generated
+    generated = []
+
+    try:
+        async with limiter:
+            upstream = stream_provider(system_prompt, user_message)
+            try:
+                async for delta in upstream:
+                    generated.append(delta)
+                    text = guard.feed(delta)
+                    if text:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - start) * 1000
+                            metrics.observe("chat_ttft_ms", ttft_ms)
+                        emitted.append(text)
+                        yield sse_event("token", {"text": text})
+                    if guard.done:
+                        metrics.incr("chat_stream_capped")
+                        break
+            finally:
+                # Cancels the upstream generation when we stop early
+                await upstream.aclose()
+    except ChatOverloaded as e:
+        metrics.incr("chat_stream_errors")
+        yield sse_event("error", {"detail": str(e)})
+        return
+    except Exception as e:
+        metrics.incr("chat_stream_errors")
+        yield sse_event("error", {"detail": f"Error streaming response: {str(e)}"})
+        return
+
+    tail = guard.flush()
+    if tail:
+        if ttft_ms is None:
+            ttft_ms = (time.perf_counter() - start) * 1000
+            metrics.observe("chat_ttft_ms", ttft_ms)
+        emitted.append(tail)
+        yield sse_event("token", {"text": tail})
+
+    full_text = "".join(emitted)
+    if on_complete and not is_error_reply(full_text):
+        on_complete(full_text)
+
+    total_ms = (time.perf_counter() - start) * 1000
+    metrics.observe("chat_stream_total_ms", total_ms)
+    tokens_saved = record_generation(rules.get("max_tokens", BASELINE_MAX_TOKENS), estimate_tokens("".join(generated)),
+                                     stopped_early=guard.done, elapsed_ms=total_ms - (ttft_ms or 0))
+    yield sse_event("done", {"words": guard.words, "capped": guard.done, "ttft_ms": ttft_ms, "total_ms": total_ms,
+                             "tokens_saved": tokens_saved})
+
+
+async def replay_cached(text: str) -> AsyncIterator[str]:
+    """Serves a cached reply over SSE in the same event shape as stream_chat."""
+    metrics.observe("chat_ttft_ms", 0.0)
+    yield sse_event("token", {"text": text})
+    yield sse_event("done", {"words": len(text.split()), "capped": False, "ttft_ms": 0.0, "total_ms": 0.0, "cached": True})
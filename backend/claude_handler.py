@@ -1,43 +1,25 @@
 import os
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 from dotenv import load_dotenv
+from response_validator import validate_response
 
 load_dotenv()
 
-# Configure Anthropic Client
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+
+# Configure Anthropic Clients (sync for scripts, async for the FastAPI chat path)
 client = None
+async_client = None
 api_key = os.getenv("ANTHROPIC_API_KEY")
 
 if api_key:
     client = Anthropic(api_key=api_key)
+    async_client = AsyncAnthropic(api_key=api_key)
 
-def validate_response(text: str, rules: dict) -> str:
-    """
-    Validates and cleans the response based on rules.
-    """
-    max_words = rules.get("max_words", 150)
-    
-    words = text.split()
-    if len(words) > max_words:
-        text = " ".join(words[:max_words]) + "..."
-        
-    forbidden = rules.get("forbidden_phrases", [])
-    for phrase in forbidden:
-        if phrase.lower() in text.lower():
-             text = text.replace(phrase, "")
-             
-    return text
-
-def call_claude(system_prompt: str, user_message: str, rules: dict = {}) -> str:
-    """
-    Calls Anthropic Claude 3.5 Sonnet with persona-enforced prompt.
-    """
-    if not client:
-        return "Error: ANTHROPIC_API_KEY not set in .env"
-
-    try:
-        # Refined engineering-driven prompt
-        enforced_user_message = f"""You respond using a first-principles, engineering-driven way of thinking.
+def build_user_message(user_message: str) -> str:
+    """Wraps the user question in the engineering-driven instruction prompt."""
+    # Refined engineering-driven prompt
+    return f"""You respond using a first-principles, engineering-driven way of thinking.
 
 How to think:
 - Reduce the question to fundamentals: physics, math, incentives, constraints.
@@ -70,12 +52,22 @@ End with a clear conclusion or action. Then stop.
 Question: {user_message}
 
 Response:"""
+
+def call_claude(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Calls Anthropic Claude 3.5 Sonnet with persona-enforced prompt.
+    """
+    if not client:
+        return "Error: ANTHROPIC_API_KEY not set in .env"
+
+    try:
+        enforced_user_message = build_user_message(user_message)
         
-        print(f"[DEBUG] Using model: claude-3-5-sonnet-20241022")
+        print(f"[DEBUG] Using model: {CLAUDE_MODEL}")
         print(f"[DEBUG] User question: {user_message}")
         
         message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
+            model=CLAUDE_MODEL,
             max_tokens=250,
             temperature=0.4,
             messages=[
@@ -95,3 +87,29 @@ Response:"""
 
     except Exception as e:
         return f"Error calling Claude: {str(e)}"
+
+async def call_claude_async(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Async version of call_claude for the /chat handler.
+    """
+    if not async_client:
+        return "Error: ANTHROPIC_API_KEY not set in .env"
+
+    try:
+        message = await async_client.messages.create(
+            model=CLAUDE_MODEL,
+            max_tokens=min(250, rules.get("max_tokens", 250)),
+            temperature=0.4,
+            messages=[
+                {"role": "user", "content": build_user_message(user_message)}
+            ]
+        )
+
+        response_text = message.content[0].text
+        if not response_text:
+             return "Error: Empty response from Claude."
+
+        return validate_response(response_text, rules)
+
+    except Exception as e:
+        return f"Error calling Claude: {str(e)}"
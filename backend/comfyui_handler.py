@@ -1,75 +1,58 @@
+"""
+ComfyUI client for the persona workflow.
+
+One ComfyUIClient keeps a single websocket open to ComfyUI (/ws?clientId=...)
+and multiplexes every outstanding prompt over it: POST /prompt returns a
+prompt_id, and the listener resolves that prompt's future when ComfyUI sends
+its execution-complete event (`executing` with node=None, or
+`execution_success`). Node outputs come from the `executed` events; only a
+prompt whose output node was served from ComfyUI's cache (no `executed` event)
+costs one GET /history call. After a reconnect, prompts still in flight are
+checked against /history, since their events may have been sent while the
+socket was down.
+
+The workflow template (API format) is read once per file version, not per call.
+"""
+import asyncio
+import copy
 import json
-import requests
+import os
 import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional
+
+import httpx
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
 
 # Configuration for ComfyUI API
-COMFYUI_SERVER_ADDRESS = "127.0.0.1:8188"
-CLIENT_ID = str(uuid.uuid4())
+COMFYUI_SERVER_ADDRESS = os.getenv("COMFYUI_SERVER_ADDRESS", "127.0.0.1:8188")
+# Workflow exported with "Save (API Format)"; unset uses the built-in persona workflow
+COMFYUI_WORKFLOW_PATH = os.getenv("COMFYUI_WORKFLOW_PATH", "")
+COMFYUI_PERSONA_PATH = os.getenv("COMFYUI_PERSONA_PATH", os.path.join(os.path.dirname(__file__), "persona.json"))
+COMFYUI_TIMEOUT = float(os.getenv("COMFYUI_TIMEOUT", "20"))
+COMFYUI_CONNECT_TIMEOUT = float(os.getenv("COMFYUI_CONNECT_TIMEOUT", "5"))
 
-def queue_prompt(prompt_workflow):
-    """Sends the workflow to ComfyUI for execution."""
-    p = {"prompt": prompt_workflow, "client_id": CLIENT_ID}
-    try:
-        response = requests.post(f"http://{COMFYUI_SERVER_ADDRESS}/prompt", json=p)
-        return response.json()
-    except Exception as e:
-        print(f"Failed to queue prompt: {e}")
-        return None
-
-def get_history(prompt_id):
-    """Retrieves the history/result of a specific prompt execution."""
-    try:
-        response = requests.get(f"http://{COMFYUI_SERVER_ADDRESS}/history/{prompt_id}")
-        return response.json()
-    except Exception as e:
-        print(f"Failed to get history: {e}")
-        return None
+# Node receiving the user message, and the node whose output is the reply
+INPUT_NODE = "3"
+OUTPUT_NODE = "5"
 
-def chat_with_comfyui(user_message: str):
-    """
-    Main interface function. 
-    1. Loads the workflow template.
-    2. Injects the user message into the input node.
-    3. Queues the workflow.
-    4. Pols for result (simplistic implementation).
-    """
-    # Load the workflow template
-    # Switching to user-provided workflow
-    workflow_path = "d:/Persona AI/comfyui/Persona AI.json"
-    
-    try:
-        with open(workflow_path, "r") as f:
-            workflow_data = json.load(f)
-    except FileNotFoundError:
-        return "Error: Workflow file not found."
-    
-    # Modify the workflow format for API usage
-    # ComfyUI API expects "prompt": { "node_id": { inputs... class_type... }, ... }
-    # which is different from the Save-Format (nodes array).
-    # We need to construct the API prompt object from our save format or define it directly.
-    # For robust API usage, it's often easier to define the API-format structure directly.
-    # Since we built the save format in the previous step, let's construct the API format manually here 
-    # to match the structure we defined in custom nodes.
-    
-    # API Structure construction based on our custom nodes
-    prompt_api = {
+# Events that arrived before their POST /prompt returned, kept for this many prompts
+EARLY_EVENTS = 256
+
+
+def default_workflow() -> dict:
+    """API structure for our custom nodes (PersonaLoader -> builder -> Ollama -> validator)."""
+    return {
         "1": {
-            "inputs": {
-                "persona_path": "d:/Persona AI/backend/persona.json"
-            },
+            "inputs": {"persona_path": COMFYUI_PERSONA_PATH},
             "class_type": "PersonaLoader"
         },
-        "2": {
-            "inputs": {
-                "text": user_message # Primitive node usually has 'text' or specific value
-            },
-            # Note: PrimitiveNodes in API are tricky, usually we just link to the target node directly 
-            # or use a specific string node. Let's assume we replace the input of Node 3 directly for simplicity.
-        },
         "3": {
             "inputs": {
                 "persona_rules": ["1", 0],
-                "user_message": user_message # Injecting directly here instead of using Node 2
+                "user_message": ""  # Injected per call
             },
             "class_type": "PersonaPromptBuilder"
         },
@@ -88,42 +71,271 @@ def chat_with_comfyui(user_message: str):
             },
             "class_type": "ResponseValidator"
         }
-        # Note: ComfyUI doesn't return output in HTTP response body directly. 
-        # We need to look for headers or history. 
-        # Usually we might add a SaveText node or similar to capture output easily, 
-        # or we just rely on "ResponseValidator" execution if we can capture its output.
-        # But standard ComfyUI API usage involves WebSocket for progress or Polling history.
     }
-    
-    # Removing Node 2 from API prompt as we injected directly into Node 3
-    
-    # Queue workflow
-    response = queue_prompt(prompt_api)
-    if not response:
-        return "Error: Could not connect to ComfyUI."
-    
-    prompt_id = response.get('prompt_id')
-    if not prompt_id:
-        return "Error: No prompt ID returned."
-        
-    # Polling for result (Waiting for execution)
-    import time
-    for _ in range(20): # Wait up to 20 seconds
-        time.sleep(1)
-        history = get_history(prompt_id)
-        if history and prompt_id in history:
-            # Execution done
-            outputs = history[prompt_id].get('outputs', {})
-            # Node 5 is our final node
-            if '5' in outputs:
-                 # Check what our node returns. Custom nodes return tuples.
-                 # By default, ComfyUI history stores the OUTPUTS of the nodes.
-                 # We need to make sure our ResponseValidator writes something we can read?
-                 # Actually, ComfyUI history stores the cached output of nodes.
-                 val = outputs['5'].get('final_response', [])
-                 if val:
-                     return val[0] # Assuming list of outputs
-            break
-            
-    return "Error: Timeout waiting for ComfyUI or no output captured."
 
+
+@lru_cache(maxsize=8)
+def _read_workflow(path: str, mtime_ns: int) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        workflow = json.load(f)
+    if "nodes" in workflow:
+        raise ValueError(f"{path} is in the UI save format; export it with Save (API Format)")
+    return workflow
+
+
+def workflow_template(path: str = None) -> dict:
+    """The cached template: re-read only when the file's mtime changes. Do not mutate it."""
+    path = COMFYUI_WORKFLOW_PATH if path is None else path
+    if not path:
+        return _default_template()
+    try:
+        return _read_workflow(path, os.stat(path).st_mtime_ns)
+    except (OSError, ValueError) as e:
+        print(f"[comfyui] Could not load {path} ({e}), using the built-in workflow")
+        return _default_template()
+
+
+@lru_cache(maxsize=1)
+def _default_template() -> dict:
+    return default_workflow()
+
+
+def build_prompt(user_message: str, template: dict = None) -> dict:
+    """Template with the message injected; only the input node is copied."""
+    template = workflow_template() if template is None else template
+    prompt = dict(template)
+    node = copy.deepcopy(template[INPUT_NODE])
+    node["inputs"]["user_message"] = user_message
+    prompt[INPUT_NODE] = node
+    return prompt
+
+
+class ComfyUIError(Exception):
+    pass
+
+
+class _Run:
+    __slots__ = ("future", "outputs", "error")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.outputs: Dict[str, dict] = {}
+        self.error: Optional[str] = None
+
+
+class ComfyUIClient:
+    """
+    Async ComfyUI client: HTTP for queueing, one shared websocket for results.
+
+    Like AsyncSupabase, the connections belong to the event loop that opened
+    them; a call from a different loop (tests, scripts) starts over.
+    """
+
+    def __init__(self, address: str = COMFYUI_SERVER_ADDRESS, timeout: float = COMFYUI_TIMEOUT,
+                 connect_timeout: float = COMFYUI_CONNECT_TIMEOUT, reconnect_backoff: float = 0.5):
+        self.address = address
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.reconnect_backoff = reconnect_backoff
+        self.client_id = str(uuid.uuid4())
+        self._loop = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._runs: Dict[str, _Run] = {}
+        self._early: "OrderedDict[str, _Run]" = OrderedDict()
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.history_fetches = 0
+        self.connects = 0
+
+    # --- Connection ---------------------------------------------------------
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Anything tied to a previous loop is unusable; drop it without awaiting
+            self._loop = loop
+            self._http = httpx.AsyncClient(base_url=f"http://{self.address}",
+                                           timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout))
+            self._connected = asyncio.Event()
+            self._runs.clear()
+            self._early.clear()
+            self._listener = None
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(self._listen())
+
+    async def _listen(self):
+        url = f"ws://{self.address}/ws?clientId={self.client_id}"
+        while True:
+            try:
+                async with connect(url, open_timeout=self.connect_timeout, max_size=None) as ws:
+                    self.connects += 1
+                    self._connected.set()
+                    if self.connects > 1:
+                        # Events sent while we were away are lost; ask /history instead
+                        for prompt_id in list(self._runs):
+                            asyncio.create_task(self._recover(prompt_id))
+                    async for message in ws:
+                        if isinstance(message, str):  # binary frames are image previews
+                            self._dispatch(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionClosed, asyncio.TimeoutError, ValueError) as e:
+                print(f"[comfyui] Websocket error: {e}")
+            self._connected.clear()
+            await asyncio.sleep(self.reconnect_backoff)
+
+    def _dispatch(self, message: dict):
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return  # queue status broadcasts
+        run = self._runs.get(prompt_id)
+        if run is None:
+            run = self._early.get(prompt_id)
+            if run is None:
+                run = self._early[prompt_id] = _Run(self._loop.create_future())
+                while len(self._early) > EARLY_EVENTS:
+                    self._early.popitem(last=False)
+        kind = message.get("type")
+        if kind == "executed":
+            run.outputs[str(data.get("node"))] = data.get("output") or {}
+        elif kind == "execution_success" or (kind == "executing" and data.get("node") is None):
+            self._finish(run)
+        elif kind == "execution_error":
+            run.error = data.get("exception_message") or "execution error"
+            self._finish(run)
+        elif kind == "execution_interrupted":
+            run.error = "execution interrupted"
+            self._finish(run)
+
+    @staticmethod
+    def _finish(run: _Run):
+        if not run.future.done():
+            run.future.set_result(None)
+
+    async def _recover(self, prompt_id: str):
+        run = self._runs.get(prompt_id)
+        entry = await self._history(prompt_id) if run is not None else None
+        if entry is None or run.future.done():
+            return
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            run.error = "execution error"
+        run.outputs.update(entry.get("outputs") or {})
+        self._finish(run)
+
+    async def _history(self, prompt_id: str) -> Optional[dict]:
+        self.history_fetches += 1
+        try:
+            resp = await self._http.get(f"/history/{prompt_id}")
+            return resp.json().get(prompt_id)
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Failed to get history: {e}")
+            return None
+
+    # --- Prompts ------------------------------------------------------------
+
+    async def queue_prompt(self, prompt: dict) -> str:
+        """Sends the workflow to ComfyUI for execution. Returns the prompt_id."""
+        resp = await self._http.post("/prompt", json={"prompt": prompt, "client_id": self.client_id})
+        try:
+            body = resp.json()
+        except ValueError:
+            # A proxy in front of ComfyUI (or a crash page) answered with HTML or plain text
+            raise ComfyUIError(f"prompt rejected: HTTP {resp.status_code}")
+        if resp.status_code != 200 or not body.get("prompt_id"):
+            raise ComfyUIError(f"prompt rejected: {body.get('error') or body.get('node_errors') or resp.status_code}")
+        return body["prompt_id"]
+
+    async def run(self, prompt: dict, timeout: float = None) -> Dict[str, dict]:
+        """Queues a prompt and waits for its completion event. Returns outputs by node id."""
+        self._bind()
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise ComfyUIError("could not connect to ComfyUI")
+        prompt_id = await self.queue_prompt(prompt)
+        self.submitted += 1
+        # No await between the POST returning and this: events can't slip past unseen
+        run = self._early.pop(prompt_id, None) or _Run(self._loop.create_future())
+        self._runs[prompt_id] = run
+        try:
+            await asyncio.wait_for(asyncio.shield(run.future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            await self._recover(prompt_id)
+            if not run.future.done():
+                self.timeouts += 1
+                raise
+        finally:
+            self._runs.pop(prompt_id, None)
+        if run.error:
+            self.errors += 1
+            raise ComfyUIError(run.error)
+        if OUTPUT_NODE not in run.outputs:
+            # Output node was cached: no executed event, the result is only in /history
+            entry = await self._history(prompt_id)
+            run.outputs.update((entry or {}).get("outputs") or {})
+        self.completed += 1
+        return run.outputs
+
+    async def chat(self, user_message: str) -> str:
+        try:
+            outputs = await self.run(build_prompt(user_message))
+        except ComfyUIError as e:
+            return f"Error: ComfyUI {e}."
+        except httpx.HTTPError:
+            return "Error: Could not connect to ComfyUI."
+        except asyncio.TimeoutError:
+            return "Error: Timeout waiting for ComfyUI or no output captured."
+        # Custom nodes return tuples; history stores each output as a list
+        val = outputs.get(OUTPUT_NODE, {}).get("final_response", [])
+        if val:
+            return val[0]
+        return "Error: Timeout waiting for ComfyUI or no output captured."
+
+    def stats(self) -> dict:
+        return {
+            "connected": bool(self._connected and self._connected.is_set()),
+            "connects": self.connects,
+            "in_flight": len(self._runs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "history_fetches": self.history_fetches,
+        }
+
+    async def aclose(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self._loop = None
+
+
+comfyui = ComfyUIClient()
+
+
+async def chat_with_comfyui_async(user_message: str) -> str:
+    return await comfyui.chat(user_message)
+
+
+def chat_with_comfyui(user_message: str) -> str:
+    """Blocking entry point for scripts: one short-lived client."""
+    async def once():
+        client = ComfyUIClient()
+        try:
+            return await client.chat(user_message)
+        finally:
+            await client.aclose()
+    return asyncio.run(once())
@@ -1,8 +1,12 @@
+import asyncio
+import atexit
 import os
-import requests
+import threading
+import time
 import json
 from datetime import date, datetime
 from dotenv import load_dotenv
+from supabase_session import supabase_session
 
 load_dotenv()
 
@@ -11,70 +15,194 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 DAILY_FREE_LIMIT = 10
 GLOBAL_SAFETY_CAP = 1000
+GLOBAL_STATS_FLUSH_INTERVAL = float(os.getenv("GLOBAL_STATS_FLUSH_INTERVAL", "1"))
+GLOBAL_STATS_MAX_AGE = float(os.getenv("GLOBAL_STATS_MAX_AGE", "5"))
+# How long to use GET + PATCH before asking for increment_global_stats again
+GLOBAL_STATS_RPC_RECHECK = 300
 
 # Helpers
 def get_today_str():
     return date.today().isoformat()
 
-def supabase_request(method, endpoint, data=None, params=None):
-    if not SUPABASE_URL or not SUPABASE_KEY or "your_supabase" in SUPABASE_URL:
+def supabase_configured():
+    return bool(SUPABASE_URL and SUPABASE_KEY and "your_supabase" not in SUPABASE_URL)
+
+def supabase_request(method, endpoint, data=None, params=None, prefer="return=representation"):
+    if not supabase_configured():
         return None
     
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=representation"
-    }
-    
     url = f"{SUPABASE_URL}/rest/v1/{endpoint}"
     
     try:
-        print(f"Supabase Request: {method} {url}")
-        if method == "GET":
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
-        elif method == "POST":
-            resp = requests.post(url, headers=headers, json=data, timeout=10)
-        elif method == "PATCH":
-            resp = requests.patch(url, headers=headers, params=params, json=data, timeout=10)
-            
-        print(f"Supabase Response: {resp.status_code}")
+        # Pooled keep-alive session: no handshake per call, retries with jitter
+        resp = supabase_session.request(method, url, SUPABASE_KEY, params=params, json=data, prefer=prefer)
         if resp.status_code >= 300:
-            print(f"Supabase Error Body: {resp.text}")
+            print(f"Supabase Error: {method} {endpoint} -> {resp.status_code} {resp.text}")
             return None
         return resp.json()
     except Exception as e:
         print(f"Supabase HTTP Error: {e}")
         return None
 
+class GlobalStatsCounter:
+    """
+    Batched counter for today's global_stats row.
+    Chats bump an in-memory count; a background thread adds it to the row with
+    one atomic increment_global_stats RPC every GLOBAL_STATS_FLUSH_INTERVAL
+    seconds, and the RPC's result keeps the local total in sync. That replaces
+    a GET + PATCH per chat on a single hot row, which also lost updates
+    under concurrency.
+
+    The live quota path doesn't use this: check_can_chat and
+    apply_quota_increments (quota_cache.py) count global requests in the
+    database. Only check_can_chat_rest does, i.e. when the check_can_chat
+    migration is missing, and then increment_global_stats most likely is too.
+    So a 404 from the RPC switches to the old GET + PATCH (not atomic) and the
+    RPC is tried again every GLOBAL_STATS_RPC_RECHECK seconds.
+    """
+
+    def __init__(self, flush_interval=None, max_age=None, clock=time.monotonic):
+        self.flush_interval = flush_interval if flush_interval is not None else GLOBAL_STATS_FLUSH_INTERVAL
+        self.max_age = max_age if max_age is not None else GLOBAL_STATS_MAX_AGE
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # date -> increments not yet written (a flush can straddle midnight)
+        self._pending = {}
+        self._day = None
+        self._total = 0
+        self._synced_at = None
+        self._thread = None
+        self._rpc_missing_at = None
+        self.flushes = 0
+        self.flush_failures = 0
+
+    def increment(self, amount=1):
+        today = get_today_str()
+        with self._lock:
+            self._pending[today] = self._pending.get(today, 0) + amount
+        self._ensure_flusher()
+
+    def approximate_total(self):
+        """Today's total as of the last sync plus our unflushed increments."""
+        today = get_today_str()
+        with self._lock:
+            stale = self._day != today or self._synced_at is None or self._clock() - self._synced_at > self.max_age
+        if stale:
+            self.flush(sync=True)
+        with self._lock:
+            total = self._total if self._day == today else 0
+            return total + self._pending.get(today, 0)
+
+    def flush(self, sync=False):
+        """Writes pending increments (and with sync=True, reads today's total even if none)."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            today = get_today_str()
+            if sync and today not in batch:
+                batch[today] = 0
+
+            for day, amount in sorted(batch.items()):
+                result = self._add(day, amount)
+                with self._lock:
+                    if not isinstance(result, int):
+                        # Keep it for the next flush
+                        if amount:
+                            self._pending[day] = self._pending.get(day, 0) + amount
+                        self.flush_failures += 1
+                        continue
+                    if day == today:
+                        self._day, self._total, self._synced_at = day, result, self._clock()
+                    self.flushes += 1
+
+    def _add(self, day, amount):
+        """Adds amount to the day's row; returns the new total, or None on failure."""
+        if not supabase_configured():
+            return None
+        missing = self._rpc_missing_at
+        if missing is None or self._clock() - missing >= GLOBAL_STATS_RPC_RECHECK:
+            try:
+                resp = supabase_session.request("POST", f"{SUPABASE_URL}/rest/v1/rpc/increment_global_stats",
+                                                SUPABASE_KEY, json={"p_date": day, "p_amount": amount})
+            except Exception as e:
+                print(f"Supabase HTTP Error: {e}")
+                return None
+            if resp.status_code != 404:
+                self._rpc_missing_at = None
+                if resp.status_code >= 300:
+                    print(f"Supabase Error: POST rpc/increment_global_stats -> {resp.status_code} {resp.text}")
+                    return None
+                return resp.json()
+            if missing is None:
+                print("increment_global_stats RPC missing, falling back to GET + PATCH")
+            self._rpc_missing_at = self._clock()
+        return self._add_rest(day, amount)
+
+    def _add_rest(self, day, amount):
+        """The pre-RPC read-modify-write (concurrent writers can lose updates)."""
+        rows = supabase_request("GET", "global_stats", params={"date": f"eq.{day}", "select": "total_requests"})
+        if rows is None:
+            return None
+        if not rows:
+            created = supabase_request("POST", "global_stats", data={"date": day, "total_requests": amount})
+            return created[0]["total_requests"] if created else None
+        total = (rows[0].get("total_requests") or 0) + amount
+        if amount and supabase_request("PATCH", "global_stats", params={"date": f"eq.{day}"},
+                                       data={"total_requests": total}) is None:
+            return None
+        return total
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _ensure_flusher(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="global-stats-flusher", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+global_stats_counter = GlobalStatsCounter()
+
 def check_global_cap():
-    """Checks if system-wide safety limit is breached."""
-    today = get_today_str()
-    # QUERY: global_stats?date=eq.today&select=total_requests
-    data = supabase_request("GET", "global_stats", params={"date": f"eq.{today}", "select": "total_requests"})
-    
-    if data and len(data) > 0:
-        total = data[0].get('total_requests', 0)
-        if total >= GLOBAL_SAFETY_CAP:
-            return False
-    elif data == []:
-         # Create row
-         supabase_request("POST", "global_stats", data={"date": today, "total_requests": 0})
-         
-    return True
+    """Checks if system-wide safety limit is breached (local approximation, synced every few seconds)."""
+    return global_stats_counter.approximate_total() < GLOBAL_SAFETY_CAP
 
 def increment_global_stats():
-    """Increments total system requests."""
-    today = get_today_str()
-    # For MVP via REST: Fetch count then update (Race condition permissible for MVP safety cap)
-    data = supabase_request("GET", "global_stats", params={"date": f"eq.{today}", "select": "total_requests"})
-    if data and len(data) > 0:
-        new_total = data[0]['total_requests'] + 1
-        supabase_request("PATCH", "global_stats", params={"date": f"eq.{today}"}, data={"total_requests": new_total})
+    """Increments total system requests (batched, see GlobalStatsCounter)."""
+    global_stats_counter.increment()
 
 def check_can_chat(identifier: str) -> dict:
     """
-    Core Logic using REST API
+    Quota check + increment in one round trip.
+    Calls the check_can_chat Postgres function (supabase/migrations/check_can_chat_rpc.sql),
+    which resolves the user, resets the day, checks both limits and bumps both
+    counters atomically. Falls back to the REST chain if the function is missing.
+    Identifier can be IP address or Email
+    """
+    # Fail OPEN if no keys configured
+    if not SUPABASE_URL or "your_" in SUPABASE_URL:
+        return {'allowed': True, 'plan': 'dev', 'remaining': 999}
+
+    result = supabase_request("POST", "rpc/check_can_chat", data={
+        "p_identifier": identifier,
+        "p_daily_limit": DAILY_FREE_LIMIT,
+        "p_global_cap": GLOBAL_SAFETY_CAP,
+    })
+    if isinstance(result, dict) and "allowed" in result:
+        return result
+
+    print("check_can_chat RPC unavailable, falling back to REST chain")
+    return check_can_chat_rest(identifier)
+
+def check_can_chat_rest(identifier: str) -> dict:
+    """
+    Core Logic using REST API (up to seven sequential calls, not atomic).
+    Kept as the fallback until the RPC migration is applied everywhere.
     Identifier can be IP address or Email
     """
     # Fail OPEN if no keys configured
@@ -142,6 +270,26 @@ def check_can_chat(identifier: str) -> dict:
         print(f"Logic Error: {e}")
         return {'allowed': True, 'plan': 'error_fallback', 'remaining': 5}
 
+def apply_quota_increments(increments: list) -> dict:
+    """
+    Write-behind flush for quota_cache: one RPC adds every batched increment
+    ([{"identifier", "count", "date"}]) to users and global_stats.
+    Returns {"users": [...fresh counters...], "global_total": n}, or None on failure.
+    """
+    if not SUPABASE_URL or "your_" in SUPABASE_URL:
+        return {"users": [], "global_total": 0}
+    result = supabase_request("POST", "rpc/apply_quota_increments", data={"p_increments": increments})
+    if isinstance(result, dict) and "users" in result:
+        return result
+    return None
+
+async def check_can_chat_async(identifier: str) -> dict:
+    """
+    Async entry point for the /chat handler.
+    Runs the blocking quota call on a worker thread so the event loop stays free.
+    """
+    return await asyncio.to_thread(check_can_chat, identifier)
+
 def save_contact_submission(name: str, email: str, message: str, ip_address: str = None, user_agent: str = None) -> dict:
     """
     Saves a contact form submission to the database.
@@ -184,8 +332,14 @@ def get_supabase_client():
             return self
         
         def insert(self, data):
-            result = supabase_request("POST", self.table_name, data=data)
-            return SupabaseResponse(result)
+            self._insert_data = data
+            return self
+        
+        def upsert(self, data, on_conflict):
+            """Insert, or update the row with the same on_conflict value (needs a unique index)."""
+            self._insert_data = data
+            self._on_conflict = on_conflict
+            return self
         
         def update(self, data):
             self._update_data = data
@@ -196,7 +350,13 @@ def get_supabase_client():
             return self
         
         def execute(self):
-            if hasattr(self, '_update_data'):
+            if hasattr(self, '_on_conflict'):
+                result = supabase_request("POST", self.table_name, data=self._insert_data,
+                                          params={"on_conflict": self._on_conflict},
+                                          prefer="resolution=merge-duplicates,return=representation")
+            elif hasattr(self, '_insert_data'):
+                result = supabase_request("POST", self.table_name, data=self._insert_data)
+            elif hasattr(self, '_update_data'):
                 result = supabase_request("PATCH", self.table_name, params=self._filters, data=self._update_data)
             elif hasattr(self, '_select'):
                 result = supabase_request("GET", self.table_name, params=self._filters)
@@ -1,10 +1,28 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
 import requests
-from typing import Optional
+
+from ip_country_db import get_db
+
+# Config
+GEO_CACHE_TTL = float(os.getenv("GEO_CACHE_TTL", "86400"))
+# Failed lookups (None) are retried after this, not on every page view
+GEO_NEGATIVE_TTL = float(os.getenv("GEO_NEGATIVE_TTL", "300"))
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "50000"))
 
 
 def get_country_from_ip(ip_address: str) -> Optional[str]:
     """
-    Detect country from IP address using ipapi.co free API.
+    Detect country from IP address.
+    Uses the offline range database (ip_country_db.py) when one is installed:
+    microseconds, no network. Without it, falls back to the ipapi.co free API.
     
     Args:
         ip_address: User's IP address
@@ -12,6 +30,10 @@ def get_country_from_ip(ip_address: str) -> Optional[str]:
     Returns:
         Two-letter country code (e.g., 'IN', 'US') or None if detection fails
     """
+    db = get_db()
+    if db is not None:
+        return db.lookup(ip_address)
+
     try:
         # Use ipapi.co free tier (1,000 requests/day)
         response = requests.get(f"https://ipapi.co/{ip_address}/country/", timeout=2)
@@ -36,8 +58,7 @@ def is_indian_user(ip_address: str) -> bool:
     Returns:
         True if user is from India, False otherwise
     """
-    country = get_country_from_ip(ip_address)
-    return country == "IN" if country else False
+    return resolve_geo(ip_address).is_india
 
 
 def get_payment_provider(ip_address: str) -> str:
@@ -50,6 +71,153 @@ def get_payment_provider(ip_address: str) -> str:
     Returns:
         'razorpay' for Indian users, 'gumroad' for international users
     """
-    if is_indian_user(ip_address):
-        return "razorpay"
-    return "gumroad"
+    return resolve_geo(ip_address).payment_provider
+
+
+def provider_for_country(country: Optional[str]) -> str:
+    return "razorpay" if country == "IN" else "gumroad"
+
+
+@dataclass(frozen=True)
+class GeoResult:
+    """Country and payment provider from one lookup."""
+    country: Optional[str]
+    payment_provider: str
+
+    @property
+    def is_india(self) -> bool:
+        return self.country == "IN"
+
+
+class GeoCache:
+    """
+    Thread-safe TTL'd LRU of ip -> GeoResult.
+    Successful lookups live for GEO_CACHE_TTL, failures (country None) for
+    GEO_NEGATIVE_TTL. Concurrent misses for the same IP share one lookup: the
+    first caller runs it, the rest wait on its Future.
+    """
+
+    def __init__(self, lookup: Callable[[str], Optional[str]] = None, ttl: float = GEO_CACHE_TTL,
+                 negative_ttl: float = GEO_NEGATIVE_TTL, max_entries: int = GEO_CACHE_MAX_ENTRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        # Resolved at call time so tests can swap get_country_from_ip
+        self._lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # ip -> (GeoResult, expires_at)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lookups = 0
+        self.lookup_failures = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def peek(self, ip_address: str) -> Optional[GeoResult]:
+        """Cached result, or None on a miss (no lookup)."""
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None:
+                return None
+            result, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[ip_address]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(ip_address)
+            self.hits += 1
+            if result.country is None:
+                self.negative_hits += 1
+            return result
+
+    def resolve(self, ip_address: str) -> GeoResult:
+        cached = self.peek(ip_address)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._in_flight.get(ip_address)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[ip_address] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._load(ip_address)
+        except BaseException as e:
+            future.set_exception(e)     # never leave waiters hanging
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(ip_address, None)
+
+    async def resolve_async(self, ip_address: str) -> GeoResult:
+        cached = self.peek(ip_address)
+        if cached is not None:
+            return cached
+        if get_db() is not None:
+            return self.resolve(ip_address)     # local table: microseconds, fine on the loop
+        return await asyncio.to_thread(self.resolve, ip_address)
+
+    def _load(self, ip_address: str) -> GeoResult:
+        lookup = self._lookup or get_country_from_ip
+        try:
+            country = lookup(ip_address)
+        except Exception as e:
+            print(f"Error detecting country from IP: {e}")
+            country = None
+        result = GeoResult(country, provider_for_country(country))
+        ttl = self.ttl if country else self.negative_ttl
+        with self._lock:
+            self.lookups += 1
+            if country is None:
+                self.lookup_failures += 1
+            self._entries[ip_address] = (result, self._clock() + ttl)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests_seen = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / requests_seen, 4) if requests_seen else 0.0,
+                "lookups": self.lookups,
+                "lookup_failures": self.lookup_failures,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "in_flight": len(self._in_flight),
+            }
+
+
+geo_cache = GeoCache()
+
+
+def resolve_geo(ip_address: str) -> GeoResult:
+    """Country + payment provider for an IP, through the shared cache."""
+    return geo_cache.resolve(ip_address)
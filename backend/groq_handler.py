@@ -1,38 +1,55 @@
 import os
-from groq import Groq
+import time
+from typing import Optional
+from groq import Groq, AsyncGroq
 from dotenv import load_dotenv
+from response_validator import validate_response
+from token_budget import BASELINE_MAX_TOKENS, record_generation
 
 load_dotenv()
 
-# Configure Groq Client
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# Configure Groq Clients (sync for scripts, async for the FastAPI chat path)
 client = None
+async_client = None
 api_key = os.getenv("GROQ_API_KEY")
 
 if api_key:
     client = Groq(api_key=api_key)
+    async_client = AsyncGroq(api_key=api_key)
+
+def build_messages(system_prompt: str, user_message: str) -> list:
+    """Builds the Groq message list with the persona reinforcement wrapper."""
+    # User message wrapper (reinforcement logic similar to what we added for Gemini)
+    enforced_user_message = f"""[USER QUESTION]: {user_message}
+
+[INSTRUCTION]: Answer this as Elon Musk would. 
+- Use First Principles. 
+- Be barely polite, or not polite at all.
+- Focus on physics, cost, and truth.
+- PROVIDE PROOF: Cite dates, events, historical parallels, or specific reports. Do not just state opinions.
+- NO "AI" disclaimers.
+- Make it quotable."""
+
+    # Minimal system prompt structure for Groq
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": enforced_user_message}
+    ]
 
-def validate_response(text: str, rules: dict) -> str:
+def completion_params(max_tokens: Optional[int] = None) -> dict:
     """
-    Validates and cleans the response based on rules.
-    1. Truncate to max_words
-    2. Check prompt compliance (basic)
+    Sampling parameters shared by the sync and async Groq calls.
+    max_tokens is the persona's budget (token_budget); scripts get the old fixed limit.
     """
-    max_words = rules.get("max_words", 150)
-    
-    # 1. Check word count
-    words = text.split()
-    if len(words) > max_words:
-        # Hard cut
-        text = " ".join(words[:max_words]) + "..."
-        
-    # 2. Naive forbidden phrase check/strip could go here
-    forbidden = rules.get("forbidden_phrases", [])
-    for phrase in forbidden:
-        if phrase.lower() in text.lower():
-             # Basic redaction or removal
-             text = text.replace(phrase, "")
-             
-    return text
+    return {
+        "model": GROQ_MODEL,  # Current model (cheap + fast + effective)
+        "temperature": 0.9,   # Higher temperature for "red pilled" creativity
+        "max_tokens": max_tokens or BASELINE_MAX_TOKENS,
+        "top_p": 0.95,
+        "stop": None,
+    }
 
 def call_groq(system_prompt: str, user_message: str, rules: dict = {}) -> str:
     """
@@ -43,36 +60,15 @@ def call_groq(system_prompt: str, user_message: str, rules: dict = {}) -> str:
         return "Error: GROQ_API_KEY not set in .env"
 
     try:
-        # User message wrapper (reinforcement logic similar to what we added for Gemini)
-        enforced_user_message = f"""[USER QUESTION]: {user_message}
-
-[INSTRUCTION]: Answer this as Elon Musk would. 
-- Use First Principles. 
-- Be barely polite, or not polite at all.
-- Focus on physics, cost, and truth.
-- PROVIDE PROOF: Cite dates, events, historical parallels, or specific reports. Do not just state opinions.
-- NO "AI" disclaimers.
-- Make it quotable."""
-        
         # DEBUG: Print what we're actually sending
-        print(f"[DEBUG] Using model: llama-3.3-70b-versatile")
+        print(f"[DEBUG] Using model: {GROQ_MODEL}")
         print(f"[DEBUG] User question: {user_message}")
         print(f"[DEBUG] System Prompt: {system_prompt[:50]}...")
         
-        # Minimal system prompt structure for Groq
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": enforced_user_message}
-        ]
-        
         completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",  # Current model (cheap + fast + effective)
-            messages=messages,
-            temperature=0.9,  # Higher temperature for "red pilled" creativity
-            max_tokens=300,   # More room for detailed reasoning
-            top_p=0.95,
+            messages=build_messages(system_prompt, user_message),
             stream=False,
-            stop=None,
+            **completion_params(),
         )
 
         response_text = completion.choices[0].message.content
@@ -88,3 +84,62 @@ def call_groq(system_prompt: str, user_message: str, rules: dict = {}) -> str:
 
     except Exception as e:
         return f"Error calling Groq: {str(e)}"
+
+async def call_groq_async(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Async version of call_groq for the /chat handler.
+    Awaits the completion instead of blocking the event loop.
+    """
+    if not async_client:
+        return "Error: GROQ_API_KEY not set in .env"
+
+    try:
+        print(f"[DEBUG] Using model: {GROQ_MODEL} (async)")
+        print(f"[DEBUG] User question: {user_message}")
+
+        params = completion_params(rules.get("max_tokens"))
+        start = time.perf_counter()
+        completion = await async_client.chat.completions.create(
+            messages=build_messages(system_prompt, user_message),
+            stream=False,
+            **params,
+        )
+
+        choice = completion.choices[0]
+        response_text = choice.message.content
+        if not response_text:
+             return "Error: Empty response from Groq."
+
+        if completion.usage:
+            record_generation(params["max_tokens"], completion.usage.completion_tokens,
+                              stopped_early=choice.finish_reason == "length",
+                              elapsed_ms=(time.perf_counter() - start) * 1000,
+                              words=len(response_text.split()))
+
+        return validate_response(response_text, rules)
+
+    except Exception as e:
+        return f"Error calling Groq: {str(e)}"
+
+async def stream_groq(system_prompt: str, user_message: str, max_tokens: Optional[int] = None):
+    """
+    Streams the Groq completion as text deltas.
+    Closing this generator early (aclose) closes the upstream HTTP stream,
+    which stops the generation on Groq's side.
+    """
+    if not async_client:
+        yield "Error: GROQ_API_KEY not set in .env"
+        return
+
+    stream = await async_client.chat.completions.create(
+        messages=build_messages(system_prompt, user_message),
+        stream=True,
+        **completion_params(max_tokens),
+    )
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+    finally:
+        await stream.close()
@@ -1,38 +1,167 @@
+import json
 import os
+import threading
+import time
+from concurrent.futures import Future
 import requests
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any
+from urllib.parse import parse_qsl
 from dotenv import load_dotenv
+from session_tokens import new_token_version, note_token_version
+from subscription_expiry import subscription_expiry
 
 load_dotenv()
 
 GUMROAD_ACCESS_TOKEN = os.getenv("GUMROAD_ACCESS_TOKEN")
 GUMROAD_PRODUCT_PERMALINK = "persona-ai"  # From your Gumroad URL
+GUMROAD_API_URL = os.getenv("GUMROAD_API_URL", "https://api.gumroad.com/v2")
+GUMROAD_CONNECT_TIMEOUT = float(os.getenv("GUMROAD_CONNECT_TIMEOUT", "3"))
+GUMROAD_READ_TIMEOUT = float(os.getenv("GUMROAD_READ_TIMEOUT", "10"))
+SALE_CACHE_TTL = float(os.getenv("SALE_CACHE_TTL", "300"))
+# "No such sale" answers are kept briefly; network errors are not cached at all
+SALE_NEGATIVE_TTL = float(os.getenv("SALE_NEGATIVE_TTL", "30"))
+SALE_CACHE_MAX_ENTRIES = int(os.getenv("SALE_CACHE_MAX_ENTRIES", "10000"))
+# The /webhooks/gumroad route stays off while Gumroad is frozen for launch
+GUMROAD_WEBHOOKS_ENABLED = os.getenv("GUMROAD_WEBHOOKS_ENABLED", "false").lower() == "true"
+
+_gumroad_session = requests.Session()
+
+
+class GumroadUnavailable(Exception):
+    """Gumroad could not be asked (network error, 5xx, rate limit)."""
+
+
+def fetch_sale(sale_id: str) -> Optional[Dict[str, Any]]:
+    """
+    One GET /sales/:id. Returns the sale record, or None if Gumroad says the sale
+    is not valid. Raises GumroadUnavailable when there is no answer to trust.
+    """
+    try:
+        response = _gumroad_session.get(
+            f"{GUMROAD_API_URL}/sales/{sale_id}",
+            headers={"Authorization": f"Bearer {GUMROAD_ACCESS_TOKEN}"},
+            timeout=(GUMROAD_CONNECT_TIMEOUT, GUMROAD_READ_TIMEOUT),
+        )
+    except requests.RequestException as e:
+        raise GumroadUnavailable(str(e)) from e
+    if response.status_code == 429 or response.status_code >= 500:
+        raise GumroadUnavailable(f"HTTP {response.status_code}")
+    if response.status_code == 200:
+        data = response.json()
+        if data.get("success"):
+            return data.get("sale")
+    return None
+
+
+class SaleCache:
+    """
+    TTL cache of Gumroad sale records, so one activation or webhook costs one
+    API call no matter how many helpers look at the sale. Concurrent misses
+    for the same sale_id share one fetch. invalidate() drops a record when a
+    webhook says it changed (refund, dispute).
+    """
+
+    def __init__(self, fetch: Callable[[str], Optional[dict]] = None, ttl: float = SALE_CACHE_TTL,
+                 negative_ttl: float = SALE_NEGATIVE_TTL, max_entries: int = SALE_CACHE_MAX_ENTRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        # Resolved at call time so tests can swap fetch_sale
+        self._fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # sale_id -> (record or None, expires_at)
+        self._entries: Dict[str, tuple] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def get(self, sale_id: str) -> Optional[Dict[str, Any]]:
+        """Sale record or None; None also when Gumroad is unreachable (not cached)."""
+        with self._lock:
+            entry = self._entries.get(sale_id)
+            if entry is not None and entry[1] > self._clock():
+                self.hits += 1
+                return entry[0]
+            future = self._in_flight.get(sale_id)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[sale_id] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        record = None
+        try:
+            record = (self._fetch or fetch_sale)(sale_id)
+            with self._lock:
+                self.fetches += 1
+                ttl = self.ttl if record else self.negative_ttl
+                if len(self._entries) >= self.max_entries:
+                    self._prune()
+                self._entries[sale_id] = (record, self._clock() + ttl)
+        except GumroadUnavailable as e:
+            print(f"Error verifying Gumroad sale: {e}")
+            with self._lock:
+                self.errors += 1
+        finally:
+            with self._lock:
+                self._in_flight.pop(sale_id, None)
+            future.set_result(record)
+        return record
+
+    def _prune(self):
+        now = self._clock()
+        live = {k: v for k, v in self._entries.items() if v[1] > now}
+        if len(live) >= self.max_entries:
+            # Still full: drop the entries closest to expiry
+            live = dict(sorted(live.items(), key=lambda item: item[1][1])[len(live) // 2:])
+        self._entries = live
+
+    def invalidate(self, sale_id: str):
+        with self._lock:
+            if self._entries.pop(sale_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "fetches": self.fetches,
+                "errors": self.errors,
+                "invalidations": self.invalidations,
+            }
+
+
+sale_cache = SaleCache()
 
 
 def verify_sale(sale_id: str) -> Optional[Dict[str, Any]]:
     """
     Verify a Gumroad sale using the API.
     Returns sale data if valid, None if invalid.
+    The record is cached (SALE_CACHE_TTL), so the helpers below reuse one fetch.
     """
     if not GUMROAD_ACCESS_TOKEN:
         print("ERROR: GUMROAD_ACCESS_TOKEN not configured")
         return None
-    
-    try:
-        url = f"https://api.gumroad.com/v2/sales/{sale_id}"
-        headers = {"Authorization": f"Bearer {GUMROAD_ACCESS_TOKEN}"}
-        
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("success"):
-                return data.get("sale")
-        
-        return None
-    except Exception as e:
-        print(f"Error verifying Gumroad sale: {e}")
-        return None
+    return sale_cache.get(sale_id)
+
+
+def invalidate_sale(sale_id: str):
+    """Forget the cached record; call when a webhook reports a change to the sale."""
+    sale_cache.invalidate(sale_id)
 
 
 def get_sale_email(sale_id: str) -> Optional[str]:
@@ -68,25 +197,33 @@ def grant_premium_access(user_email: str, sale_id: str, supabase_client) -> bool
         True if successful, False otherwise
     """
     try:
-        # Update user to premium
+        # Update user to premium; a new token_version retires session tokens that still say "free".
+        # A purchase has no end date: clear one left by a lapsed subscription, or the
+        # expiry path (check_can_chat, the sweeper) would downgrade the new purchase.
+        version = new_token_version()
         result = supabase_client.table("users").update({
             "plan": "pro",
             "gumroad_sale_id": sale_id,
             "payment_provider": "gumroad",
-            "msg_count": 0  # Reset message count
+            "msg_count": 0,  # Reset message count
+            "subscription_end_date": None,
+            "token_version": version
         }).eq("email", user_email).execute()
         
         if result.data:
-            # Record transaction
-            supabase_client.table("transactions").insert({
+            note_token_version(user_email, version)
+            for user in result.data:
+                subscription_expiry.forget(user["id"])
+            # Record transaction; one row per sale, so a rerun of this event adds nothing
+            recorded = supabase_client.table("transactions").upsert({
                 "user_ip": None,  # Email-based user, no IP tracking
                 "gumroad_sale_id": sale_id,
                 "amount": 699,  # $6.99 in cents
                 "status": "paid",
                 "payment_provider": "gumroad"
-            }).execute()
+            }, on_conflict="gumroad_sale_id").execute()
             
-            return True
+            return bool(recorded.data)
         
         return False
     except Exception as e:
@@ -96,7 +233,9 @@ def grant_premium_access(user_email: str, sale_id: str, supabase_client) -> bool
 
 def revoke_premium_access(sale_id: str, supabase_client) -> bool:
     """
-    Revoke premium access after a refund.
+    Revoke premium access after a refund. Safe to run again: once the user has
+    been downgraded no row holds the sale id, and the refunded transaction is
+    taken as proof that this already happened.
     
     Args:
         sale_id: Gumroad sale ID
@@ -112,21 +251,92 @@ def revoke_premium_access(sale_id: str, supabase_client) -> bool:
         if user_result.data:
             user = user_result.data[0]
             
-            # Downgrade to free plan
-            supabase_client.table("users").update({
+            # Downgrade to free plan; a new token_version retires session tokens that still say "pro"
+            version = new_token_version()
+            downgraded = supabase_client.table("users").update({
                 "plan": "free",
                 "gumroad_sale_id": None,
-                "payment_provider": "razorpay"  # Reset to default
+                "payment_provider": "razorpay",  # Reset to default
+                "token_version": version
             }).eq("id", user["id"]).execute()
+            if not downgraded.data:
+                return False
+            if user.get("email"):
+                note_token_version(user["email"], version)
+        else:
+            # Already revoked (or the user never linked): only the transaction can still say "paid".
+            # No transaction either means Supabase didn't answer or the sale is unknown: retry.
+            txn_result = supabase_client.table("transactions").select("*").eq("gumroad_sale_id", sale_id).execute()
+            if not txn_result.data:
+                return False
             
-            # Update transaction status
-            supabase_client.table("transactions").update({
-                "status": "refunded"
-            }).eq("gumroad_sale_id", sale_id).execute()
-            
-            return True
+        # Update transaction status
+        supabase_client.table("transactions").update({
+            "status": "refunded"
+        }).eq("gumroad_sale_id", sale_id).execute()
         
-        return False
+        return True
     except Exception as e:
         print(f"Error revoking premium access: {e}")
         return False
+
+
+def parse_ping(body: bytes) -> Dict[str, Any]:
+    """Gumroad pings are form-encoded ("true"/"false" strings); JSON bodies are accepted too."""
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        fields = dict(parse_qsl(body.decode("utf-8")))
+    for flag in ("refunded", "disputed"):
+        if isinstance(fields.get(flag), str):
+            fields[flag] = fields[flag].lower() == "true"
+    return fields
+
+
+def ping_event_id(fields: Dict[str, Any]) -> str:
+    """
+    One event per sale and outcome: the sale, then (maybe) its refund.
+    This is what the ping claims; apply_gumroad_event only acts once the
+    verified record agrees, so a forged ping cannot complete the id.
+    """
+    refund = fields.get("refunded") or fields.get("disputed")
+    return f"{fields['sale_id']}:{'refund' if refund else 'sale'}"
+
+
+def apply_gumroad_event(payload: bytes) -> bool:
+    """
+    Applies one stored ping (run by the webhook inbox workers).
+    Pings are not signed: only the sale_id is taken from them. The buyer's
+    email, the product and the refund state all come from the Gumroad API.
+    A ping that contradicts the record (e.g. claims a refund the API doesn't
+    show yet) is retried, so it never marks its event id as done.
+    Returns False to have it retried later.
+    """
+    from database import get_supabase_client
+
+    fields = parse_ping(payload)
+    sale_id = fields["sale_id"]
+    claims_refund = bool(fields.get("refunded") or fields.get("disputed"))
+    if claims_refund:
+        # A refund changes the record: drop the cached copy first
+        invalidate_sale(sale_id)
+    sale_data = verify_sale(sale_id)
+    if not sale_data:
+        print(f"Gumroad ping for unverified sale {sale_id}")
+        return False
+    if sale_data.get("product_permalink", GUMROAD_PRODUCT_PERMALINK) != GUMROAD_PRODUCT_PERMALINK:
+        print(f"Gumroad ping for sale {sale_id} of another product, ignored")
+        return True
+    refunded = bool(sale_data.get("refunded") or sale_data.get("disputed"))
+    if refunded != claims_refund:
+        print(f"Gumroad ping for sale {sale_id} does not match the sale record, retrying later")
+        return False
+
+    supabase = get_supabase_client()
+    if refunded:
+        return revoke_premium_access(sale_id, supabase)
+    buyer_email = sale_data.get("email")
+    if not buyer_email:
+        print(f"No email found for sale {sale_id}")
+        return True
+    return grant_premium_access(buyer_email, sale_id, supabase)
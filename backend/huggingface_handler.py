@@ -1,6 +1,8 @@
 import os
+import httpx
 import requests
 from dotenv import load_dotenv
+from response_validator import validate_response
 
 load_dotenv()
 
@@ -9,41 +11,11 @@ api_key = os.getenv("HUGGINGFACE_API_KEY")
 # Using Mistral-7B-Instruct-v0.2 (7B params, has active Inference API)
 API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
 
-def validate_response(text: str, rules: dict) -> str:
-    """
-    Validates and cleans the response based on rules.
-    1. Truncate to max_words
-    2. Check prompt compliance (basic)
-    """
-    max_words = rules.get("max_words", 150)
-    
-    # 1. Check word count
-    words = text.split()
-    if len(words) > max_words:
-        # Hard cut
-        text = " ".join(words[:max_words]) + "..."
-        
-    # 2. Naive forbidden phrase check/strip could go here
-    forbidden = rules.get("forbidden_phrases", [])
-    for phrase in forbidden:
-        if phrase.lower() in text.lower():
-             # Basic redaction or removal
-             text = text.replace(phrase, "")
-             
-    return text
-
-def call_huggingface(system_prompt: str, user_message: str, rules: dict = {}) -> str:
-    """
-    Calls Hugging Face Inference API with Mixtral-8x7B.
-    Uses same Elon-style persona prompt as Groq.
-    """
-    if not api_key:
-        return "Error: HUGGINGFACE_API_KEY not set in .env"
-
-    try:
-        # ELON-ORIENTED PROMPT: Same as Groq
-        # ELON-ORIENTED PROMPT: Refined for Smart Number Handling & Insights
-        enforced_user_message = f"""You simulate the thinking style of Elon Musk—first-principles reasoning, engineering-driven, brutally honest, but ultimately helpful logic.
+def build_user_message(user_message: str) -> str:
+    """Wraps the user question in the Elon-oriented instruction prompt."""
+    # ELON-ORIENTED PROMPT: Same as Groq
+    # ELON-ORIENTED PROMPT: Refined for Smart Number Handling & Insights
+    return f"""You simulate the thinking style of Elon Musk—first-principles reasoning, engineering-driven, brutally honest, but ultimately helpful logic.
 
 CRITICAL INTERACTION RULES:
 1. **SMART NUMBER HANDLING**:
@@ -81,7 +53,42 @@ Tone:
 Question: {user_message}
 
 Response:"""
-        
+
+def build_payload(user_message: str, max_new_tokens: int = 300) -> dict:
+    """Inference API payload shared by the sync and async calls."""
+    return {
+        "inputs": build_user_message(user_message),
+        "parameters": {
+            "max_new_tokens": max_new_tokens,
+            "temperature": 0.4,
+            "top_p": 0.95,
+            "return_full_text": False
+        }
+    }
+
+def extract_text(result) -> str:
+    """Hugging Face returns list with generated_text"""
+    if isinstance(result, list) and len(result) > 0:
+        return result[0].get("generated_text", "")
+    return result.get("generated_text", "")
+
+def error_message(status_code: int) -> str:
+    """Starts with "Error" like every handler failure, so caches and the router treat it as one."""
+    if status_code == 429:
+        return "Error: Rate limit reached. Please try again in a moment."
+    if status_code == 503:
+        return "Error: Model is loading. Please try again in 20 seconds."
+    return f"Error: Hugging Face API error: {status_code}"
+
+def call_huggingface(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Calls Hugging Face Inference API with Mixtral-8x7B.
+    Uses same Elon-style persona prompt as Groq.
+    """
+    if not api_key:
+        return "Error: HUGGINGFACE_API_KEY not set in .env"
+
+    try:
         # DEBUG: Print what we're sending
         print(f"[DEBUG] Using model: Mistral-7B-Instruct-v0.2 via Hugging Face")
         print(f"[DEBUG] User question: {user_message}")
@@ -91,25 +98,12 @@ Response:"""
             "Content-Type": "application/json"
         }
         
-        payload = {
-            "inputs": enforced_user_message,
-            "parameters": {
-                "max_new_tokens": 300,
-                "temperature": 0.4,
-                "top_p": 0.95,
-                "return_full_text": False
-            }
-        }
+        payload = build_payload(user_message)
         
         response = requests.post(API_URL, headers=headers, json=payload, timeout=30)
         
         if response.status_code == 200:
-            result = response.json()
-            # Hugging Face returns list with generated_text
-            if isinstance(result, list) and len(result) > 0:
-                response_text = result[0].get("generated_text", "")
-            else:
-                response_text = result.get("generated_text", "")
+            response_text = extract_text(response.json())
                 
             print(f"[DEBUG] Raw response length: {len(response_text)} chars")
             print(f"[DEBUG] Response preview: {response_text[:200]}")
@@ -119,13 +113,37 @@ Response:"""
             
             return validate_response(response_text, rules)
         else:
-            error_msg = f"Hugging Face API error: {response.status_code}"
-            if response.status_code == 429:
-                error_msg = "Rate limit reached. Please try again in a moment."
-            elif response.status_code == 503:
-                error_msg = "Model is loading. Please try again in 20 seconds."
+            error_msg = error_message(response.status_code)
             print(f"[DEBUG] Error: {response.text}")
             return error_msg
 
     except Exception as e:
         return f"Error calling Hugging Face: {str(e)}"
+
+async def call_huggingface_async(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Async version of call_huggingface for the /chat handler.
+    """
+    if not api_key:
+        return "Error: HUGGINGFACE_API_KEY not set in .env"
+
+    try:
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+        async with httpx.AsyncClient(timeout=30) as http:
+            response = await http.post(API_URL, headers=headers, json=build_payload(user_message, rules.get("max_tokens", 300)))
+
+        if response.status_code != 200:
+            return error_message(response.status_code)
+
+        response_text = extract_text(response.json())
+        if not response_text:
+            return "Error: Empty response from Hugging Face."
+
+        return validate_response(response_text, rules)
+
+    except Exception as e:
+        return f"Error calling Hugging Face: {str(e)}"
@@ -0,0 +1,243 @@
+"""
+Offline IP -> country lookup for /api/detect-country.
+Replaces the per-request ipapi.co call (network, 1,000/day, 2 s timeout) with a
+local range table: a binary file, memory-mapped, holding sorted range starts,
+range ends and a country index as flat integer arrays, searched with bisect.
+A lookup is a few microseconds with no I/O once the pages are warm.
+
+File layout (little-endian):
+    header   b"IPCC", version u16, n_countries u16, n_v4 u32, n_v6 u32
+    countries  n_countries * 2 ASCII bytes
+    v4         starts u32[n_v4], ends u32[n_v4], country u16[n_v4]
+    v6         starts as high/low u64 halves [n_v6] each, ends likewise, country u16[n_v6]
+
+Build it from CSV range dumps (DB-IP / IP2Location lite style rows:
+start, end, country[, ...]; start/end as IP strings or integers):
+
+    python ip_country_db.py build dbip-country-lite.csv -o ip_country.bin
+    python ip_country_db.py lookup ip_country.bin 8.8.8.8 2001:4860::8888
+"""
+import argparse
+import csv
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, Optional, Tuple
+
+# Config
+IP_COUNTRY_DB = os.getenv("IP_COUNTRY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ip_country.bin"))
+
+MAGIC = b"IPCC"
+VERSION = 1
+MASK64 = (1 << 64) - 1
+HEADER = struct.Struct("<4sHHII")
+V4_MAPPED = (0xFFFF << 32, (0xFFFF << 32) | 0xFFFFFFFF)
+# Placeholders used by the public dumps for "no country"
+UNKNOWN_COUNTRIES = {"", "-", "ZZ", "--"}
+
+
+class IPCountryDB:
+    """Memory-mapped range table. Cheap to open; the OS pages data in on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        magic, version, n_countries, n_v4, n_v6 = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an IP country database (version {VERSION})")
+        offset = HEADER.size
+        codes = bytes(view[offset:offset + 2 * n_countries]).decode("ascii")
+        self.countries = [codes[i:i + 2] for i in range(0, len(codes), 2)]
+        offset += 2 * n_countries
+
+        self.v4_starts, offset = self._ints(view, offset, "I", n_v4)
+        self.v4_ends, offset = self._ints(view, offset, "I", n_v4)
+        self.v4_country, offset = self._ints(view, offset, "H", n_v4)
+        # 128-bit values as two u64 arrays, so bisect runs in C over plain machine ints
+        self.v6_starts_hi, offset = self._ints(view, offset, "Q", n_v6)
+        self.v6_starts_lo, offset = self._ints(view, offset, "Q", n_v6)
+        self.v6_ends_hi, offset = self._ints(view, offset, "Q", n_v6)
+        self.v6_ends_lo, offset = self._ints(view, offset, "Q", n_v6)
+        self.v6_country, offset = self._ints(view, offset, "H", n_v6)
+
+    @staticmethod
+    def _ints(view: memoryview, offset: int, code: str, count: int):
+        size = array(code).itemsize * count
+        raw = view[offset:offset + size]
+        if sys.byteorder == "little":
+            return raw.cast(code), offset + size     # zero-copy over the mapping
+        values = array(code, raw.tobytes())
+        values.byteswap()
+        return values, offset + size
+
+    @property
+    def ranges(self) -> Tuple[int, int]:
+        return len(self.v4_starts), len(self.v6_starts_hi)
+
+    def lookup_int(self, value: int, v6: bool) -> Optional[str]:
+        if not v6:
+            i = bisect_right(self.v4_starts, value) - 1
+            if i >= 0 and value <= self.v4_ends[i]:
+                return self.countries[self.v4_country[i]]
+            return None
+
+        # Last start <= value in (hi, lo) order: find the run of equal high halves, then bisect the low halves
+        hi, lo = value >> 64, value & MASK64
+        first = bisect_left(self.v6_starts_hi, hi)
+        run_end = bisect_right(self.v6_starts_hi, hi, first)
+        i = bisect_right(self.v6_starts_lo, lo, first, run_end) - 1 if run_end > first else first - 1
+        if i < first:
+            i = first - 1
+        if i >= 0 and (hi, lo) <= (self.v6_ends_hi[i], self.v6_ends_lo[i]):
+            return self.countries[self.v6_country[i]]
+        return None
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """Two-letter country code, or None for unknown, private or malformed addresses."""
+        try:
+            return self.lookup_int(int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), "big"), False)
+        except OSError:
+            pass
+        try:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address.split("%", 1)[0]), "big")
+        except (OSError, ValueError):
+            return None
+        if V4_MAPPED[0] <= value <= V4_MAPPED[1]:
+            return self.lookup_int(value & 0xFFFFFFFF, False)
+        return self.lookup_int(value, True)
+
+    def close(self):
+        # Views into the mapping must go before the mapping itself
+        self.v4_starts = self.v4_ends = self.v4_country = self.v6_country = None
+        self.v6_starts_hi = self.v6_starts_lo = self.v6_ends_hi = self.v6_ends_lo = None
+        self._mm.close()
+
+
+def _parse_ip(field: str) -> Tuple[int, bool]:
+    field = field.strip()
+    if field.isdigit():
+        value = int(field)
+        return value, value > 0xFFFFFFFF
+    address = ipaddress.ip_address(field)
+    return int(address), address.version == 6
+
+
+def read_csv(path: str) -> Iterable[Tuple[int, int, bool, str]]:
+    """(start, end, is_v6, country) per usable row; header and no-country rows are skipped."""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                start, start_v6 = _parse_ip(row[0])
+                end, end_v6 = _parse_ip(row[1])
+            except ValueError:
+                continue   # header line
+            country = row[2].strip().upper()
+            if country in UNKNOWN_COUNTRIES:
+                continue
+            if start_v6 != end_v6 or end < start or len(country) != 2:
+                raise ValueError(f"{path}: bad range row {row}")
+            yield start, end, start_v6, country
+
+
+def _merge(ranges: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """Sorts ranges, joins touching same-country ones and rejects overlaps."""
+    merged: List[Tuple[int, int, str]] = []
+    for start, end, country in sorted(ranges):
+        if merged:
+            last_start, last_end, last_country = merged[-1]
+            if country == last_country and last_start <= start and end <= last_end:
+                continue   # same range from two dumps
+            if start <= last_end:
+                raise ValueError(f"overlapping ranges at {start} ({last_country} / {country})")
+            if start == last_end + 1 and country == last_country:
+                merged[-1] = (last_start, end, country)
+                continue
+        merged.append((start, end, country))
+    return merged
+
+
+def build(rows: Iterable[Tuple[int, int, bool, str]], path: str) -> Tuple[int, int]:
+    """Writes the database file; returns (IPv4 ranges, IPv6 ranges)."""
+    v4, v6 = [], []
+    for start, end, is_v6, country in rows:
+        if is_v6 and V4_MAPPED[0] <= start and end <= V4_MAPPED[1]:
+            # ::ffff:a.b.c.d rows (IPv6 dumps repeat the IPv4 space this way); lookups map them to IPv4
+            start, end, is_v6 = start & 0xFFFFFFFF, end & 0xFFFFFFFF, False
+        (v6 if is_v6 else v4).append((start, end, country))
+    v4, v6 = _merge(v4), _merge(v6)
+    countries = sorted({c for _, _, c in v4} | {c for _, _, c in v6})
+    index = {c: i for i, c in enumerate(countries)}
+
+    def packed(code, values):
+        values = array(code, values)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tobytes()
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(countries), len(v4), len(v6)))
+        f.write("".join(countries).encode("ascii"))
+        f.write(packed("I", [s for s, _, _ in v4]))
+        f.write(packed("I", [e for _, e, _ in v4]))
+        f.write(packed("H", [index[c] for _, _, c in v4]))
+        f.write(packed("Q", [s >> 64 for s, _, _ in v6]))
+        f.write(packed("Q", [s & MASK64 for s, _, _ in v6]))
+        f.write(packed("Q", [e >> 64 for _, e, _ in v6]))
+        f.write(packed("Q", [e & MASK64 for _, e, _ in v6]))
+        f.write(packed("H", [index[c] for _, _, c in v6]))
+    # Atomic swap: a running worker keeps its old mapping, new opens see the new file
+    os.replace(tmp, path)
+    return len(v4), len(v6)
+
+
+_db: Optional[IPCountryDB] = None
+_db_missing = False
+
+
+def get_db() -> Optional[IPCountryDB]:
+    """The database at IP_COUNTRY_DB, opened on first use; None if no file is installed."""
+    global _db, _db_missing
+    if _db is None and not _db_missing:
+        try:
+            _db = IPCountryDB(IP_COUNTRY_DB)
+            print(f"IP country DB loaded: {_db.ranges[0]} IPv4 / {_db.ranges[1]} IPv6 ranges")
+        except FileNotFoundError:
+            _db_missing = True
+            print(f"IP country DB not found at {IP_COUNTRY_DB}; using the ipapi.co fallback")
+    return _db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the offline IP -> country database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="build the database from CSV range dumps")
+    build_cmd.add_argument("csv", nargs="+", help="CSV files with start,end,country rows (IPv4 and/or IPv6)")
+    build_cmd.add_argument("-o", "--output", default=IP_COUNTRY_DB)
+    lookup_cmd = commands.add_parser("lookup", help="look up addresses in a built database")
+    lookup_cmd.add_argument("db")
+    lookup_cmd.add_argument("ips", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        rows = (row for path in args.csv for row in read_csv(path))
+        n_v4, n_v6 = build(rows, args.output)
+        print(f"Wrote {args.output}: {n_v4} IPv4 ranges, {n_v6} IPv6 ranges ({os.path.getsize(args.output)} bytes)")
+    else:
+        db = IPCountryDB(args.db)
+        for ip in args.ips:
+            print(f"{ip}\t{db.lookup(ip) or '-'}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import os
-import requests
+from supabase_session import supabase_session
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,16 +9,10 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 def list_all_ips():
     """List all IP addresses in the database"""
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     url = f"{SUPABASE_URL}/rest/v1/users?select=ip_address,msg_count,plan"
     
     try:
-        resp = requests.get(url, headers=headers)
+        resp = supabase_session.request("GET", url, SUPABASE_KEY)
         if resp.status_code == 200:
             users = resp.json()
             print(f"\n📊 Found {len(users)} IP addresses:\n")
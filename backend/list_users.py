@@ -1,5 +1,5 @@
 import os
-import requests
+from supabase_session import supabase_session
 import json
 from dotenv import load_dotenv
 
@@ -11,14 +11,9 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY") # Service Role Key
 def list_all_users():
     # 1. Fetch from public.users (Our Metadata Table)
     url = f"{SUPABASE_URL}/rest/v1/users?select=*"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-    }
-    
     print(f"Checking Database Table: {url}")
     try:
-        resp = requests.get(url, headers=headers)
+        resp = supabase_session.request("GET", url, SUPABASE_KEY)
         if resp.status_code == 200:
             users = resp.json()
             print(f"\n✅ DATABASE IS HEALTHY! Found {len(users)} users in your table:")
@@ -1,12 +1,25 @@
 import ollama
 
+from response_validator import validate_response
+
+OLLAMA_MODEL = 'mistral'
+
+# Async client for the FastAPI chat path
+async_client = ollama.AsyncClient()
+
+def trim_words(content: str, max_words: int = 120) -> str:
+    words = content.split()
+    if len(words) > max_words:
+        content = " ".join(words[:max_words]) + "..."
+    return content
+
 def call_ollama(system_prompt: str, user_message: str) -> str:
     """
     Calls the local Ollama Mistral 7B model with the given system prompt and user message.
     Enforces a strict word count limit of 120 words.
     """
     try:
-        response = ollama.chat(model='mistral', messages=[
+        response = ollama.chat(model=OLLAMA_MODEL, messages=[
             {'role': 'system', 'content': system_prompt},
             {'role': 'user', 'content': user_message},
         ])
@@ -14,11 +27,25 @@ def call_ollama(system_prompt: str, user_message: str) -> str:
         content = response['message']['content']
         
         # Enforce max 120 words response strictly by trimming
-        words = content.split()
-        if len(words) > 120:
-            content = " ".join(words[:120]) + "..."
-            
-        return content
+        return trim_words(content)
     except Exception as e:
         # Simple error handling as per "don't over-engineer" rule, but good to have basic feedback
         return f"Error calling Ollama: {str(e)}"
+
+async def call_ollama_async(system_prompt: str, user_message: str, rules: dict = {}) -> str:
+    """
+    Async version of call_ollama for the /chat handler.
+    The persona's max_words and forbidden_phrases apply, as for the other providers.
+    """
+    try:
+        options = {'num_predict': rules['max_tokens']} if rules.get('max_tokens') else None
+        response = await async_client.chat(model=OLLAMA_MODEL, messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_message},
+        ], options=options)
+        content = response['message']['content']
+        if not content:
+            return "Error: Empty response from Ollama."
+        return validate_response(content, rules)
+    except Exception as e:
+        return f"Error calling Ollama: {str(e)}"
@@ -0,0 +1,311 @@
+"""
+Latency-aware LLM provider router.
+Tracks rolling latency and error rate per provider, trips a circuit breaker on
+failing providers, and sends each chat to the fastest healthy one.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from chat_pipeline import AsyncProvider, is_error_reply
+from metrics import LatencyWindow
+
+# Config
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "groq")
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "30"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+OUTCOME_WINDOW = 50
+
+# Hedging: fire a second provider when the first is slower than its usual tail
+CHAT_HEDGING = os.getenv("CHAT_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "250"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "5000"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_BUDGET_PERCENT = float(os.getenv("HEDGE_BUDGET_PERCENT", "10"))
+HEDGE_BUDGET_BURST = 10.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderUnavailable(Exception):
+    """Raised when every provider failed or is tripped."""
+
+
+class CircuitBreaker:
+    """
+    Closed: calls flow, outcomes are recorded.
+    Open: calls are refused until the cooldown passes.
+    Half-open: one trial call decides whether to close again or re-open.
+    """
+
+    def __init__(self, error_rate: float = BREAKER_ERROR_RATE, min_calls: int = BREAKER_MIN_CALLS,
+                 cooldown: float = BREAKER_COOLDOWN, clock: Callable[[], float] = time.monotonic):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self._clock() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record(self, ok: bool, recent_error_rate: float, recent_calls: int):
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+            if ok:
+                self.state = CLOSED
+            else:
+                self._trip()
+            return
+        if self.state == CLOSED and recent_calls >= self.min_calls and recent_error_rate >= self.error_rate:
+            self._trip()
+
+    def abandon(self):
+        """The trial call was cancelled before it finished; let another one through."""
+        self._trial_in_flight = False
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = self._clock()
+        self.trips += 1
+
+
+class ProviderHealth:
+    """Rolling latency and outcome window for one provider."""
+
+    def __init__(self, name: str, breaker: CircuitBreaker):
+        self.name = name
+        self.breaker = breaker
+        self.latency = LatencyWindow(size=OUTCOME_WINDOW * 4)
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW)
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, ok: bool, elapsed_ms: float):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latency.observe(elapsed_ms)
+        else:
+            self.errors += 1
+        was_half_open = self.breaker.state == HALF_OPEN
+        self.breaker.record(ok, self.error_rate(), len(self.outcomes))
+        if was_half_open and self.breaker.state == CLOSED:
+            # Recovered: judge it on fresh outcomes, not the ones that tripped it
+            self.outcomes.clear()
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 4),
+            "p50_ms": self.latency.percentile(50),
+            "p95_ms": self.latency.percentile(95),
+            "trips": self.breaker.trips,
+        }
+
+
+class HedgeBudget:
+    """
+    Caps hedges to a percentage of requests.
+    Every request deposits percent/100 of a token (up to a small burst),
+    every hedge spends a whole one.
+    """
+
+    def __init__(self, percent: float = HEDGE_BUDGET_PERCENT, burst: float = HEDGE_BUDGET_BURST):
+        self.ratio = percent / 100
+        self.burst = burst
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.denied = 0
+
+    def on_request(self):
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.hedges += 1
+            return True
+        self.denied += 1
+        return False
+
+    def refund(self):
+        """Returns a token when there turned out to be nobody to hedge to."""
+        self.tokens += 1.0
+        self.hedges -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "budget_percent": round(self.ratio * 100, 2),
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "denied": self.denied,
+            "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class LLMRouter:
+    """
+    Routes each call to the healthy provider with the lowest rolling p50.
+    Providers without latency samples yet are tried first so they get measured.
+    On failure the next candidate is tried within the same request.
+
+    With hedging on, if the chosen provider has not answered by its recent
+    HEDGE_PERCENTILE latency, the same request is sent to the next healthy
+    provider (within the hedge budget); the first good reply wins and the
+    other call is cancelled.
+    """
+
+    def __init__(self, providers: Dict[str, AsyncProvider], timeout: float = PROVIDER_TIMEOUT,
+                 breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker,
+                 hedging: bool = CHAT_HEDGING, hedge_budget: Optional[HedgeBudget] = None,
+                 hedge_min_delay_ms: float = HEDGE_MIN_DELAY_MS, hedge_min_samples: int = HEDGE_MIN_SAMPLES):
+        self.providers = providers
+        self.timeout = timeout
+        self.health = {name: ProviderHealth(name, breaker_factory()) for name in providers}
+        self.hedging = hedging
+        self.hedge_budget = hedge_budget or HedgeBudget()
+        self.hedge_min_delay_ms = hedge_min_delay_ms
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_wins = 0
+        self.__name__ = "llm_router"
+
+    def ranked(self) -> List[str]:
+        """Provider names ordered by preference (unmeasured first, then fastest p50)."""
+        def key(name):
+            p50 = self.health[name].latency.percentile(50)
+            return (p50 is not None, p50 or 0.0)
+        return sorted(self.providers, key=key)
+
+    async def call_provider(self, name: str, system_prompt: str, user_message: str, rules: dict) -> Optional[str]:
+        """Calls one provider and records the outcome. Returns None on failure."""
+        health = self.health[name]
+        start = time.perf_counter()
+        try:
+            text = await asyncio.wait_for(self.providers[name](system_prompt, user_message, rules), self.timeout)
+            ok = not is_error_reply(text)
+        except asyncio.CancelledError:
+            # Lost a hedge race (or the client went away). Not an error, but the
+            # elapsed time is a lower bound on its latency, so keep it in the window.
+            health.breaker.abandon()
+            health.latency.observe((time.perf_counter() - start) * 1000)
+            raise
+        except Exception as e:
+            print(f"[router] {name} failed: {type(e).__name__}: {e}")
+            text, ok = None, False
+        health.record(ok, (time.perf_counter() - start) * 1000)
+        return text if ok else None
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """Seconds to wait on `name` before hedging, or None until it has enough samples."""
+        window = self.health[name].latency
+        if window.count < self.hedge_min_samples:
+            return None
+        delay_ms = min(max(window.percentile(HEDGE_PERCENTILE), self.hedge_min_delay_ms), HEDGE_MAX_DELAY_MS)
+        return delay_ms / 1000
+
+    async def _hedged(self, primary: str, candidates: List[str], system_prompt: str,
+                      user_message: str, rules: dict) -> Optional[str]:
+        """Calls primary; after its hedge delay, races the next healthy candidate against it."""
+        primary_task = asyncio.ensure_future(self.call_provider(primary, system_prompt, user_message, rules))
+        delay = self.hedge_delay(primary)
+        if delay is not None:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if not done and self.hedge_budget.try_spend():
+                secondary = next((n for n in candidates if self.health[n].breaker.allow()), None)
+                if secondary:
+                    return await self._race(primary_task, secondary, system_prompt, user_message, rules)
+                self.hedge_budget.refund()
+        return await primary_task
+
+    async def _race(self, primary_task: asyncio.Task, secondary: str, system_prompt: str,
+                    user_message: str, rules: dict) -> Optional[str]:
+        secondary_task = asyncio.ensure_future(self.call_provider(secondary, system_prompt, user_message, rules))
+        pending = {primary_task, secondary_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    text = task.result()
+                    if text is not None:
+                        if task is secondary_task:
+                            self.hedge_wins += 1
+                        return text
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def __call__(self, system_prompt: str, user_message: str, rules: dict = {}) -> str:
+        self.hedge_budget.on_request()
+        ranked = self.ranked()
+        tried = 0
+        for i, name in enumerate(ranked):
+            if not self.health[name].breaker.allow():
+                continue
+            tried += 1
+            if self.hedging:
+                text = await self._hedged(name, ranked[i + 1:], system_prompt, user_message, rules)
+            else:
+                text = await self.call_provider(name, system_prompt, user_message, rules)
+            if text is not None:
+                return text
+        if not tried:
+            raise ProviderUnavailable("All LLM providers are tripped")
+        return "Error: all LLM providers failed. Please try again."
+
+    def stats(self) -> dict:
+        stats = {name: health.snapshot() for name, health in self.health.items()}
+        if self.hedging:
+            stats["hedging"] = {**self.hedge_budget.snapshot(), "hedge_wins": self.hedge_wins}
+        return stats
+
+
+def load_providers(names: str = LLM_PROVIDERS) -> Dict[str, AsyncProvider]:
+    """
+    Builds the provider map from a comma-separated list (LLM_PROVIDERS env).
+    Handlers are imported lazily so optional SDKs are only needed when enabled.
+    """
+    providers = {}
+    for name in [n.strip() for n in names.split(",") if n.strip()]:
+        if name == "groq":
+            from groq_handler import call_groq_async
+            providers[name] = call_groq_async
+        elif name == "claude":
+            from claude_handler import call_claude_async
+            providers[name] = call_claude_async
+        elif name == "huggingface":
+            from huggingface_handler import call_huggingface_async
+            providers[name] = call_huggingface_async
+        elif name == "ollama":
+            from llm_handler import call_ollama_async
+            providers[name] = call_ollama_async
+        else:
+            print(f"[router] Unknown provider '{name}', skipping")
+    return providers
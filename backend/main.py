@@ -1,11 +1,27 @@
+import asyncio
+from functools import partial
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from groq_handler import call_groq
+from groq_handler import stream_groq, completion_params
 # HUGGING FACE (Network issues - DNS resolution failed)
 # from huggingface_handler import call_huggingface
-from database import check_can_chat, save_contact_submission
-import json
+from async_database import async_supabase, save_contact_submission
+from geolocation import geo_cache
+from password_hasher import password_hasher
+from payments import apply_razorpay_event, event_id as razorpay_event_id, verify_signature
+from gumroad_handler import GUMROAD_WEBHOOKS_ENABLED, apply_gumroad_event, parse_ping, ping_event_id
+from quota_cache import QUOTA_CACHE_ENABLED, check_quota, quota_cache
+from subscription_expiry import EXPIRY_ENABLED, subscription_expiry
+from supabase_session import supabase_session
+from chat_pipeline import chat_limiter, generate_reply, stream_chat, replay_cached, sse_event, ChatOverloaded
+from response_cache import response_cache, make_cache_key
+from semantic_cache import SEMANTIC_CACHE_ENABLED, semantic_cache, semantic_namespace
+from single_flight import chat_flight
+from llm_router import LLMRouter, ProviderUnavailable, load_providers
+from metrics import metrics
+from webhook_inbox import webhook_inbox
 import os
 import uvicorn
 from dotenv import load_dotenv
@@ -38,6 +54,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Provider router (LLM_PROVIDERS=groq,claude,huggingface,ollama). Defaults to Groq only.
+chat_router = LLMRouter(load_providers())
+
 class ChatRequest(BaseModel):
     message: str
     persona: str = "elon"  # Default to Elon
@@ -47,13 +66,6 @@ class ContactRequest(BaseModel):
     email: str
     message: str
 
-def load_persona():
-    try:
-        with open("persona.json", "r") as f:
-            return json.load(f)
-    except:
-        return {}
-
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     print(f"Incoming Request: {request.method} {request.url}")
@@ -63,50 +75,155 @@ async def log_requests(request: Request, call_next):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "backend": "serverless-groq"}
+    return {"status": "ok", "backend": "serverless-groq", "chat": chat_limiter.stats()}
 
 from auth import router as auth_router
 from middleware.auth_middleware import get_user_identifier
-from personas import get_persona_prompt, is_valid_persona, PERSONA_DATA
+from personas import PERSONA_DATA
+from persona_registry import persona_registry
 
 app.include_router(auth_router)
 
-@app.post("/chat")
-async def chat(request: ChatRequest, raw_request: Request):
+@app.on_event("startup")
+async def start_quota_flusher():
+    if QUOTA_CACHE_ENABLED:
+        quota_cache.start()
+
+@app.on_event("shutdown")
+async def stop_quota_flusher():
+    # Writes the last batch of chat increments before the worker exits
+    if QUOTA_CACHE_ENABLED:
+        await asyncio.to_thread(quota_cache.stop)
+
+@app.on_event("shutdown")
+async def close_supabase_client():
+    await async_supabase.aclose()
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    await asyncio.to_thread(password_hasher.shutdown)
+
+@app.on_event("startup")
+async def start_subscription_expiry():
+    # Loads the end-date index before the first chat, then sweeps on a timer
+    if EXPIRY_ENABLED:
+        await asyncio.to_thread(subscription_expiry.start)
+
+@app.on_event("shutdown")
+async def stop_subscription_expiry():
+    if EXPIRY_ENABLED:
+        await asyncio.to_thread(subscription_expiry.stop)
+
+@app.on_event("startup")
+async def start_webhook_inbox():
+    webhook_inbox.register("razorpay", apply_razorpay_event)
+    webhook_inbox.register("gumroad", apply_gumroad_event)
+    webhook_inbox.start()
+
+@app.on_event("shutdown")
+async def stop_webhook_inbox():
+    # Unfinished events stay in the inbox and are picked up on the next start
+    await asyncio.to_thread(webhook_inbox.stop)
+
+async def prepare_chat(request: ChatRequest, raw_request: Request):
+    """
+    Shared setup for /chat and /chat/stream.
+    Returns (persona, limit_status) or raises 402.
+    """
     print(f"Received Message: {request.message}")
     print(f"Requested Persona: {request.persona}")
     
-    # 1. Validate persona
-    persona_id = request.persona if is_valid_persona(request.persona) else "elon"
-    if persona_id != request.persona:
-        print(f"Invalid persona '{request.persona}', defaulting to 'elon'")
+    # 1. Resolve persona (compiled prompt + rules, hot-reloaded from persona.json)
+    persona = persona_registry.get(request.persona)
+    if persona.id != request.persona:
+        print(f"Invalid persona '{request.persona}', defaulting to '{persona.id}'")
     
-    # 2. Load persona rules (for validation)
-    rules = load_persona()
-    
-    # 3. Check Limits (Database)
+    # 2. Check Limits (Database)
     user_identifier = get_user_identifier(raw_request)
-    limit_status = check_can_chat(user_identifier)
+    limit_status = await check_quota(user_identifier)
     
     if not limit_status['allowed']:
         # Return 402 Payment Required with details
         raise HTTPException(status_code=402, detail=limit_status)
 
-    # 4. Get system prompt for selected persona
-    system_prompt = get_persona_prompt(persona_id)
+    return persona, limit_status
+
+@app.post("/chat")
+async def chat(request: ChatRequest, raw_request: Request):
+    persona, limit_status = await prepare_chat(request, raw_request)
     
-    # 5. Call Groq API (Llama 3.3 70B) with persona-specific prompt
-    response_text = call_groq(system_prompt, request.message, rules)
-    print(f"Generated Response from {persona_id}: {response_text[:50]}...") # Log partial response
+    # 3. Call the fastest healthy provider (Groq by default) with persona-specific prompt
+    # Awaited through the limiter so a slow completion never blocks other requests.
+    # Exact repeats and near-duplicates are served from cache (quota was already charged above).
+    cache_key = make_cache_key(persona.id, request.message, completion_params(persona.max_tokens), persona.fingerprint)
+    namespace = (semantic_namespace(persona.id, completion_params(persona.max_tokens), persona.fingerprint)
+                 if SEMANTIC_CACHE_ENABLED else None)
+    try:
+        response_text = await generate_reply(chat_router, persona.system_prompt, request.message, persona.rules,
+                                             cache_key=cache_key, semantic_namespace=namespace)
+    except ChatOverloaded:
+        raise HTTPException(status_code=503, detail="Too many chats in flight. Please retry.")
+    except ProviderUnavailable:
+        raise HTTPException(status_code=503, detail="AI providers are temporarily unavailable. Please retry.")
+    print(f"Generated Response from {persona.id}: {response_text[:50]}...") # Log partial response
     
-    # 6. Return
+    # 4. Return
     return {
         "response": response_text,
-        "persona": persona_id,
+        "persona": persona.id,
         "remaining_free": limit_status.get('remaining', 0),
         "plan": limit_status.get('plan', 'unknown')
     }
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, raw_request: Request):
+    """
+    Server-sent events version of /chat.
+    Emits a "meta" event, then "token" events as Groq generates, then "done".
+    """
+    persona, limit_status = await prepare_chat(request, raw_request)
+    cache_key = make_cache_key(persona.id, request.message, completion_params(persona.max_tokens), persona.fingerprint)
+    cached = response_cache.get(cache_key)
+
+    async def events():
+        yield sse_event("meta", {
+            "persona": persona.id,
+            "remaining_free": limit_status.get('remaining', 0),
+            "plan": limit_status.get('plan', 'unknown')
+        })
+        if cached is not None:
+            stream = replay_cached(cached)
+        else:
+            # max_tokens sized from the persona's word cap; the stream is also cut at the cap
+            stream = stream_chat(partial(stream_groq, max_tokens=persona.max_tokens), persona.system_prompt, request.message, persona.rules,
+                                 on_complete=lambda text: response_cache.put(cache_key, text))
+        async for event in stream:
+            yield event
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "chat": chat_limiter.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "single_flight": chat_flight.stats(),
+        "providers": chat_router.stats(),
+        "quota": quota_cache.stats(),
+        "supabase": supabase_session.stats(),
+        "supabase_async": async_supabase.stats(),
+        "password_hasher": password_hasher.stats(),
+        "geo": geo_cache.stats(),
+        "expiry": subscription_expiry.stats(),
+        "webhooks": await asyncio.to_thread(webhook_inbox.stats),
+        **metrics.snapshot()
+    }
+
 # --- Contact Form Route ---
 
 @app.post("/contact")
@@ -125,7 +242,7 @@ async def submit_contact(request: ContactRequest, raw_request: Request):
     user_agent = raw_request.headers.get("user-agent", "")
     
     # Save to database
-    result = save_contact_submission(
+    result = await save_contact_submission(
         name=request.name,
         email=request.email,
         message=request.message,
@@ -150,74 +267,37 @@ async def create_payment_order():
 
 @app.post("/webhooks/razorpay")
 async def razorpay_webhook(request: Request):
-    # In a real app, verify signature here
-    # body = await request.body()
-    # verify_signature(body, request.headers.get('X-Razorpay-Signature'))
-    
-    # Logic to upgrade user to 'pro' using database.py (omitted for brevity in this step)
+    """
+    Verifies and stores the event, then acks; a webhook inbox worker applies it.
+    Redeliveries of an event id are acked without being applied again.
+    """
+    body = await request.body()
+    if not verify_signature(body, request.headers.get("X-Razorpay-Signature", "")):
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    event = razorpay_event_id(body, request.headers.get("X-Razorpay-Event-Id"))
+    await asyncio.to_thread(webhook_inbox.enqueue, "razorpay", event, body)
     return {"status": "ok"}
 
+if GUMROAD_WEBHOOKS_ENABLED:
+    @app.post("/webhooks/gumroad")
+    async def gumroad_webhook(request: Request):
+        """Stores the ping and acks; the worker verifies the sale and grants or revokes access."""
+        body = await request.body()
+        try:
+            fields = parse_ping(body)
+        except UnicodeDecodeError:
+            fields = {}
+        if not fields.get("sale_id"):
+            raise HTTPException(status_code=400, detail="Missing sale_id")
+        await asyncio.to_thread(webhook_inbox.enqueue, "gumroad", ping_event_id(fields), body)
+        return {"status": "ok"}
+
 # ============================================
 # GUMROAD INTEGRATION - FROZEN FOR LAUNCH
 # ============================================
 #
 # 
-# # @app.post("/webhooks/gumroad")
-# async def gumroad_webhook(request: Request):
-#     """
-#     Handle Gumroad webhook events (purchase, refund, cancellation).
-#     Called by Gumroad when a sale or refund occurs.
-#     """
-#     try:
-#         from gumroad_handler import verify_sale, grant_premium_access, revoke_premium_access, get_sale_email
-#         from database import get_supabase_client
-#         
-#         body = await request.json()
-#         
-        # Extract sale info from webhook
-#         sale_id = body.get("sale_id")
-#         seller_id = body.get("seller_id")
-#         product_permalink = body.get("product_permalink")
-#         email = body.get("email")
-#         refunded = body.get("refunded", False)
-#         disputed = body.get("disputed", False)
-#         
-#         if not sale_id:
-#             raise HTTPException(status_code=400, detail="Missing sale_id")
-#         
-        # Verify sale with Gumroad API
-#         sale_data = verify_sale(sale_id)
-#         if not sale_data:
-#             raise HTTPException(status_code=400, detail="Invalid sale")
-#         
-#         supabase = get_supabase_client()
-#         
-        # Handle refund/dispute
-#         if refunded or disputed:
-#             success = revoke_premium_access(sale_id, supabase)
-#             return {"status": "revoked" if success else "error"}
-#         
-        # Handle new purchase - AUTO-GRANT PREMIUM ACCESS
-        # Get buyer email from Gumroad
-#         buyer_email = email or get_sale_email(sale_id)
-#         
-#         if buyer_email:
-            # Automatically grant premium access
-#             success = grant_premium_access(buyer_email, sale_id, supabase)
-#             
-#             if success:
-#                 print(f"✅ Auto-granted premium access to {buyer_email} (sale: {sale_id})")
-#                 return {"status": "premium_granted", "email": buyer_email}
-#             else:
-#                 print(f"❌ Failed to grant premium to {buyer_email} (sale: {sale_id})")
-#                 return {"status": "error", "message": "Failed to grant premium"}
-#         else:
-#             print(f"⚠️ No email found for sale {sale_id}")
-#             return {"status": "error", "message": "No email found"}
-#         
-#     except Exception as e:
-#         print(f"Gumroad webhook error: {e}")
-#         raise HTTPException(status_code=500, detail=str(e))
+# The Gumroad webhook is /webhooks/gumroad above (GUMROAD_WEBHOOKS_ENABLED=true).
 # 
 # 
 # # @app.post("/api/activate-premium")
@@ -227,7 +307,7 @@ async def razorpay_webhook(request: Request):
 #     Called when user clicks activation link from Gumroad receipt.
 #     """
 #     try:
-#         from gumroad_handler import verify_sale, grant_premium_access, get_sale_email
+#         from gumroad_handler import verify_sale, grant_premium_access
 #         from database import get_supabase_client
 #         from middleware.auth_middleware import get_user_from_token
 #         
@@ -243,8 +323,8 @@ async def razorpay_webhook(request: Request):
 #         if not sale_data:
 #             raise HTTPException(status_code=400, detail="Invalid sale")
 #         
-        # Get buyer email from Gumroad
-#         gumroad_email = get_sale_email(sale_id)
+        # Buyer email from the same (cached) sale record
+#         gumroad_email = sale_data.get("email")
 #         if not gumroad_email:
 #             raise HTTPException(status_code=400, detail="Could not retrieve purchase email")
 #         
@@ -321,20 +401,18 @@ async def detect_country(request: Request):
     Detect user's country from IP address for payment provider selection.
     """
     try:
-        from geolocation import get_country_from_ip, get_payment_provider
-        
         client_ip = request.client.host if request.client else None
         
         if not client_ip:
             return {"country": None, "payment_provider": "gumroad"}
         
-        country = get_country_from_ip(client_ip)
-        provider = get_payment_provider(client_ip)
+        # One cached resolution gives both answers (was two ipapi.co calls per request)
+        geo = await geo_cache.resolve_async(client_ip)
         
         return {
-            "country": country,
-            "payment_provider": provider,
-            "is_india": country == "IN"
+            "country": geo.country,
+            "payment_provider": geo.payment_provider,
+            "is_india": geo.is_india
         }
         
     except Exception as e:
@@ -0,0 +1,77 @@
+"""
+In-process metrics.
+Counters, rolling latency windows and rolling value windows (token counts,
+ratios), exposed as JSON on GET /metrics.
+"""
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+# Samples kept per latency window
+WINDOW_SIZE = 1024
+
+
+class LatencyWindow:
+    """Rolling window of the most recent samples (milliseconds, unless used via observe_value)."""
+
+    def __init__(self, size: int = WINDOW_SIZE):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def observe(self, value_ms: float):
+        self._samples.append(value_ms)
+        self.count += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Metrics:
+    """Named counters, latency windows and value windows shared across the worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.values: Dict[str, LatencyWindow] = {}
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _observe(self, windows: Dict[str, LatencyWindow], name: str, value: float):
+        with self._lock:
+            window = windows.get(name)
+            if window is None:
+                window = windows[name] = LatencyWindow()
+            window.observe(value)
+
+    def observe(self, name: str, value_ms: float):
+        self._observe(self.latencies, name, value_ms)
+
+    def observe_value(self, name: str, value: float):
+        """Like observe, for samples that are not latencies (tokens, ratios)."""
+        self._observe(self.values, name, value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latency_ms": {name: w.snapshot() for name, w in self.latencies.items()},
+                "values": {name: w.snapshot() for name, w in self.values.items()},
+            }
+
+
+metrics = Metrics()
@@ -1,10 +1,115 @@
 from fastapi import Request
 import jwt
+import hashlib
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key")
 JWT_ALGORITHM = "HS256"
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens that already passed jwt.decode, keyed by the token's
+    SHA-256 digest (raw tokens are never kept as keys). Each entry holds the
+    decoded claims and is dropped at the token's own exp, so a cache hit is never
+    more permissive than decoding again.
+
+    revoke() puts a digest in a revocation set until the token expires, so logout
+    takes effect at once even though the JWT itself stays valid. The set is per
+    process: other workers stop honouring the token when their copy is revoked or
+    the cookie is gone.
+
+    Returned claims are shared between callers; treat them as read-only.
+    """
+
+    def __init__(self, max_entries: int = JWT_CACHE_SIZE, secret: str = None, clock=time.time):
+        self.max_entries = max_entries
+        self.secret = secret or SECRET_KEY
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest -> (exp, claims), least recently used first
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        # digest -> exp; kept only until the token would have expired anyway
+        self._revoked: Dict[bytes, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def decode(self, token: str) -> Optional[dict]:
+        """Verified claims for token, or None if it is invalid, expired or revoked."""
+        key = self._digest(token)
+        now = self._clock()
+        with self._lock:
+            revoked_until = self._revoked.get(key)
+            if revoked_until is not None:
+                if revoked_until > now:
+                    self.rejected += 1
+                    return None
+                del self._revoked[key]
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[JWT_ALGORITHM])
+        except jwt.PyJWTError:
+            with self._lock:
+                self.rejected += 1
+            return None
+
+        exp = claims.get("exp")
+        if exp is None:
+            # Nothing to expire the entry on; don't cache a token that never ends
+            return claims
+        with self._lock:
+            if key in self._revoked:
+                return None
+            self._entries[key] = (exp, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return claims
+
+    def revoke(self, token: str):
+        """Stops accepting token in this process until its exp."""
+        claims = self.decode(token)
+        if claims is None:
+            return
+        key = self._digest(token)
+        now = self._clock()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._revoked[key] = claims.get("exp") or now + 7 * 24 * 3600
+            if len(self._revoked) > self.max_entries:
+                self._revoked = {k: exp for k, exp in self._revoked.items() if exp > now}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "revoked": len(self._revoked),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+            }
+
+
+verified_tokens = VerifiedTokenCache()
+
 
 def get_user_identifier(request: Request) -> str:
     """
@@ -12,17 +117,18 @@ def get_user_identifier(request: Request) -> str:
     This allows backward compatibility with IP-based tracking.
     """
     token = request.cookies.get("auth_token")
-    
+
     if token:
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            
-            # Check if expired (should be handled by jwt.decode but good to be explicit)
-            if "exp" in payload and datetime.utcnow().timestamp() > payload["exp"]:
-                return request.client.host  # Expired, fallback to IP
-                
+        # Verified once, then served from the cache until exp; expired or revoked -> None
+        payload = verified_tokens.decode(token)
+        if payload:
             return payload.get("email", request.client.host)  # Valid logged-in user
-        except Exception:
-            pass
-    
+
+    # Access tokens are short-lived; the refresh token still names the user
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        payload = verified_tokens.decode(refresh_token)
+        if payload and payload.get("type") == "refresh":
+            return payload["email"]
+
     return request.client.host  # Fallback to IP
@@ -0,0 +1,243 @@
+"""
+Local stand-in for a ComfyUI server, for tests and offline runs.
+Serves POST /prompt, GET /history/:prompt_id and the /ws?clientId= websocket
+on one port. Queued prompts run on `workers` executors (ComfyUI itself runs
+one at a time) and report progress to the queueing client's websocket with
+the same events ComfyUI sends: execution_start, executing, executed,
+execution_cached, execution_error and the final `executing` with node=None.
+
+    server = MockComfyUI(run_time=0.05).start()
+    client = ComfyUIClient(address=server.address)
+    ...
+    server.stop()
+
+The reply is "[comfyui] reply to: <user_message>", reported as the output
+node's final_response.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from websockets.protocol import State
+from websockets.server import ServerProtocol
+
+OUTPUT_NODE = "5"
+INPUT_NODE = "3"
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class MockComfyUI:
+    """In-memory ComfyUI queue with configurable HTTP delay and run time."""
+
+    def __init__(self, latency: float = 0.0, run_time: float = 0.01, workers: int = 1):
+        self.latency = latency
+        # Seconds per prompt, or a callable taking the prompt
+        self.run_time = run_time
+        self.workers = workers
+        # Answer this many upcoming POST /prompt with 503
+        self.fail_next = 0
+        # Send error bodies as plain text, like a reverse proxy in front of ComfyUI
+        self.plain_errors = False
+        # Fail this many upcoming executions with execution_error
+        self.error_next = 0
+        # Report the output node as cached (no executed event; result only in /history)
+        self.cached = False
+        self.history: Dict[str, dict] = {}
+        self.requests = Counter()
+        self.ws_connections = 0
+        self.ws_messages = 0
+        self.lock = threading.Lock()
+        self._sockets: Dict[str, List[tuple]] = defaultdict(list)
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._address = ""
+        self._thread: Optional[threading.Thread] = None
+        self._number = 0
+
+    # --- Execution ----------------------------------------------------------
+
+    def _send(self, client_id: str, kind: str, data: dict):
+        message = json.dumps({"type": kind, "data": data}).encode("utf-8")
+        for protocol, writer in list(self._sockets.get(client_id, ())):
+            if protocol.state is State.OPEN:
+                protocol.send_text(message)
+                writer.write(b"".join(protocol.data_to_send()))
+                self.ws_messages += 1
+
+    async def _execute(self):
+        while True:
+            prompt_id, prompt, client_id = await self._queue.get()
+            send = lambda kind, **data: self._send(client_id, kind, {**data, "prompt_id": prompt_id})
+            send("execution_start", timestamp=int(time.time() * 1000))
+            for node in prompt:
+                send("executing", node=node, display_node=node)
+            delay = self.run_time(prompt) if callable(self.run_time) else self.run_time
+            if delay:
+                await asyncio.sleep(delay)
+            with self.lock:
+                failed = self.error_next > 0
+                if failed:
+                    self.error_next -= 1
+            if failed:
+                send("execution_error", node_id=OUTPUT_NODE, node_type=prompt[OUTPUT_NODE].get("class_type"),
+                     exception_message="simulated failure", exception_type="RuntimeError")
+                self.history[prompt_id] = {"prompt": prompt, "outputs": {},
+                                           "status": {"status_str": "error", "completed": False}}
+                continue
+            message = prompt.get(INPUT_NODE, {}).get("inputs", {}).get("user_message", "")
+            outputs = {OUTPUT_NODE: {"final_response": [f"[comfyui] reply to: {message}"]}}
+            if self.cached:
+                send("execution_cached", nodes=list(prompt))
+            else:
+                send("executed", node=OUTPUT_NODE, display_node=OUTPUT_NODE, output=outputs[OUTPUT_NODE])
+            self.history[prompt_id] = {"prompt": prompt, "outputs": outputs,
+                                       "status": {"status_str": "success", "completed": True}}
+            send("executing", node=None)
+            send("execution_success", timestamp=int(time.time() * 1000))
+
+    # --- HTTP ---------------------------------------------------------------
+
+    async def handle(self, method: str, path: str, body: bytes) -> tuple:
+        """Returns (status, payload) for one API call."""
+        self.requests[(method, path.rsplit("/", 1)[0] if path.startswith("/history/") else path)] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 503, {"error": "Service Unavailable"}
+
+        if method == "POST" and path == "/prompt":
+            payload = json.loads(body or b"{}")
+            prompt = payload.get("prompt") or {}
+            node_errors = {node: {"errors": [{"message": "missing class_type"}]}
+                           for node, spec in prompt.items() if "class_type" not in spec}
+            if not prompt or node_errors:
+                return 400, {"error": {"type": "prompt_outputs_failed_validation"}, "node_errors": node_errors}
+            prompt_id = str(uuid.uuid4())
+            self._number += 1
+            self._queue.put_nowait((prompt_id, prompt, payload.get("client_id", "")))
+            return 200, {"prompt_id": prompt_id, "number": self._number, "node_errors": {}}
+        if method == "GET" and path.startswith("/history/"):
+            prompt_id = path[len("/history/"):]
+            entry = self.history.get(prompt_id)
+            return 200, {prompt_id: entry} if entry else {}
+        return 404, {"error": "not found"}
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {k.strip().lower(): v.strip() for k, v in
+                           (line.split(":", 1) for line in lines[1:] if ":" in line)}
+                parts = urlsplit(target)
+                if headers.get("upgrade", "").lower() == "websocket" and parts.path == "/ws":
+                    await self._websocket(head, dict(parse_qsl(parts.query)).get("clientId", ""), reader, writer)
+                    return
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                status, payload = await self.handle(method, parts.path, body)
+                if status >= 500 and self.plain_errors:
+                    kind, data = "text/plain", REASONS.get(status, "").encode("utf-8")
+                else:
+                    kind, data = "application/json", json.dumps(payload).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: {kind}\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+        except ConnectionError:
+            pass  # client gave up
+        finally:
+            writer.close()
+
+    async def _websocket(self, head: bytes, client_id: str, reader, writer):
+        protocol = ServerProtocol()
+        protocol.receive_data(head)
+        request = protocol.events_received()[0]
+        protocol.send_response(protocol.accept(request))
+        writer.write(b"".join(protocol.data_to_send()))
+        self.ws_connections += 1
+        sockets = self._sockets[client_id]
+        sockets.append((protocol, writer))
+        self._send(client_id, "status", {"status": {"exec_info": {"queue_remaining": self._queue.qsize()}},
+                                         "sid": client_id})
+        try:
+            while protocol.state is not State.CLOSED:
+                data = await reader.read(65536)
+                if not data:
+                    protocol.receive_eof()
+                    break
+                protocol.receive_data(data)
+                protocol.events_received()  # clients only send pings and close frames
+                writer.write(b"".join(protocol.data_to_send()))
+                if protocol.close_expected():
+                    break
+        finally:
+            sockets.remove((protocol, writer))
+
+    # --- Lifecycle ----------------------------------------------------------
+
+    def drop_connections(self):
+        """Closes every websocket from the server side (reconnect tests)."""
+        def close():
+            for sockets in self._sockets.values():
+                for _, writer in list(sockets):
+                    writer.close()
+        self._loop.call_soon_threadsafe(close)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockComfyUI":
+        ready = threading.Event()
+
+        async def main():
+            self._queue = asyncio.Queue()
+            self._server = await asyncio.start_server(self._serve, host, port)
+            self._address = "%s:%d" % self._server.sockets[0].getsockname()[:2]
+            executors = [asyncio.create_task(self._execute()) for _ in range(self.workers)]
+            ready.set()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                for task in executors:
+                    task.cancel()
+                self._server.close()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._main = self._loop.create_task(main())
+            try:
+                self._loop.run_until_complete(self._main)
+            except asyncio.CancelledError:
+                pass
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.address}"
+
+    def stop(self):
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._main.cancel)
+            self._thread.join()
+            self._thread = None
+
+    def round_trips(self) -> int:
+        return sum(self.requests.values())
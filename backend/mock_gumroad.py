@@ -0,0 +1,143 @@
+"""
+Local stand-in for the Gumroad API (v2), for tests and offline runs.
+Serves GET /v2/sales/:id and the paged GET /v2/sales list (after/before date
+filters, page_key cursor) from an in-memory dict, checks the bearer token and
+counts requests.
+
+    server = MockGumroad(latency=0.05).start()
+    gumroad_handler.GUMROAD_API_URL = f"{server.url}/v2"
+    server.add_sale("sale_1", "buyer@example.com")
+    ...
+    server.stop()
+"""
+from bisect import bisect_left, bisect_right
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+
+class MockGumroad:
+    """In-memory Gumroad sales API with a configurable per-request delay."""
+
+    def __init__(self, access_token: str = "test-gumroad-token", latency: float = 0.0, page_size: int = 10):
+        self.access_token = access_token
+        self.latency = latency
+        self.page_size = page_size
+        # Answer this many upcoming requests with 503
+        self.fail_next = 0
+        self.sales: Dict[str, dict] = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        # (after, before) -> matching sales; dropped on every change
+        self._listings: Dict[tuple, List[dict]] = {}
+        self._by_date: Optional[List[dict]] = None
+        self._dates: List[str] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def add_sale(self, sale_id: str, email: str, refunded: bool = False, disputed: bool = False,
+                 product_permalink: str = "persona-ai", price: int = 699, **extra) -> dict:
+        sale = {
+            "id": sale_id,
+            "email": email,
+            "product_permalink": product_permalink,
+            "price": price,
+            "refunded": refunded,
+            "disputed": disputed,
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            **extra,
+        }
+        with self.lock:
+            self.sales[sale_id] = sale
+            self._listings.clear()
+            self._by_date = None
+        return sale
+
+    def _listing(self, after: str, before: str) -> List[dict]:
+        key = (after, before)
+        if key not in self._listings:
+            if self._by_date is None:
+                self._by_date = sorted(self.sales.values(), key=lambda s: s["created_at"][:10])
+                self._dates = [s["created_at"][:10] for s in self._by_date]
+            # Both bounds exclusive, compared on the sale's date
+            lo = bisect_right(self._dates, after) if after else 0
+            hi = bisect_left(self._dates, before) if before else len(self._dates)
+            self._listings[key] = self._by_date[lo:hi]
+        return self._listings[key]
+
+    def handle(self, method: str, path: str, query: dict, authorization: str) -> tuple:
+        """Returns (status, payload) for one API call."""
+        self.requests[(method, path.rsplit("/", 1)[0] if path.startswith("/v2/sales/") else path)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 503, {"success": False, "message": "Service Unavailable"}
+        if authorization != f"Bearer {self.access_token}":
+            return 401, {"success": False, "message": "The access token is invalid"}
+        if method != "GET":
+            return 405, {"success": False}
+
+        if path == "/v2/sales":
+            with self.lock:
+                ordered = self._listing(query.get("after", ""), query.get("before", ""))
+            offset = int(query.get("page_key") or 0)
+            page = ordered[offset:offset + self.page_size]
+            payload = {"success": True, "sales": page}
+            if offset + self.page_size < len(ordered):
+                payload["next_page_key"] = str(offset + self.page_size)
+            return 200, payload
+        if path.startswith("/v2/sales/"):
+            sale = self.sales.get(path[len("/v2/sales/"):])
+            if sale is None:
+                return 404, {"success": False, "message": "The sale was not found."}
+            return 200, {"success": True, "sale": dict(sale)}
+        return 404, {"success": False, "message": "not found"}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockGumroad":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                status, payload = mock.handle("GET", parts.path, dict(parse_qsl(parts.query)),
+                                              self.headers.get("Authorization", ""))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout tests)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def round_trips(self) -> int:
+        return sum(self.requests.values())
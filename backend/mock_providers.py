@@ -0,0 +1,39 @@
+import asyncio
+import random
+
+# Local stand-ins for LLM providers (router/hedging tests, load tests)
+
+
+class MockProvider:
+    """
+    Async provider with configurable latency and failure behaviour.
+    latency: seconds, or a callable returning seconds per call
+    error_rate: probability a call fails
+    fail_mode: "raise" (exception) or "error_text" ("Error ..." reply like the real handlers)
+    """
+
+    def __init__(self, name, latency=0.01, error_rate=0.0, fail_mode="error_text", seed=None):
+        self.__name__ = name
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_mode = fail_mode
+        self.calls = 0
+        self.cancelled = 0
+        self._rng = random.Random(seed)
+
+    def _delay(self):
+        return self.latency() if callable(self.latency) else self.latency
+
+    async def __call__(self, system_prompt, user_message, rules={}):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self._delay())
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self._rng.random() < self.error_rate:
+            if self.fail_mode == "raise":
+                raise RuntimeError(f"{self.name} upstream error")
+            return f"Error calling {self.name}: simulated failure"
+        return f"[{self.name}] reply to: {user_message}"
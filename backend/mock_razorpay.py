@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Razorpay payments API (v1), for tests and offline runs.
+Serves the paged GET /v1/payments list (count/skip/from/to) and GET
+/v1/payments/:id from an in-memory dict, checks basic auth and counts requests.
+
+    server = MockRazorpay(latency=0.05).start()
+    reconcile.RAZORPAY_API_URL = f"{server.url}/v1"
+    server.add_payment("pay_1", "buyer@example.com", order_id="order_1")
+    ...
+    server.stop()
+"""
+import base64
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+MAX_COUNT = 100
+
+
+class MockRazorpay:
+    """In-memory Razorpay payments API with a configurable per-request delay."""
+
+    def __init__(self, key_id: str = "rzp_test_key", key_secret: str = "rzp_test_secret", latency: float = 0.0):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.latency = latency
+        # Answer this many upcoming requests with 503
+        self.fail_next = 0
+        self.payments: Dict[str, dict] = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        # (from, to) -> payments newest first, as the API lists them; dropped on every change
+        self._listings: Dict[tuple, List[dict]] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def add_payment(self, payment_id: str, email: str, order_id: Optional[str] = None, status: str = "captured",
+                    amount: int = 9900, created_at: Optional[int] = None, **extra) -> dict:
+        payment = {
+            "id": payment_id,
+            "entity": "payment",
+            "amount": amount,
+            "currency": "INR",
+            "status": status,
+            "order_id": order_id,
+            "email": email,
+            "amount_refunded": amount if status == "refunded" else 0,
+            "refund_status": "full" if status == "refunded" else None,
+            "created_at": created_at if created_at is not None else int(time.time()),
+            **extra,
+        }
+        with self.lock:
+            self.payments[payment_id] = payment
+            self._listings.clear()
+        return payment
+
+    def _listing(self, start: int, end: int) -> List[dict]:
+        key = (start, end)
+        if key not in self._listings:
+            rows = [p for p in self.payments.values() if start <= p["created_at"] <= end]
+            self._listings[key] = sorted(rows, key=lambda p: (-p["created_at"], p["id"]))
+        return self._listings[key]
+
+    def handle(self, method: str, path: str, query: dict, authorization: str) -> tuple:
+        """Returns (status, payload) for one API call."""
+        self.requests[(method, path.rsplit("/", 1)[0] if path.startswith("/v1/payments/") else path)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 503, {"error": {"code": "SERVER_ERROR", "description": "Service Unavailable"}}
+        expected = base64.b64encode(f"{self.key_id}:{self.key_secret}".encode()).decode()
+        if authorization != f"Basic {expected}":
+            return 401, {"error": {"code": "BAD_REQUEST_ERROR", "description": "Authentication failed"}}
+        if method != "GET":
+            return 405, {"error": {"code": "BAD_REQUEST_ERROR"}}
+
+        if path == "/v1/payments":
+            count = int(query.get("count", 10))
+            if count > MAX_COUNT:
+                return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "count must be at most 100"}}
+            skip = int(query.get("skip", 0))
+            with self.lock:
+                rows = self._listing(int(query.get("from", 0)), int(query.get("to", 2 ** 40)))
+                items = [dict(p) for p in rows[skip:skip + count]]
+            return 200, {"entity": "collection", "count": len(items), "items": items}
+        if path.startswith("/v1/payments/"):
+            payment = self.payments.get(path[len("/v1/payments/"):])
+            if payment is None:
+                return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}}
+            return 200, dict(payment)
+        return 404, {"error": {"code": "NOT_FOUND"}}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockRazorpay":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                status, payload = mock.handle("GET", parts.path, dict(parse_qsl(parts.query)),
+                                              self.headers.get("Authorization", ""))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def round_trips(self) -> int:
+        return sum(self.requests.values())
@@ -0,0 +1,378 @@
+"""
+Local stand-in for the Supabase REST API (PostgREST), for tests and offline benchmarks.
+Keeps tables in memory, speaks enough of /rest/v1 for this backend (GET/POST/PATCH
+with eq/neq/lt/lte/gt/gte/in/is/not filters, select, order, limit, offset, and
+on_conflict upserts; user_identifier_check is enforced on inserted and upserted
+rows), implements the RPC functions from supabase/migrations in Python, and fakes the
+two GoTrue calls auth.py makes (admin user create, password grant).
+
+    server = MockSupabase(latency=0.02).start()
+    database.SUPABASE_URL = server.url
+    ...
+    server.stop()
+
+latency is added to every request to stand in for the network round trip;
+handshake_latency is added once per new connection, for the extra round trips
+TCP + TLS setup costs. start(ssl_context=...) serves HTTPS.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+# Columns filled in on insert when missing, per table
+DEFAULTS = {
+    "users": lambda: {"id": str(uuid.uuid4()), "plan": "free", "msg_count": 0,
+                      "last_active_date": date.today().isoformat(), "created_at": datetime.utcnow().isoformat()},
+    "transactions": lambda: {"id": str(uuid.uuid4()), "created_at": datetime.utcnow().isoformat()},
+    "contact_submissions": lambda: {"id": str(uuid.uuid4()), "submitted_at": datetime.utcnow().isoformat()},
+    "global_stats": lambda: {"date": date.today().isoformat(), "total_requests": 0},
+}
+
+
+class CheckViolation(Exception):
+    pass
+
+
+def _coerce(raw: str, current):
+    """Filter values arrive as strings; compare them as the stored column's type."""
+    if isinstance(current, bool):
+        return raw == "true"
+    if isinstance(current, int):
+        return int(raw)
+    if isinstance(current, float):
+        return float(raw)
+    return raw
+
+
+@lru_cache(maxsize=256)
+def _in_options(raw: str) -> frozenset:
+    return frozenset(raw.strip("()").split(","))
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    op, _, raw = expression.partition(".")
+    if op == "not":
+        return not _matches(row, column, raw)
+    value = row.get(column)
+    if op == "is":
+        return value is None if raw == "null" else value == (raw == "true")
+    if op == "in":
+        return value is not None and str(value) in _in_options(raw)
+    if value is None:
+        return op == "neq"
+    target = _coerce(raw, value)
+    return {
+        "eq": value == target,
+        "neq": value != target,
+        "lt": value < target,
+        "lte": value <= target,
+        "gt": value > target,
+        "gte": value >= target,
+    }[op]
+
+
+class MockSupabase:
+    """In-memory PostgREST with a configurable per-request delay."""
+
+    RESERVED = {"select", "order", "limit", "offset", "on_conflict"}
+
+    def __init__(self, latency: float = 0.0, daily_limit: int = 10, global_cap: int = 1000,
+                 handshake_latency: float = 0.0):
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.connections = 0
+        # Answer this many upcoming requests with 503, to exercise client retries
+        self.fail_next = 0
+        self.tables: Dict[str, List[dict]] = {name: [] for name in DEFAULTS}
+        self.requests = Counter()
+        # (table, order) -> rows sorted by id, reused by paged full-table reads
+        self._id_order: Dict[tuple, List[dict]] = {}
+        # Requests being served right now, and the most seen at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # email -> {"id", "password"} for /auth/v1
+        self.auth_users: Dict[str, dict] = {}
+        self.rpcs: Dict[str, Callable[[dict], object]] = {
+            "check_can_chat": self.rpc_check_can_chat,
+            "apply_quota_increments": self.rpc_apply_quota_increments,
+            "increment_global_stats": self.rpc_increment_global_stats,
+        }
+        self.daily_limit = daily_limit
+        self.global_cap = global_cap
+        # One lock stands in for the database's row locks and transactions
+        self.lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # --- Table operations ---------------------------------------------------
+
+    def select(self, table: str, filters: dict) -> List[dict]:
+        rows = self.tables.setdefault(table, [])
+        return [row for row in rows if all(_matches(row, c, e) for c, e in filters.items())]
+
+    def check(self, table: str, rows: List[dict]):
+        """Table constraints Postgres checks on every proposed row (schema.sql)."""
+        if table == "users":
+            for row in rows:
+                if row.get("email") is None and row.get("ip_address") is None:
+                    raise CheckViolation('new row for relation "users" violates check constraint '
+                                         '"user_identifier_check"')
+
+    def insert(self, table: str, data) -> List[dict]:
+        rows = data if isinstance(data, list) else [data]
+        self.check(table, rows)
+        created = []
+        for row in rows:
+            record = DEFAULTS.get(table, dict)()
+            record.update(row)
+            self.tables.setdefault(table, []).append(record)
+            created.append(record)
+        return created
+
+    def update(self, table: str, filters: dict, data: dict) -> List[dict]:
+        matched = self.select(table, filters)
+        for row in matched:
+            row.update(data)
+        return matched
+
+    def upsert(self, table: str, column: str, data) -> List[dict]:
+        """POST ?on_conflict=column with resolution=merge-duplicates: update matches, insert the rest."""
+        rows = data if isinstance(data, list) else [data]
+        # Checked before conflicts are resolved, as in Postgres: even rows that only update
+        self.check(table, rows)
+        existing = {r.get(column): r for r in self.tables.setdefault(table, [])}
+        result = []
+        for row in rows:
+            current = existing.get(row.get(column))
+            if current is None:
+                result.extend(self.insert(table, row))
+            else:
+                current.update(row)
+                result.append(current)
+        return result
+
+    # --- RPC functions (mirrors of supabase/migrations/*.sql) --------------
+
+    def rpc_check_can_chat(self, args: dict) -> dict:
+        """Python twin of check_can_chat_rpc.sql; runs under the lock like the SQL transaction."""
+        identifier = args["p_identifier"]
+        daily_limit = args.get("p_daily_limit", self.daily_limit)
+        global_cap = args.get("p_global_cap", self.global_cap)
+        column = "email" if "@" in identifier else "ip_address"
+        today = date.today().isoformat()
+
+        users = self.select("users", {column: f"eq.{identifier}"})
+        user = users[0] if users else self.insert("users", {column: identifier})[0]
+        if user.get("last_active_date") != today:
+            user.update({"msg_count": 0, "last_active_date": today})
+        end = user.get("subscription_end_date")
+        if user.get("plan") == "pro" and end and datetime.fromisoformat(str(end).replace("Z", "+00:00")) <= datetime.now(timezone.utc):
+            user.update({"plan": "free", "token_version": int(time.time() * 1000)})
+
+        stats = self.select("global_stats", {"date": f"eq.{today}"})
+        stats = stats[0] if stats else self.insert("global_stats", {"date": today})[0]
+
+        if user.get("plan") == "pro":
+            stats["total_requests"] += 1
+            return {"allowed": True, "plan": "pro", "remaining": 9999}
+        if stats["total_requests"] >= global_cap:
+            return {"allowed": False, "reason": "global_cap_reached", "plan": "free"}
+        if (user.get("msg_count") or 0) >= daily_limit:
+            return {"allowed": False, "reason": "daily_limit_reached", "plan": "free", "remaining": 0}
+
+        stats["total_requests"] += 1
+        user["msg_count"] = (user.get("msg_count") or 0) + 1
+        return {"allowed": True, "plan": "free", "remaining": daily_limit - user["msg_count"]}
+
+    def rpc_apply_quota_increments(self, args: dict) -> dict:
+        """Python twin of apply_quota_increments_rpc.sql."""
+        today = date.today().isoformat()
+        fresh = []
+        total = 0
+        for item in args["p_increments"]:
+            identifier, count, day = item["identifier"], item["count"], item["date"]
+            users = []
+            if identifier is not None:
+                column = "email" if "@" in identifier else "ip_address"
+                users = self.select("users", {column: f"eq.{identifier}"})
+            if users:
+                user = users[0]
+                last = user.get("last_active_date")
+                if last == day:
+                    user["msg_count"] = (user.get("msg_count") or 0) + count
+                elif not last or last < day:
+                    user["msg_count"] = count
+                user["last_active_date"] = max(last or day, day)
+                fresh.append({"identifier": identifier, "plan": user.get("plan"),
+                              "msg_count": user["msg_count"], "last_active_date": user["last_active_date"]})
+            if day == today:
+                total += count
+
+        stats = self.select("global_stats", {"date": f"eq.{today}"})
+        stats = stats[0] if stats else self.insert("global_stats", {"date": today})[0]
+        stats["total_requests"] += total
+        return {"users": fresh, "global_total": stats["total_requests"]}
+
+    def rpc_increment_global_stats(self, args: dict) -> int:
+        """Python twin of increment_global_stats_rpc.sql."""
+        stats = self.select("global_stats", {"date": f"eq.{args['p_date']}"})
+        stats = stats[0] if stats else self.insert("global_stats", {"date": args["p_date"]})[0]
+        stats["total_requests"] += args.get("p_amount", 1)
+        return stats["total_requests"]
+
+    # --- Auth (GoTrue) -----------------------------------------------------
+
+    def auth(self, path: str, query: dict, body: dict) -> tuple:
+        email, password = body.get("email"), body.get("password")
+        if path == "admin/users":
+            if email in self.auth_users:
+                return 422, {"code": 422, "msg": "A user with this email address has already been registered"}
+            user = {"id": str(uuid.uuid4()), "email": email, "password": password}
+            self.auth_users[email] = user
+            return 200, {"id": user["id"], "email": email, "user_metadata": body.get("user_metadata", {})}
+        if path == "token" and query.get("grant_type") == "password":
+            user = self.auth_users.get(email)
+            if not user or user["password"] != password:
+                return 400, {"error": "invalid_grant", "error_description": "Invalid login credentials"}
+            return 200, {"access_token": f"mock-{user['id']}", "token_type": "bearer",
+                         "user": {"id": user["id"], "email": email}}
+        return 404, {"message": "not found"}
+
+    # --- HTTP ---------------------------------------------------------------
+
+    def handle(self, method: str, path: str, query: List[tuple], body) -> tuple:
+        """Returns (status, payload) for one REST call."""
+        self.requests[(method, path)] += 1
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return self._handle(method, path, query, body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _handle(self, method: str, path: str, query: List[tuple], body) -> tuple:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 503, {"message": "Service Unavailable"}
+        if path.startswith("/auth/v1/") and method == "POST":
+            with self.lock:
+                return self.auth(path[len("/auth/v1/"):], dict(query), body or {})
+        if not path.startswith("/rest/v1/"):
+            return 404, {"message": "not found"}
+        resource = path[len("/rest/v1/"):]
+
+        with self.lock:
+            if resource.startswith("rpc/"):
+                fn = self.rpcs.get(resource[len("rpc/"):])
+                if fn is None or method != "POST":
+                    return 404, {"code": "PGRST202", "message": f"Could not find the function {resource}"}
+                return 200, fn(body or {})
+
+            params = dict(query)
+            filters = {k: v for k, v in query if k not in self.RESERVED}
+            if method == "GET":
+                rows = self.select(resource, filters)
+                if "order" in params:
+                    column, _, direction = params["order"].partition(".")
+                    cached = self._id_order.get((resource, params["order"]))
+                    if filters or column != "id" or cached is None or len(cached) != len(rows):
+                        rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                                      reverse=direction == "desc")
+                        if not filters and column == "id":
+                            # ids never change: a whole-table id order holds until rows are added or removed
+                            self._id_order[(resource, params["order"])] = rows
+                    else:
+                        rows = cached
+                offset = int(params.get("offset", 0))
+                rows = rows[offset:offset + int(params["limit"])] if "limit" in params else rows[offset:]
+                columns = params.get("select", "*")
+                if columns != "*":
+                    keep = columns.split(",")
+                    rows = [{k: r.get(k) for k in keep} for r in rows]
+                return 200, [dict(r) for r in rows]
+            if method == "POST":
+                try:
+                    if "on_conflict" in params:
+                        return 201, [dict(r) for r in self.upsert(resource, params["on_conflict"], body)]
+                    return 201, [dict(r) for r in self.insert(resource, body)]
+                except CheckViolation as e:
+                    return 400, {"code": "23514", "message": str(e)}
+            if method == "PATCH":
+                return 200, [dict(r) for r in self.update(resource, filters, body or {})]
+            if method == "DELETE":
+                matched = self.select(resource, filters)
+                self.tables[resource] = [r for r in self.tables[resource] if r not in matched]
+                return 200, [dict(r) for r in matched]
+        return 405, {"message": f"{method} not supported"}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0, ssl_context=None) -> "MockSupabase":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; avoid the Nagle/delayed-ACK stall
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                with mock.lock:
+                    mock.connections += 1
+                if mock.handshake_latency:
+                    time.sleep(mock.handshake_latency)
+                if ssl_context is not None:
+                    # Handshake on the handler thread, not the accept loop
+                    self.request.do_handshake()
+                super().setup()
+
+            def _serve(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, payload = mock.handle(self.command, parts.path, parse_qsl(parts.query), body)
+                data = json.dumps(payload, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout tests)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        if ssl_context is not None:
+            self._server.socket = ssl_context.wrap_socket(self._server.socket, server_side=True,
+                                                          do_handshake_on_connect=False)
+        self._scheme = "https" if ssl_context is not None else "http"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{self._scheme}://{host}:{port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def round_trips(self) -> int:
+        return sum(self.requests.values())
@@ -0,0 +1,113 @@
+"""
+PBKDF2 password hashing off the event loop.
+pbkdf2_sha256 is CPU-bound by design (~15 ms per hash at the default cost) and
+holds the GIL while it runs, so calling it from an async endpoint stalls every
+other request on the worker. Hashes and verifies go to a dedicated process
+pool sized to the cores; when more than PASSWORD_HASH_MAX_QUEUE jobs are
+waiting, new ones are rejected with HasherOverloaded instead of piling up.
+
+PASSWORD_HASH_ROUNDS sets the cost per deployment. The context accepts only
+exactly that cost, so after a change every older hash reports needs_update
+and is replaced on the user's next successful login (verify_and_update).
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# Config
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "0")) or PASSWORD_HASH_WORKERS * 8
+
+
+class HasherOverloaded(Exception):
+    """Too many hashing jobs queued; the caller should answer 503."""
+
+
+@lru_cache(maxsize=4)
+def password_context(rounds: int = PASSWORD_HASH_ROUNDS) -> CryptContext:
+    # min == default == max: a hash made with any other cost needs_update
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto",
+                        pbkdf2_sha256__default_rounds=rounds,
+                        pbkdf2_sha256__min_rounds=rounds,
+                        pbkdf2_sha256__max_rounds=rounds)
+
+
+# Run inside the pool processes (module-level so they pickle)
+def _hash(password: str, rounds: int) -> str:
+    return password_context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return password_context(rounds).verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """Process pool for PBKDF2 with a bounded queue. The pool starts on first use."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 rounds: int = PASSWORD_HASH_ROUNDS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Jobs submitted and not finished (running + waiting); touched only on the event loop
+        self._outstanding = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def _submit(self, fn, *args):
+        if self._outstanding - self.workers >= self.max_queue:
+            self.rejected += 1
+            raise HasherOverloaded(f"{self._outstanding} password hashes outstanding")
+        self._outstanding += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), fn, *args)
+        finally:
+            self._outstanding -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return (await self.verify_and_update(password, hashed))[0]
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """(valid, new_hash); new_hash is set when the stored hash used another cost."""
+        return await self._submit(_verify_and_update, password, hashed, self.rounds)
+
+    def needs_update(self, hashed: str) -> bool:
+        """False for hashes the context can't parse (bcrypt, legacy plaintext, malformed)."""
+        context = password_context(self.rounds)
+        try:
+            return context.identify(hashed) is not None and context.needs_update(hashed)
+        except ValueError:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "outstanding": self._outstanding,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
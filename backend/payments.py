@@ -1,16 +1,27 @@
 import razorpay
+import hashlib
+import hmac
+import json
 import os
+from typing import Optional
 from dotenv import load_dotenv
+from session_tokens import new_token_version, note_token_version
+from subscription_expiry import subscription_expiry
 
 load_dotenv()
 
 KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
 
 client = None
 if KEY_ID and "your_razorpay" not in KEY_ID:
     client = razorpay.Client(auth=(KEY_ID, KEY_SECRET))
 
+# Events that make a user pro / take it away again
+GRANT_EVENTS = {"payment.captured", "order.paid"}
+REVOKE_EVENTS = {"refund.processed", "payment.refunded"}
+
 def create_order(amount_paise: int = 9900):
     if not client:
         return {"error": "Razorpay keys not configured"}
@@ -23,6 +34,111 @@ def create_order(amount_paise: int = 9900):
     order = client.order.create(data=data)
     return order
 
-def verify_signature(body: bytes, signature: str):
-    if not client: return False
-    return client.utility.verify_webhook_signature(body, signature, os.getenv("RAZORPAY_WEBHOOK_SECRET", "secret"))
+def verify_signature(body: bytes, signature: str) -> bool:
+    """
+    Checks X-Razorpay-Signature (hex HMAC-SHA256 of the raw body with the webhook secret).
+    Done with hmac directly: the SDK helper wants str bodies and raises on mismatch.
+    """
+    if not WEBHOOK_SECRET or not signature:
+        return False
+    expected = hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+def event_id(body: bytes, header_id: Optional[str]) -> str:
+    """Razorpay's X-Razorpay-Event-Id; redeliveries of one event repeat it. Falls back to a body digest."""
+    return header_id or hashlib.sha256(body).hexdigest()
+
+def apply_razorpay_event(payload: bytes) -> bool:
+    """
+    Applies one stored webhook event (run by the webhook inbox workers).
+    Returns False to have it retried later.
+    """
+    from database import get_supabase_client
+
+    event = json.loads(payload)
+    name = event.get("event")
+    entity = ((event.get("payload") or {}).get("payment") or {}).get("entity") or {}
+    if name not in GRANT_EVENTS | REVOKE_EVENTS:
+        return True  # not ours to act on
+    email = entity.get("email") or (entity.get("notes") or {}).get("email")
+    if not email:
+        print(f"Razorpay {name}: payment {entity.get('id')} has no email")
+        return True  # retrying will not add one
+    supabase = get_supabase_client()
+
+    if name in GRANT_EVENTS:
+        # Events are not applied in order: a capture retried after its refund must not re-grant
+        if payment_refunded(entity, supabase):
+            print(f"Razorpay {name}: payment {entity.get('id')} was already refunded")
+            return True
+        return grant_razorpay_access(email, entity, supabase)
+    return revoke_razorpay_access(email, entity, supabase)
+
+def _payment_transactions(payment: dict, supabase_client) -> list:
+    """The transaction rows for this payment: by order (create_order's row) when it has one."""
+    if payment.get("order_id"):
+        rows = supabase_client.table("transactions").select("*").eq("razorpay_order_id", payment["order_id"]).execute().data
+        return [r for r in rows if r.get("razorpay_payment_id") in (None, payment.get("id"))]
+    return supabase_client.table("transactions").select("*").eq("razorpay_payment_id", payment.get("id")).execute().data
+
+def payment_refunded(payment: dict, supabase_client) -> bool:
+    return any(r.get("status") == "refunded" for r in _payment_transactions(payment, supabase_client))
+
+def grant_razorpay_access(email: str, payment: dict, supabase_client) -> bool:
+    try:
+        # A new token_version retires session tokens that still say "free";
+        # a one-off payment clears any end date left by a lapsed subscription
+        version = new_token_version()
+        result = supabase_client.table("users").update({
+            "plan": "pro",
+            "payment_provider": "razorpay",
+            "msg_count": 0,
+            "subscription_end_date": None,
+            "token_version": version
+        }).eq("email", email).execute()
+        if not result.data:
+            return False
+        note_token_version(email, version)
+        for user in result.data:
+            subscription_expiry.forget(user["id"])
+        supabase_client.table("transactions").update({
+            "razorpay_payment_id": payment.get("id"),
+            "status": "paid"
+        }).eq("razorpay_order_id", payment.get("order_id")).execute()
+        return True
+    except Exception as e:
+        print(f"Error granting premium access: {e}")
+        return False
+
+def revoke_razorpay_access(email: str, payment: dict, supabase_client) -> bool:
+    try:
+        version = new_token_version()
+        result = supabase_client.table("users").update({
+            "plan": "free",
+            "token_version": version
+        }).eq("email", email).execute()
+        if not result.data:
+            return False
+        note_token_version(email, version)
+        # Recorded even if the capture was never applied, so a late capture sees the refund
+        if payment.get("order_id"):
+            refunded = supabase_client.table("transactions").update({
+                "razorpay_payment_id": payment.get("id"),
+                "status": "refunded"
+            }).eq("razorpay_order_id", payment["order_id"]).execute()
+        else:
+            refunded = supabase_client.table("transactions").update({
+                "status": "refunded"
+            }).eq("razorpay_payment_id", payment.get("id")).execute()
+        if not refunded.data:
+            supabase_client.table("transactions").insert({
+                "razorpay_order_id": payment.get("order_id"),
+                "razorpay_payment_id": payment.get("id"),
+                "amount": payment.get("amount"),
+                "status": "refunded",
+                "payment_provider": "razorpay"
+            }).execute()
+        return True
+    except Exception as e:
+        print(f"Error revoking premium access: {e}")
+        return False
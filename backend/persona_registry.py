@@ -0,0 +1,151 @@
+"""
+Persona registry.
+Loads persona.json and personas.PERSONA_PROMPTS once, precompiles each persona's
+rules, and hot-reloads when persona.json changes on disk.
+
+Rules per persona, in order of precedence:
+1. persona.json "personas": {"<id>": {"max_words": ..., "forbidden_phrases": [...]}}
+2. The persona's own prompt ("Maximum N words", the ❌ forbidden phrase list)
+3. persona.json top-level max_words / forbidden_phrases (shared baseline)
+Forbidden phrases from all three are combined.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+from personas import PERSONA_PROMPTS
+from response_validator import PhraseMatcher, compile_phrases
+from token_budget import estimate_max_tokens
+
+# Config
+PERSONA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "persona.json")
+PERSONA_RELOAD_INTERVAL = float(os.getenv("PERSONA_RELOAD_INTERVAL", "2"))
+DEFAULT_PERSONA = "elon"
+DEFAULT_MAX_WORDS = 150
+
+_MAX_WORDS_RE = re.compile(r"Maximum (\d+) words", re.IGNORECASE)
+_FORBIDDEN_LINE_RE = re.compile(r'^❌\s*"(.+?)"\s*$', re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class Persona:
+    """Ready-to-use, immutable persona config handed to /chat."""
+    id: str
+    system_prompt: str
+    max_words: int
+    # Generation budget sized from max_words (see token_budget)
+    max_tokens: int
+    forbidden_phrases: Tuple[str, ...]
+    forbidden_pattern: Optional[PhraseMatcher]
+    # Dict-style view for validate_response / StreamGuard (read-only)
+    rules: Mapping
+    # Changes whenever the prompt or rules change; used to scope caches
+    fingerprint: str
+
+
+def rules_from_prompt(prompt: str) -> dict:
+    rules = {"forbidden_phrases": _FORBIDDEN_LINE_RE.findall(prompt)}
+    match = _MAX_WORDS_RE.search(prompt)
+    if match:
+        rules["max_words"] = int(match.group(1))
+    return rules
+
+
+def build_persona(persona_id: str, prompt: str, config: dict) -> Persona:
+    from_prompt = rules_from_prompt(prompt)
+    override = config.get("personas", {}).get(persona_id, {})
+
+    max_words = override.get("max_words") or from_prompt.get("max_words") or config.get("max_words", DEFAULT_MAX_WORDS)
+    phrases = []
+    for source in (config.get("forbidden_phrases", []), from_prompt["forbidden_phrases"], override.get("forbidden_phrases", [])):
+        for phrase in source:
+            if phrase not in phrases:
+                phrases.append(phrase)
+    phrases = tuple(phrases)
+    max_tokens = estimate_max_tokens(max_words)
+
+    fingerprint = hashlib.sha256(json.dumps([prompt, max_words, phrases]).encode("utf-8")).hexdigest()[:16]
+    return Persona(
+        id=persona_id,
+        system_prompt=prompt,
+        max_words=max_words,
+        max_tokens=max_tokens,
+        forbidden_phrases=phrases,
+        forbidden_pattern=compile_phrases(phrases),
+        rules=MappingProxyType({"max_words": max_words, "max_tokens": max_tokens, "forbidden_phrases": phrases}),
+        fingerprint=fingerprint,
+    )
+
+
+class PersonaRegistry:
+    """
+    Holds the compiled personas. get() is a dict lookup; at most once per
+    reload_interval it also stats persona.json and rebuilds if the mtime moved.
+    """
+
+    def __init__(self, path: str = PERSONA_FILE, prompts: Dict[str, str] = PERSONA_PROMPTS,
+                 reload_interval: float = PERSONA_RELOAD_INTERVAL):
+        self.path = path
+        self.prompts = prompts
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._personas: Dict[str, Persona] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.reload()
+
+    def _read_config(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            print(f"[personas] {self.path} not found, using prompt rules only")
+            return {}
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """Rebuilds every persona. A broken persona.json keeps the last good config."""
+        with self._lock:
+            mtime = self._current_mtime()
+            try:
+                config = self._read_config()
+                personas = {pid: build_persona(pid, prompt, config) for pid, prompt in self.prompts.items()}
+            except (ValueError, re.error) as e:
+                print(f"[personas] Failed to reload {self.path}: {e}")
+                self._mtime = mtime
+                return
+            self._personas = personas
+            self._mtime = mtime
+            self.reloads += 1
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if self._current_mtime() != self._mtime:
+            self.reload()
+
+    def exists(self, persona_id: str) -> bool:
+        return persona_id in self._personas
+
+    def get(self, persona_id: str) -> Persona:
+        """Returns the persona, falling back to the default persona for unknown ids."""
+        self._maybe_reload()
+        personas = self._personas
+        return personas.get(persona_id) or personas[DEFAULT_PERSONA]
+
+
+persona_registry = PersonaRegistry()
@@ -0,0 +1,332 @@
+"""
+In-process quota cache in front of check_can_chat.
+Keeps each identifier's plan, msg_count and day in memory, decides allow/deny
+locally and writes the increments back to Supabase in batches
+(apply_quota_increments RPC) every QUOTA_FLUSH_INTERVAL_MS.
+
+A chat only waits on Supabase when the identifier is not cached (or its entry
+is older than QUOTA_ENTRY_TTL, or from another day), when it is close to its
+limit, or when it is a pro subscription past its end date (an in-memory
+lookup in subscription_expiry.py). Those go through the atomic check_can_chat RPC.
+
+Over-admission rules (free plan, daily limit L):
+1. One process, no crash: never over-admits. Once the local view shows
+   QUOTA_STRICT_MARGIN or fewer chats left, every check flushes this process's
+   pending increments and asks the RPC, which holds the authoritative count.
+2. Crash: increments not yet flushed are lost, so those chats are never charged.
+   That is at most QUOTA_MAX_PENDING chats per identifier, since an identifier
+   with that many pending increments also takes the RPC path.
+3. W processes: a process cannot see chats another one admitted since its
+   entry was refreshed. A user spreading chats across processes within one
+   QUOTA_ENTRY_TTL can get up to (W - 1) * (L - QUOTA_STRICT_MARGIN) extra
+   chats. Run one process, or a short TTL, where that matters.
+The global safety cap is checked against the last flushed total plus this
+process's pending increments, so it can overshoot by the same amounts.
+
+Pro chats are never charged to users.msg_count (check_can_chat doesn't either),
+so a pro user downgraded mid-day starts from the count they had as free. They
+still count towards the global total: flush() sends them as one item per day
+with no identifier, which apply_quota_increments adds to global_stats only.
+"""
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from database import (DAILY_FREE_LIMIT, GLOBAL_SAFETY_CAP, apply_quota_increments, check_can_chat,
+                      get_today_str)
+from metrics import metrics
+from subscription_expiry import subscription_expiry
+
+# Config
+QUOTA_CACHE_ENABLED = os.getenv("QUOTA_CACHE_ENABLED", "1") == "1"
+QUOTA_FLUSH_INTERVAL_MS = int(os.getenv("QUOTA_FLUSH_INTERVAL_MS", "250"))
+QUOTA_ENTRY_TTL = float(os.getenv("QUOTA_ENTRY_TTL", "30"))
+QUOTA_MAX_PENDING = int(os.getenv("QUOTA_MAX_PENDING", "3"))
+QUOTA_STRICT_MARGIN = int(os.getenv("QUOTA_STRICT_MARGIN", "2"))
+QUOTA_MAX_ENTRIES = int(os.getenv("QUOTA_MAX_ENTRIES", "100000"))
+
+# Plans whose decisions can be cached (not 'dev' / 'error_fallback')
+CACHEABLE_PLANS = ("free", "pro")
+
+
+@dataclass
+class QuotaEntry:
+    plan: str
+    # msg_count as Supabase last reported it (includes our flushed increments)
+    count: int
+    day: str
+    refreshed_at: float
+    # Admitted locally, not yet sent
+    pending: int = 0
+    # Sent in the flush that is currently in flight
+    inflight: int = 0
+
+
+class QuotaCache:
+    """
+    Local allow/deny with write-behind. check() is safe to call from any thread;
+    check_async() answers cache hits without leaving the event loop.
+    """
+
+    def __init__(self, load: Callable[[str], dict] = check_can_chat,
+                 flush: Callable[[list], Optional[dict]] = apply_quota_increments,
+                 daily_limit: int = DAILY_FREE_LIMIT, global_cap: int = GLOBAL_SAFETY_CAP,
+                 flush_interval: float = QUOTA_FLUSH_INTERVAL_MS / 1000, entry_ttl: float = QUOTA_ENTRY_TTL,
+                 max_pending: int = QUOTA_MAX_PENDING, strict_margin: int = QUOTA_STRICT_MARGIN,
+                 max_entries: int = QUOTA_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic,
+                 today: Callable[[], str] = get_today_str, is_active: Callable[[str], bool] = None):
+        self._load = load
+        # Subscription end dates, checked in memory on every cached pro decision
+        self._is_active = is_active or subscription_expiry.is_active
+        self._flush = flush
+        self.daily_limit = daily_limit
+        self.global_cap = global_cap
+        self.flush_interval = flush_interval
+        self.entry_ttl = entry_ttl
+        self.max_pending = max_pending
+        self.strict_margin = strict_margin
+        self.max_entries = max_entries
+        self._clock = clock
+        self._today = today
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries: Dict[str, QuotaEntry] = {}
+        # identifier -> [lock, waiters] for RPC calls in flight
+        self._remote: Dict[str, list] = {}
+        # Today's global total as of the last flush, plus what we admitted since
+        self.global_total = 0
+        self.global_pending = 0
+        # Pro chats admitted locally, by day: global total only, not msg_count
+        self._pro_pending: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.strict = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_failures = 0
+
+    # --- Decisions ----------------------------------------------------------
+
+    def try_local(self, identifier: str) -> Optional[dict]:
+        """Answers from memory, or returns None if the RPC has to decide."""
+        with self._lock:
+            if identifier in self._remote:
+                # An RPC for this identifier is in flight; its result is not in our view yet
+                return None
+            return self._decide(identifier)
+
+    def _decide(self, identifier: str) -> Optional[dict]:
+        entry = self._entries.get(identifier)
+        if (entry is None or entry.day != self._today()
+                or self._clock() - entry.refreshed_at > self.entry_ttl):
+            return None
+
+        if entry.plan == "pro":
+            if not self._is_active(identifier):
+                # Past its end date: the RPC downgrades it and answers as free
+                return None
+            self._pro_pending[entry.day] = self._pro_pending.get(entry.day, 0) + 1
+            self.global_pending += 1
+            self.hits += 1
+            return {'allowed': True, 'plan': 'pro', 'remaining': 9999}
+
+        used = entry.count + entry.pending + entry.inflight
+        if used >= self.daily_limit:
+            self.hits += 1
+            return {'allowed': False, 'reason': 'daily_limit_reached', 'plan': 'free', 'remaining': 0}
+        if self.global_total + self.global_pending >= self.global_cap:
+            self.hits += 1
+            return {'allowed': False, 'reason': 'global_cap_reached', 'plan': 'free'}
+        if self.daily_limit - used <= self.strict_margin or entry.pending >= self.max_pending:
+            self.strict += 1
+            return None
+
+        entry.pending += 1
+        self.global_pending += 1
+        self.hits += 1
+        return {'allowed': True, 'plan': 'free', 'remaining': self.daily_limit - used - 1}
+
+    def check_remote(self, identifier: str) -> dict:
+        """
+        Atomic RPC path. Calls for one identifier run one at a time (the SQL
+        function serializes them anyway), so a burst costs one RPC and the rest
+        are answered from the entry it leaves behind.
+        """
+        with self._lock:
+            slot = self._remote.get(identifier)
+            if slot is None:
+                slot = self._remote[identifier] = [threading.Lock(), 0]
+            slot[1] += 1
+        try:
+            with slot[0]:
+                with self._lock:
+                    local = self._decide(identifier)
+                if local is not None:
+                    return local
+                return self._call_rpc(identifier)
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._remote[identifier]
+
+    def _call_rpc(self, identifier: str) -> dict:
+        # Flush first so the RPC counts what we admitted locally
+        with self._lock:
+            entry = self._entries.get(identifier)
+            has_pending = entry is not None and (entry.pending or entry.inflight)
+        if has_pending:
+            self.flush()
+
+        with self._lock:
+            self.misses += 1
+        result = self._load(identifier)
+        plan = result.get('plan')
+        if plan not in CACHEABLE_PLANS or result.get('reason') == 'global_cap_reached':
+            return result
+
+        if plan == 'pro':
+            count = 0
+        else:
+            count = self.daily_limit - result.get('remaining', 0)
+        with self._lock:
+            entry = self._entries.get(identifier)
+            if entry is None:
+                entry = self._entries[identifier] = QuotaEntry(plan, count, self._today(), self._clock())
+            else:
+                entry.plan, entry.count, entry.day, entry.refreshed_at = plan, count, self._today(), self._clock()
+            if result.get('allowed'):
+                self.global_total += 1
+        return result
+
+    def check(self, identifier: str) -> dict:
+        """Blocking check (for scripts and worker threads)."""
+        return self.try_local(identifier) or self.check_remote(identifier)
+
+    async def check_async(self, identifier: str) -> dict:
+        local = self.try_local(identifier)
+        if local is not None:
+            metrics.incr("quota_local")
+            return local
+        metrics.incr("quota_remote")
+        return await asyncio.to_thread(self.check_remote, identifier)
+
+    # --- Write-behind -------------------------------------------------------
+
+    def flush(self) -> int:
+        """Sends every pending increment in one RPC. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = []
+                for identifier, entry in self._entries.items():
+                    if entry.pending:
+                        batch.append({"identifier": identifier, "count": entry.pending, "date": entry.day})
+                        entry.inflight += entry.pending
+                        entry.pending = 0
+                for day, count in self._pro_pending.items():
+                    batch.append({"identifier": None, "count": count, "date": day})
+                self._pro_pending = {}
+                sent = sum(item["count"] for item in batch)
+                self.global_pending -= sent
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                result = self._flush(batch)
+            except Exception as e:
+                print(f"[quota] Flush error: {e}")
+                result = None
+            metrics.observe("quota_flush_ms", (time.perf_counter() - start) * 1000)
+
+            with self._lock:
+                for item in batch:
+                    if item["identifier"] is None:
+                        if result is None:
+                            self._pro_pending[item["date"]] = self._pro_pending.get(item["date"], 0) + item["count"]
+                        continue
+                    entry = self._entries.get(item["identifier"])
+                    if entry is None:
+                        continue
+                    entry.inflight -= item["count"]
+                    if result is None:
+                        # Keep them for the next flush
+                        entry.pending += item["count"]
+                if result is None:
+                    self.global_pending += sent
+                    self.flush_failures += 1
+                    return 0
+
+                now = self._clock()
+                for fresh in result.get("users", []):
+                    entry = self._entries.get(fresh["identifier"])
+                    if entry is not None and str(fresh.get("last_active_date")) == entry.day:
+                        entry.plan = fresh.get("plan") or entry.plan
+                        entry.count = fresh.get("msg_count") or 0
+                        entry.refreshed_at = now
+                self.global_total = result.get("global_total", self.global_total)
+                self.flushes += 1
+                self.flushed += sent
+                self._evict()
+            return sent
+
+    def _evict(self):
+        """Drops expired entries with nothing left to write once over max_entries."""
+        if len(self._entries) <= self.max_entries:
+            return
+        now = self._clock()
+        for identifier in [i for i, e in self._entries.items()
+                           if not e.pending and not e.inflight and now - e.refreshed_at > self.entry_ttl]:
+            del self._entries[identifier]
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """Starts the background flusher (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="quota-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the flusher and writes whatever is still pending."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(e.pending for e in self._entries.values()) + sum(self._pro_pending.values())
+            checks = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "pending": pending,
+                "hits": self.hits,
+                "misses": self.misses,
+                "strict": self.strict,
+                "hit_rate": round(self.hits / checks, 4) if checks else 0.0,
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "flush_failures": self.flush_failures,
+                "global_total": self.global_total + self.global_pending,
+            }
+
+
+quota_cache = QuotaCache()
+
+
+async def check_quota(identifier: str) -> dict:
+    """Quota entry point for /chat: the cache when enabled, the RPC otherwise."""
+    if QUOTA_CACHE_ENABLED:
+        return await quota_cache.check_async(identifier)
+    return await asyncio.to_thread(check_can_chat, identifier)
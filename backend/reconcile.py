@@ -0,0 +1,450 @@
+"""
+Bulk payment reconciliation.
+Webhooks only correct one user at a time, and a lost or failed one leaves a
+paying user on "free" (or a refunded one on "pro") for good. This job reads
+everything at once and fixes the difference:
+
+1. Pages through Gumroad sales (the date range is split into windows whose
+   page_key chains are followed side by side), Razorpay payments (offset
+   pages fetched in parallel windows), and the users and transactions tables,
+   all concurrently, with at most `concurrency` requests open per source.
+2. Diffs purchases against transactions and users.plan/subscription_end_date
+   in memory, through dicts keyed by sale id, payment id, order id and email.
+3. Applies the corrections as batched writes: one PATCH per identical change
+   set and chunk of ids (id=in.(...)), a PATCH per user (upserts on id for
+   transactions) for row-specific changes, and multi-row POSTs for missing
+   transactions.
+
+Users are only upgraded when a paid, unrefunded purchase exists, and only
+downgraded when every purchase for them that was fetched is refunded or expired.
+Pro users with no purchase record (granted by hand) are reported, not touched.
+
+    python reconcile.py                     # dry run: print what would change
+    python reconcile.py --apply
+    python reconcile.py --since 2024-01-01 --concurrency 32 --apply
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+import database
+import gumroad_handler
+import payments
+from async_database import AsyncSupabase
+from session_tokens import new_token_version
+
+# Config
+RAZORPAY_API_URL = os.getenv("RAZORPAY_API_URL", "https://api.razorpay.com/v1")
+RECONCILE_SINCE = os.getenv("RECONCILE_SINCE", "2023-01-01")
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "16"))
+# Rows per Supabase GET (PostgREST's default max-rows is 1000)
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", "1000"))
+# Supabase pages read at once; kept below the API concurrency to spare the production database
+RECONCILE_DB_WINDOW = int(os.getenv("RECONCILE_DB_WINDOW", "8"))
+# Ids per PATCH / rows per POST; keeps the id=in.(...) URL well under proxy limits
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+RECONCILE_RETRIES = int(os.getenv("RECONCILE_RETRIES", "4"))
+# Whole-table pages and 200-row writes: allow more than the API's per-request timeout
+RECONCILE_READ_TIMEOUT = float(os.getenv("RECONCILE_READ_TIMEOUT", "60"))
+
+RAZORPAY_PAGE_SIZE = 100   # API maximum
+RECURRENCE_DAYS = {"monthly": 30, "quarterly": 90, "biannually": 182, "yearly": 365}
+USER_COLUMNS = "id,email,plan,payment_provider,gumroad_sale_id,subscription_end_date"
+TRANSACTION_COLUMNS = "id,gumroad_sale_id,razorpay_order_id,razorpay_payment_id,status"
+
+
+class ReconcileError(Exception):
+    """A source could not be read completely; nothing is applied from a partial view."""
+
+
+@dataclass(frozen=True)
+class Purchase:
+    """One Gumroad sale or Razorpay payment, reduced to what decides the plan."""
+    provider: str
+    ref: str                       # sale id / payment id
+    email: Optional[str]
+    refunded: bool                 # refunded, disputed or charged back
+    active: bool                   # not refunded and not past ends_at
+    amount: int
+    created_at: datetime
+    order_id: Optional[str] = None
+    ends_at: Optional[datetime] = None
+
+
+@dataclass
+class Changes:
+    """What the diff decided. Group keys are the JSON of one shared PATCH body."""
+    transaction_inserts: List[dict] = field(default_factory=list)
+    transaction_patches: Dict[str, List[str]] = field(default_factory=lambda: defaultdict(list))
+    user_patches: Dict[str, List[str]] = field(default_factory=lambda: defaultdict(list))
+    counts: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def patch_transaction(self, row_id: str, body: dict):
+        self.transaction_patches[json.dumps(body, sort_keys=True)].append(row_id)
+
+    def patch_user(self, row_id: str, body: dict):
+        self.user_patches[json.dumps(body, sort_keys=True)].append(row_id)
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def purchase_from_sale(sale: dict, now: datetime) -> Optional[Purchase]:
+    if sale.get("product_permalink", gumroad_handler.GUMROAD_PRODUCT_PERMALINK) != gumroad_handler.GUMROAD_PRODUCT_PERMALINK:
+        return None
+    created = _parse_time(sale.get("created_at")) or now
+    days = RECURRENCE_DAYS.get(sale.get("recurrence"))
+    ends_at = created + timedelta(days=days) if days else None
+    refunded = bool(sale.get("refunded") or sale.get("disputed") or sale.get("chargebacked"))
+    return Purchase("gumroad", sale["id"], (sale.get("email") or "").lower() or None, refunded,
+                    not refunded and (ends_at is None or ends_at > now), int(sale.get("price") or 0),
+                    created, ends_at=ends_at)
+
+
+def purchase_from_payment(payment: dict) -> Optional[Purchase]:
+    status = payment.get("status")
+    if status not in ("captured", "refunded"):
+        return None   # created / authorized / failed: no money kept
+    refunded = status == "refunded" or payment.get("refund_status") == "full"
+    email = payment.get("email") or (payment.get("notes") or {}).get("email")
+    return Purchase("razorpay", payment["id"], (email or "").lower() or None, refunded, not refunded,
+                    int(payment.get("amount") or 0), _parse_time(payment.get("created_at")),
+                    order_id=payment.get("order_id"))
+
+
+def diff(purchases: List[Purchase], users: List[dict], transactions: List[dict],
+         providers: Tuple[str, ...] = ("gumroad", "razorpay"), version: Optional[int] = None) -> Changes:
+    """Pure in-memory diff; every lookup below is a dict access."""
+    changes = Changes()
+    users_by_email = {u["email"].lower(): u for u in users if u.get("email")}
+    users_by_sale = {u["gumroad_sale_id"]: u for u in users if u.get("gumroad_sale_id")}
+    txn_by_sale = {t["gumroad_sale_id"]: t for t in transactions if t.get("gumroad_sale_id")}
+    txn_by_payment = {t["razorpay_payment_id"]: t for t in transactions if t.get("razorpay_payment_id")}
+    txn_by_order = {t["razorpay_order_id"]: t for t in transactions if t.get("razorpay_order_id")}
+
+    # Transactions: one row per purchase, with the right status
+    for p in purchases:
+        status = "refunded" if p.refunded else "paid"
+        if p.provider == "gumroad":
+            txn = txn_by_sale.get(p.ref)
+        else:
+            txn = txn_by_payment.get(p.ref) or (txn_by_order.get(p.order_id) if p.order_id else None)
+        if txn is None:
+            row = {"user_ip": None, "amount": p.amount, "status": status, "payment_provider": p.provider}
+            if p.provider == "gumroad":
+                row["gumroad_sale_id"] = p.ref
+            else:
+                row.update(razorpay_order_id=p.order_id, razorpay_payment_id=p.ref)
+            changes.transaction_inserts.append(row)
+            changes.counts["transactions_missing"] += 1
+        elif p.provider == "razorpay" and txn.get("razorpay_payment_id") != p.ref:
+            # Order row from create_order that never learned its payment id
+            changes.patch_transaction(txn["id"], {"razorpay_payment_id": p.ref, "status": status})
+            changes.counts["transactions_linked"] += 1
+        elif txn.get("status") != status:
+            changes.patch_transaction(txn["id"], {"status": status})
+            changes.counts["transactions_status"] += 1
+
+    # Users: entitlement per account
+    active: Dict[str, List[Purchase]] = defaultdict(list)
+    lapsed: Dict[str, dict] = {}
+    for p in purchases:
+        if p.active and p.email:
+            active[p.email].append(p)
+    active_ids = set()
+    for email, bought in active.items():
+        user = users_by_email.get(email)
+        if user is None:
+            changes.counts["purchases_without_account"] += 1
+            continue
+        active_ids.add(user["id"])
+        latest = max(bought, key=lambda p: p.created_at)
+        body = {}
+        if user.get("plan") != "pro":
+            body.update(plan="pro", payment_provider=latest.provider)
+            changes.counts["users_upgraded"] += 1
+        if all(p.ends_at for p in bought):
+            ends_at = max(p.ends_at for p in bought)
+            if _parse_time(user.get("subscription_end_date")) != ends_at:
+                body["subscription_end_date"] = ends_at.isoformat()
+                changes.counts["users_end_date"] += 1
+        elif user.get("subscription_end_date"):
+            # An active one-off purchase never ends: a date left by an older subscription
+            # would have the expiry path (subscription_expiry.py) downgrade a paying user
+            body["subscription_end_date"] = None
+            changes.counts["users_end_date"] += 1
+        gumroad_refs = {p.ref for p in bought if p.provider == "gumroad"}
+        if gumroad_refs and user.get("gumroad_sale_id") not in gumroad_refs:
+            # revoke_premium_access finds the user by sale id
+            body["gumroad_sale_id"] = max((p for p in bought if p.provider == "gumroad"),
+                                          key=lambda p: p.created_at).ref
+        if body:
+            if "plan" in body and version is not None:
+                body["token_version"] = version
+            changes.patch_user(user["id"], body)
+
+    for p in purchases:
+        if p.active:
+            continue
+        for user in (users_by_email.get(p.email) if p.email else None,
+                     users_by_sale.get(p.ref) if p.provider == "gumroad" else None):
+            if user is not None and user["id"] not in active_ids:
+                lapsed[user["id"]] = user
+    for user in lapsed.values():
+        provider = user.get("payment_provider")
+        if user.get("plan") != "pro" or (provider and provider not in providers):
+            continue   # already free, or paid through a source this run did not read
+        body = {"plan": "free"}
+        if user.get("gumroad_sale_id"):
+            body["gumroad_sale_id"] = None
+        if version is not None:
+            body["token_version"] = version
+        changes.patch_user(user["id"], body)
+        changes.counts["users_downgraded"] += 1
+
+    backed = active_ids | set(lapsed)
+    changes.counts["pro_without_purchase"] = sum(1 for u in users if u.get("plan") == "pro" and u["id"] not in backed)
+    return changes
+
+
+class Source:
+    """One upstream API: a pooled client, a concurrency cap and retries on 429/5xx."""
+
+    def __init__(self, base_url: str, concurrency: int, headers: dict = None, auth=None):
+        self.base_url = base_url
+        self.limit = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(headers=headers, auth=auth, timeout=httpx.Timeout(30, connect=5),
+                                        limits=httpx.Limits(max_connections=concurrency,
+                                                            max_keepalive_connections=concurrency))
+        self.requests = 0
+
+    async def get(self, path: str, params: dict = None) -> dict:
+        for attempt in range(RECONCILE_RETRIES + 1):
+            async with self.limit:
+                self.requests += 1
+                try:
+                    resp = await self.client.get(f"{self.base_url}{path}", params=params)
+                except httpx.TransportError as e:
+                    error = str(e)
+                else:
+                    if resp.status_code == 200:
+                        return resp.json()
+                    error = f"{resp.status_code} {resp.text[:200]}"
+                    if resp.status_code not in (429, 500, 502, 503, 504):
+                        break
+            if attempt < RECONCILE_RETRIES:
+                await asyncio.sleep(random.uniform(0, 0.5 * (2 ** attempt)))
+        raise ReconcileError(f"GET {self.base_url}{path} {params}: {error}")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+async def fetch_gumroad_sales(source: Source, since: datetime, until: datetime, shards: int) -> Dict[str, dict]:
+    """
+    Sales created in [since, until]. A page_key chain can only be walked one page
+    at a time, so the range is cut into date windows walked side by side; a window
+    whose first page says there is more is split in half (down to one day), so
+    the chains end up short wherever the sales actually are.
+    """
+    first_day, last_day = since.date(), until.date()
+    days = (last_day - first_day).days + 1
+    step = max(1, -(-days // shards))
+    sales: Dict[str, dict] = {}
+
+    async def walk(start, end):
+        # after/before are exclusive day bounds
+        params = {"after": (start - timedelta(days=1)).isoformat(), "before": (end + timedelta(days=1)).isoformat()}
+        page = await source.get("/sales", params)
+        if page.get("next_page_key") and start < end:
+            middle = start + (end - start) // 2
+            await asyncio.gather(walk(start, middle), walk(middle + timedelta(days=1), end))
+            return
+        while True:
+            for sale in page.get("sales", []):
+                sales[sale["id"]] = sale
+            if not page.get("next_page_key"):
+                return
+            page = await source.get("/sales", {**params, "page_key": page["next_page_key"]})
+
+    await asyncio.gather(*(walk(first_day + timedelta(days=d), min(first_day + timedelta(days=d + step - 1), last_day))
+                           for d in range(0, days, step)))
+    return sales
+
+
+async def fetch_razorpay_payments(source: Source, since: datetime, until: datetime, window: int) -> Dict[str, dict]:
+    """Payments created in [since, until]: `window` offset pages at a time until one comes back short."""
+    payments_by_id: Dict[str, dict] = {}
+    base = {"count": RAZORPAY_PAGE_SIZE, "from": int(since.timestamp()), "to": int(until.timestamp())}
+    skip = 0
+    while True:
+        pages = await asyncio.gather(*(source.get("/payments", {**base, "skip": skip + i * RAZORPAY_PAGE_SIZE})
+                                       for i in range(window)))
+        for page in pages:
+            for payment in page.get("items", []):
+                payments_by_id[payment["id"]] = payment
+        if any(len(page.get("items", [])) < RAZORPAY_PAGE_SIZE for page in pages):
+            return payments_by_id
+        skip += window * RAZORPAY_PAGE_SIZE
+
+
+# The job's own client, so its timeouts and pool do not touch the API's
+job_supabase = AsyncSupabase(read_timeout=RECONCILE_READ_TIMEOUT)
+
+
+async def _supabase(method: str, endpoint: str, params=None, data=None, prefer: Optional[str] = "return=minimal"):
+    resp = await job_supabase.send(method, f"{database.SUPABASE_URL}/rest/v1/{endpoint}", params=params, json=data,
+                                     prefer=prefer)
+    if resp.status_code >= 300:
+        raise ReconcileError(f"{method} {endpoint} -> {resp.status_code} {resp.text[:200]}")
+    return resp
+
+
+async def fetch_table(table: str, columns: str, window: int) -> List[dict]:
+    """Every row, `window` pages of RECONCILE_PAGE_SIZE at a time, in a stable id order."""
+    rows: List[dict] = []
+    offset = 0
+    while True:
+        pages = await asyncio.gather(*(
+            _supabase("GET", table, params={"select": columns, "order": "id",
+                                            "limit": RECONCILE_PAGE_SIZE, "offset": offset + i * RECONCILE_PAGE_SIZE},
+                      prefer=None)
+            for i in range(window)))
+        for resp in pages:
+            rows.extend(resp.json())
+        if any(len(resp.json()) < RECONCILE_PAGE_SIZE for resp in pages):
+            return rows
+        offset += window * RECONCILE_PAGE_SIZE
+
+
+async def apply(changes: Changes, concurrency: int) -> int:
+    """
+    Sends the changes; returns the number of write requests.
+    A change set shared by several rows is one PATCH per chunk of ids. Row-specific
+    user changes (a sale id, an end date) are one PATCH ?id=eq.X each: an upsert
+    would propose rows without email or ip_address, and Postgres checks
+    user_identifier_check on the proposed row before resolving the conflict.
+    Row-specific transaction changes (no such constraints) go as batched upserts on id.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    calls = []
+
+    async def send(method, table, params=None, data=None, prefer="return=minimal"):
+        async with limit:
+            await _supabase(method, table, params=params, data=data, prefer=prefer)
+
+    # PostgREST wants the same keys in every object of a bulk body
+    bulk: Dict[tuple, List[dict]] = defaultdict(list)
+    for table, groups in (("users", changes.user_patches), ("transactions", changes.transaction_patches)):
+        for body, ids in groups.items():
+            if len(ids) == 1 and table == "users":
+                calls.append(send("PATCH", table, params={"id": f"eq.{ids[0]}"}, data=json.loads(body)))
+                continue
+            if len(ids) == 1:
+                row = {"id": ids[0], **json.loads(body)}
+                bulk[(table, "upsert", tuple(sorted(row)))].append(row)
+                continue
+            for i in range(0, len(ids), RECONCILE_BATCH_SIZE):
+                chunk = ids[i:i + RECONCILE_BATCH_SIZE]
+                calls.append(send("PATCH", table, params={"id": f"in.({','.join(chunk)})"}, data=json.loads(body)))
+    for row in changes.transaction_inserts:
+        bulk[("transactions", "insert", tuple(sorted(row)))].append(row)
+
+    for (table, kind, _), rows in bulk.items():
+        for i in range(0, len(rows), RECONCILE_BATCH_SIZE):
+            if kind == "upsert":
+                calls.append(send("POST", table, params={"on_conflict": "id"}, data=rows[i:i + RECONCILE_BATCH_SIZE],
+                                  prefer="resolution=merge-duplicates,return=minimal"))
+            else:
+                calls.append(send("POST", table, data=rows[i:i + RECONCILE_BATCH_SIZE]))
+    await asyncio.gather(*calls)
+    return len(calls)
+
+
+async def reconcile(since: datetime = None, until: datetime = None, write: bool = False,
+                    concurrency: int = RECONCILE_CONCURRENCY) -> dict:
+    """Runs one pass; returns counts and timings. Writes only when write=True."""
+    now = datetime.now(timezone.utc)
+    since = since or _parse_time(RECONCILE_SINCE)
+    until = until or now
+    started = time.perf_counter()
+
+    sources = {}
+    if gumroad_handler.GUMROAD_ACCESS_TOKEN:
+        sources["gumroad"] = Source(gumroad_handler.GUMROAD_API_URL, concurrency,
+                                    headers={"Authorization": f"Bearer {gumroad_handler.GUMROAD_ACCESS_TOKEN}"})
+    if payments.KEY_ID and payments.KEY_SECRET:
+        sources["razorpay"] = Source(RAZORPAY_API_URL, concurrency, auth=(payments.KEY_ID, payments.KEY_SECRET))
+    if not sources:
+        raise ReconcileError("neither Gumroad nor Razorpay credentials are configured")
+
+    async def none():
+        return {}
+
+    try:
+        sales, paid, users, transactions = await asyncio.gather(
+            fetch_gumroad_sales(sources["gumroad"], since, until, concurrency * 4) if "gumroad" in sources else none(),
+            fetch_razorpay_payments(sources["razorpay"], since, until, concurrency) if "razorpay" in sources else none(),
+            fetch_table("users", USER_COLUMNS, min(concurrency, RECONCILE_DB_WINDOW)),
+            fetch_table("transactions", TRANSACTION_COLUMNS, min(concurrency, RECONCILE_DB_WINDOW)),
+        )
+        fetched = time.perf_counter()
+
+        purchases = [p for p in (purchase_from_sale(s, now) for s in sales.values()) if p]
+        purchases += [p for p in (purchase_from_payment(p) for p in paid.values()) if p]
+        changes = diff(purchases, users, transactions, tuple(sources), version=new_token_version())
+        diffed = time.perf_counter()
+
+        writes = await apply(changes, concurrency) if write else 0
+    finally:
+        for source in sources.values():
+            await source.aclose()
+        await job_supabase.aclose()
+    return {
+        "sources": list(sources),
+        "gumroad_sales": len(sales),
+        "razorpay_payments": len(paid),
+        "users": len(users),
+        "transactions": len(transactions),
+        **changes.counts,
+        "write_requests": writes,
+        "api_requests": {name: source.requests for name, source in sources.items()},
+        "fetch_s": round(fetched - started, 3),
+        "diff_s": round(diffed - fetched, 3),
+        "apply_s": round(time.perf_counter() - diffed, 3),
+        "applied": write,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile users and transactions with Gumroad and Razorpay.")
+    parser.add_argument("--since", default=RECONCILE_SINCE, help="first purchase date to read (YYYY-MM-DD)")
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY,
+                        help="max open requests per source")
+    parser.add_argument("--apply", action="store_true", help="write the corrections (default: dry run)")
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(reconcile(_parse_time(args.since), write=args.apply, concurrency=args.concurrency))
+    for key, value in summary.items():
+        print(f"{key:<28}{value}")
+    if not args.apply:
+        print("Dry run: nothing written. Re-run with --apply to write the corrections.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import os
-import requests
+from supabase_session import supabase_session
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,20 +9,13 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 def reset_ip_credits(ip_address):
     """Reset message count for a specific IP address"""
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=representation"
-    }
-    
     # Update the user's msg_count to 0
     url = f"{SUPABASE_URL}/rest/v1/users"
     params = {"ip_address": f"eq.{ip_address}"}
     data = {"msg_count": 0}
     
     try:
-        resp = requests.patch(url, headers=headers, params=params, json=data)
+        resp = supabase_session.request("PATCH", url, SUPABASE_KEY, params=params, json=data)
         print(f"Status: {resp.status_code}")
         print(f"Response: {resp.text}")
         
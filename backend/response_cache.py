@@ -0,0 +1,121 @@
+"""
+Exact-match response cache for /chat.
+Keyed on persona id, normalized question and model parameters.
+LRU eviction with a TTL and a byte budget.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Config
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+# Rough per-entry bookkeeping cost (dict slot, tuple, floats) added to key + value bytes
+ENTRY_OVERHEAD_BYTES = 120
+
+_PUNCTUATION = " \t\n\r.,!?;:'\"`"
+
+
+def normalize_message(message: str) -> str:
+    """Lowercases, collapses whitespace and trims surrounding punctuation."""
+    return " ".join(message.lower().split()).strip(_PUNCTUATION)
+
+
+def make_cache_key(persona_id: str, message: str, model_params: dict, persona_version: str = "") -> str:
+    """
+    Stable key for a chat request.
+    persona_version (the registry fingerprint) makes edited prompts or rules miss
+    instead of serving stale answers.
+    """
+    material = json.dumps({
+        "persona": persona_id,
+        "message": normalize_message(message),
+        "params": model_params,
+        "version": persona_version,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU of response text with TTL and a byte limit."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (response_text, expires_at, size_bytes)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, self._clock() + self.ttl, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+response_cache = ResponseCache()
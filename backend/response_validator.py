@@ -0,0 +1,175 @@
+"""
+Shared response validation engine.
+One place for the persona word cap and forbidden-phrase rules, used by every
+LLM handler and by the streaming path.
+
+Forbidden phrases are compiled once per phrase list into a single trie-shaped
+regex, so all of them are found and removed in one pass over the text.
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+DEFAULT_MAX_WORDS = 150
+
+
+def _trie_regex(phrases: Iterable[str]) -> str:
+    """
+    Builds one regex shaped like a trie of the phrases ("de(?:lve|ep dive)").
+    Python's re tries alternatives one by one, so a flat "a|b|c|..." costs
+    O(phrases) at every text position; the trie only follows matching prefixes.
+    Alternatives are ordered so the longest phrase wins on overlaps.
+    """
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A phrase ends here but longer ones continue: greedy optional tail
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class PhraseMatcher:
+    """
+    Compiled forbidden-phrase list. sub() removes every phrase, any casing,
+    in a single scan of the text.
+    """
+
+    def __init__(self, phrases: Tuple[str, ...]):
+        lowered = sorted({p.lower() for p in phrases if p})
+        self.phrases = phrases
+        self.longest = max(len(p) for p in lowered)
+        # Matched against text.lower(), so no IGNORECASE on the hot path
+        self._lower = re.compile(_trie_regex(lowered))
+        # For the rare text whose lowercase changes length ("İ"), positions would shift
+        self._fallback = re.compile("|".join(re.escape(p) for p in sorted(lowered, key=len, reverse=True)), re.IGNORECASE)
+
+    def sub(self, repl: str, text: str) -> str:
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            return self._fallback.sub(repl, text)
+        parts = []
+        last = 0
+        for match in self._lower.finditer(lowered):
+            parts.append(text[last:match.start()])
+            parts.append(repl)
+            last = match.end()
+        if not last:
+            return text
+        parts.append(text[last:])
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _compile(phrases: Tuple[str, ...]) -> Optional[PhraseMatcher]:
+    if not any(phrases):
+        return None
+    return PhraseMatcher(phrases)
+
+
+def compile_phrases(phrases: Iterable[str]) -> Optional[PhraseMatcher]:
+    """Returns the shared compiled matcher for a phrase list (None if empty)."""
+    return _compile(tuple(phrases))
+
+
+def strip_phrases(text: str, phrases: Iterable[str]) -> str:
+    """Removes every forbidden phrase, any casing, in a single scan."""
+    matcher = compile_phrases(phrases)
+    return matcher.sub("", text) if matcher else text
+
+
+def truncate_words(text: str, max_words: int) -> str:
+    words = text.split()
+    if len(words) > max_words:
+        # Hard cut
+        return " ".join(words[:max_words]) + "..."
+    return text
+
+
+def validate_response(text: str, rules: dict) -> str:
+    """
+    Validates and cleans the response based on rules.
+    1. Truncate to max_words
+    2. Strip forbidden phrases (case-insensitive)
+    """
+    text = truncate_words(text, rules.get("max_words", DEFAULT_MAX_WORDS))
+    return strip_phrases(text, rules.get("forbidden_phrases", ()))
+
+
+class StreamGuard:
+    """
+    Incremental version of validate_response for streamed responses.
+    Feed it upstream deltas, forward whatever it returns.
+
+    Text is only released on word boundaries, and the tail that could still be
+    the start of a forbidden phrase is held back until the next chunk arrives.
+    Once max_words have been released, `done` flips and the caller should
+    cancel the upstream generation.
+    """
+
+    def __init__(self, rules: dict):
+        self.max_words = rules.get("max_words", DEFAULT_MAX_WORDS)
+        self._matcher = compile_phrases(rules.get("forbidden_phrases", ()))
+        self._holdback = self._matcher.longest - 1 if self._matcher else 0
+        self._pending = ""
+        self.words = 0
+        self.done = False
+
+    def _strip(self, text: str) -> str:
+        return self._matcher.sub("", text) if self._matcher else text
+
+    def _release(self, text: str) -> str:
+        words = text.split()
+        if self.words + len(words) <= self.max_words:
+            self.words += len(words)
+            return text
+
+        # Cap reached inside this segment: keep leading whitespace, cut at the cap
+        keep = self.max_words - self.words
+        self.words = self.max_words
+        self.done = True
+        self._pending = ""
+        leading = text[:len(text) - len(text.lstrip())]
+        return leading + " ".join(words[:keep]) + "..."
+
+    def feed(self, chunk: str) -> str:
+        """Returns the text that is safe to send to the client now."""
+        if self.done or not chunk:
+            return ""
+
+        buffer = self._strip(self._pending + chunk)
+
+        # Hold back anything that could still grow into a forbidden phrase or a longer word
+        limit = len(buffer) - self._holdback
+        cut = -1
+        for i in range(max(limit, 0) - 1, -1, -1):
+            if buffer[i].isspace():
+                cut = i
+                break
+        if cut <= 0:
+            self._pending = buffer
+            return ""
+
+        self._pending = buffer[cut:]
+        return self._release(buffer[:cut])
+
+    def flush(self) -> str:
+        """Releases whatever is still held back once the upstream stream ends."""
+        if self.done:
+            return ""
+        text = self._strip(self._pending)
+        self._pending = ""
+        if not text.strip():
+            return ""
+        return self._release(text)
@@ -0,0 +1,239 @@
+"""
+Near-duplicate question cache for /chat.
+Questions are embedded locally with hashed word + character n-gram vectors
+(no network, no model download) and matched against a NumPy index per persona.
+
+Off unless SEMANTIC_CACHE_ENABLED=1. The hashed vectors are a bag of words: they
+score "is Python better than Go" / "is Go better than Python" at 1.0 and
+"should I hire him" / "should I fire him" above 0.8. So a hit also needs the
+same content words in the same order, allowing for case, punctuation, stopwords,
+plurals and small typos. Cosine only picks the candidate.
+
+Memory: an index holds up to MAX_ENTRIES x DIM float32s (100000 x 256, about
+100 MB). With MAX_NAMESPACES at 12, the defaults can reach about 1.2 GB. Indexes
+start small and double as entries arrive.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+
+# Config
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "256"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "100000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# Namespaces change whenever persona.json or the word cap does; the least recently
+# used indexes beyond this many (2 per persona by default) are dropped
+SEMANTIC_CACHE_MAX_NAMESPACES = int(os.getenv("SEMANTIC_CACHE_MAX_NAMESPACES", "12"))
+
+# Words that carry no topic signal in advice questions
+STOPWORDS = set("""
+i im a an the to my me of for is it its do does should would could can we you your be am are
+have has with on in at and or what how about think this that so just
+""".split())
+
+# Character trigrams help with plurals and typos but count less than whole words
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.35
+
+# Shorter words must match exactly ("hire" / "fire"); longer ones may differ by a typo
+TYPO_MIN_LENGTH = 5
+TYPO_MIN_RATIO = 0.8
+
+
+def _content_words(text: str) -> List[str]:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [w for w in words if w not in STOPWORDS] or words
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def question_key(text: str) -> Tuple[str, ...]:
+    """Content words in order, plurals folded; what a semantic hit has to agree on."""
+    return tuple(_stem(w) for w in _content_words(text))
+
+
+def _same_word(a: str, b: str) -> bool:
+    return a == b or (min(len(a), len(b)) >= TYPO_MIN_LENGTH
+                      and SequenceMatcher(None, a, b).ratio() >= TYPO_MIN_RATIO)
+
+
+def same_question(a: Tuple[str, ...], b: Tuple[str, ...]) -> bool:
+    """Word-by-word check: a missing "not", a swapped antonym or a new word order is a different question."""
+    return len(a) == len(b) and all(_same_word(x, y) for x, y in zip(a, b))
+
+
+def _features(text: str) -> List[tuple]:
+    content = _content_words(text)
+    features = []
+    for word in content:
+        features.append((f"w:{word}", WORD_WEIGHT))
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            features.append((f"c:{padded[i:i + 3]}", TRIGRAM_WEIGHT))
+    return features
+
+
+def embed(text: str, dim: int = SEMANTIC_CACHE_DIM) -> np.ndarray:
+    """Signed feature hashing into a unit-length float32 vector."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if (h >> 16) & 1 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def semantic_namespace(persona_id: str, model_params: dict, persona_version: str = "") -> str:
+    """One index per persona and generation setup, so answers never cross personas or prompts."""
+    digest = hashlib.sha256(json.dumps([model_params, persona_version], sort_keys=True, default=str).encode("utf-8"))
+    return f"{persona_id}:{digest.hexdigest()[:12]}"
+
+
+class VectorIndex:
+    """
+    Brute-force cosine index over a contiguous float32 matrix.
+    Capacity doubles as it grows; once max_entries is reached the oldest slot is overwritten.
+    """
+
+    def __init__(self, dim: int = SEMANTIC_CACHE_DIM, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 initial_capacity: int = 1024):
+        self.dim = dim
+        self.max_entries = max_entries
+        capacity = min(initial_capacity, max_entries)
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._values: List[Any] = [None] * capacity
+        self.count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _grow(self):
+        capacity = min(len(self._vectors) * 2, self.max_entries)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.count] = self._vectors[:self.count]
+        expires = np.zeros(capacity, dtype=np.float64)
+        expires[:self.count] = self._expires[:self.count]
+        self._vectors, self._expires = vectors, expires
+        self._values.extend([None] * (capacity - len(self._values)))
+
+    def add(self, vector: np.ndarray, value: Any, expires_at: float):
+        self.add_batch(vector.reshape(1, -1), [value], np.array([expires_at]))
+
+    def add_batch(self, vectors: np.ndarray, values: List[Any], expires_at: np.ndarray):
+        with self._lock:
+            for row, value, expiry in zip(vectors, values, expires_at):
+                if self.count == len(self._vectors) and self.count < self.max_entries:
+                    self._grow()
+                slot = self._next
+                self._vectors[slot] = row
+                self._expires[slot] = expiry
+                self._values[slot] = value
+                self._next = (slot + 1) % self.max_entries
+                self.count = min(self.count + 1, self.max_entries)
+
+    def search(self, vector: np.ndarray, now: float):
+        """Returns (score, value) of the best live match, or (0.0, None)."""
+        with self._lock:
+            if not self.count:
+                return 0.0, None
+            scores = self._vectors[:self.count] @ vector
+            best = int(np.argmax(scores))
+            if self._expires[best] <= now:
+                # Only pay for the expiry mask when the best match is stale
+                scores[self._expires[:self.count] <= now] = -1.0
+                best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score <= 0:
+                return 0.0, None
+            return score, self._values[best]
+
+    def memory_bytes(self) -> int:
+        """Matrix + expiry array; response strings are shared with the cache and counted separately."""
+        return self._vectors.nbytes + self._expires.nbytes
+
+
+class SemanticCache:
+    """Per-namespace vector indexes (LRU-bounded) with a similarity threshold."""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, dim: int = SEMANTIC_CACHE_DIM,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl: float = SEMANTIC_CACHE_TTL,
+                 max_namespaces: int = SEMANTIC_CACHE_MAX_NAMESPACES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_namespaces = max_namespaces
+        self._clock = clock
+        self._indexes: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Above the threshold but a different question on the word-by-word check
+        self.rejected = 0
+        self.evicted_namespaces = 0
+
+    def _index(self, namespace: str, create: bool = True) -> Optional[VectorIndex]:
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None and create:
+                index = self._indexes[namespace] = VectorIndex(self.dim, self.max_entries)
+                while len(self._indexes) > self.max_namespaces:
+                    # A persona reload or cap change left this one behind
+                    self._indexes.popitem(last=False)
+                    self.evicted_namespaces += 1
+            elif index is not None:
+                self._indexes.move_to_end(namespace)
+            return index
+
+    def lookup(self, namespace: str, message: str) -> Optional[str]:
+        start = time.perf_counter()
+        index = self._index(namespace, create=False)
+        score, value = index.search(embed(message, self.dim), self._clock()) if index else (0.0, None)
+        metrics.observe("semantic_lookup_ms", (time.perf_counter() - start) * 1000)
+        if value is not None and score >= self.threshold:
+            key, response_text = value
+            if same_question(question_key(message), key):
+                self.hits += 1
+                return response_text
+            self.rejected += 1
+        self.misses += 1
+        return None
+
+    def insert(self, namespace: str, message: str, response_text: str):
+        self._index(namespace).add(embed(message, self.dim), (question_key(message), response_text),
+                                   self._clock() + self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = dict(self._indexes)
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "namespaces": len(indexes),
+            "evicted_namespaces": self.evicted_namespaces,
+            "entries": sum(i.count for i in indexes.values()),
+            "index_bytes": sum(i.memory_bytes() for i in indexes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,128 @@
+"""
+Session tokens for the auth cookies.
+
+Access token (auth_token cookie, ACCESS_TOKEN_MINUTES): carries email, plan,
+subscription_end_date and the user's token_version, so /auth/me answers
+without reading users. Refresh token (refresh_token cookie, REFRESH_TOKEN_DAYS):
+identity only; it is traded for a new access token built from the current
+users row (/auth/refresh, or inline in /auth/me).
+
+users.token_version is set to a new, larger value whenever the plan changes
+(grant/revoke premium, migrate-premium). An access token minted under an older
+version is stale: this process stops trusting it as soon as it sees the bump
+(note_token_version), other workers when the access token expires.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import jwt
+from fastapi import Request, Response
+
+from middleware.auth_middleware import JWT_ALGORITHM, SECRET_KEY, verified_tokens
+
+# Config
+ACCESS_TOKEN_MINUTES = int(os.getenv("ACCESS_TOKEN_MINUTES", "15"))
+REFRESH_TOKEN_DAYS = int(os.getenv("REFRESH_TOKEN_DAYS", "7"))
+COOKIE_SECURE = os.getenv("COOKIE_SECURE", "0") == "1"
+
+ACCESS_COOKIE = "auth_token"
+REFRESH_COOKIE = "refresh_token"
+
+# email -> (latest token_version, noted at); only matters for ACCESS_TOKEN_MINUTES
+_known_versions: Dict[str, tuple] = {}
+_versions_lock = threading.Lock()
+_KNOWN_VERSIONS_MAX = 10000
+
+
+def new_token_version() -> int:
+    """Milliseconds since the epoch: larger than any version handed out before it."""
+    return time.time_ns() // 1_000_000
+
+
+def note_token_version(email: str, version: int):
+    """Record a plan change made in this process, so older access tokens stop being trusted."""
+    now = time.monotonic()
+    with _versions_lock:
+        _known_versions[email] = (version, now)
+        if len(_known_versions) > _KNOWN_VERSIONS_MAX:
+            horizon = now - ACCESS_TOKEN_MINUTES * 60
+            for key in [k for k, (_, noted) in _known_versions.items() if noted < horizon]:
+                del _known_versions[key]
+
+
+def is_current(claims: dict) -> bool:
+    known = _known_versions.get(claims.get("email"))
+    return known is None or claims.get("ver", 0) >= known[0]
+
+
+def issue_access_token(user: dict) -> str:
+    payload = {
+        "type": "access",
+        "email": user["email"],
+        "plan": user.get("plan") or "free",
+        "sub_end": user.get("subscription_end_date"),
+        "ver": user.get("token_version") or 0,
+        "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def issue_refresh_token(email: str) -> str:
+    payload = {
+        "type": "refresh",
+        "email": email,
+        "exp": datetime.utcnow() + timedelta(days=REFRESH_TOKEN_DAYS),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def session_user(claims: dict) -> dict:
+    """The /auth/me body, from access token claims."""
+    return {"email": claims["email"], "plan": claims.get("plan", "free"),
+            "subscription_end_date": claims.get("sub_end")}
+
+
+def set_access_cookie(response: Response, user: dict) -> str:
+    token = issue_access_token(user)
+    response.set_cookie(key=ACCESS_COOKIE, value=token, httponly=True, max_age=ACCESS_TOKEN_MINUTES * 60,
+                        samesite="lax", secure=COOKIE_SECURE)
+    return token
+
+
+def set_session_cookies(response: Response, user: dict) -> str:
+    """Sets both cookies after login/signup; returns the access token."""
+    # path=/ so get_user_identifier can still name the user on /chat once the access token lapses
+    response.set_cookie(key=REFRESH_COOKIE, value=issue_refresh_token(user["email"]), httponly=True,
+                        max_age=REFRESH_TOKEN_DAYS * 24 * 60 * 60, samesite="lax", secure=COOKIE_SECURE)
+    return set_access_cookie(response, user)
+
+
+def clear_session_cookies(request: Request, response: Response):
+    for name in (ACCESS_COOKIE, REFRESH_COOKIE):
+        token = request.cookies.get(name)
+        if token:
+            verified_tokens.revoke(token)
+        response.delete_cookie(name)
+
+
+def read_access(request: Request) -> Optional[dict]:
+    """
+    Claims of a valid, current access token, or None.
+    Tokens from before this scheme (no type) are returned too; they carry no plan.
+    """
+    token = request.cookies.get(ACCESS_COOKIE)
+    claims = verified_tokens.decode(token) if token else None
+    if not claims or claims.get("type", "access") != "access" or not is_current(claims):
+        return None
+    return claims
+
+
+def read_refresh(request: Request) -> Optional[dict]:
+    token = request.cookies.get(REFRESH_COOKIE)
+    claims = verified_tokens.decode(token) if token else None
+    if not claims or claims.get("type") != "refresh":
+        return None
+    return claims
@@ -0,0 +1,50 @@
+"""
+Single-flight request coalescing.
+Concurrent calls with the same key share one in-flight upstream call.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    The first caller for a key (the leader) starts the work as its own task;
+    callers that arrive while it runs await the same task.
+    The task is shielded, so a leader whose client disconnects does not cancel it
+    for everyone else.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when nobody is left awaiting it
+            task.exception()
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._in_flight),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "saved_ratio": round(self.coalesced / calls, 4) if calls else 0.0,
+        }
+
+
+chat_flight = SingleFlight()
@@ -0,0 +1,266 @@
+"""
+Subscription expiry, driven by an in-memory index of users.subscription_end_date.
+At startup every pro user with an end date is loaded (one paged query on the
+idx_users_subscription_end_date column) into a min-heap ordered by end date,
+plus a dict from identifier (email and IP) to end date.
+
+- The quota path asks is_active(identifier): one dict lookup, no DB read.
+  A pro identifier past its end date is sent to the check_can_chat RPC,
+  which downgrades it in the same transaction (check_can_chat_rpc.sql).
+- A timer pops everything due off the heap every EXPIRY_SWEEP_INTERVAL seconds
+  and downgrades it with one conditional PATCH per batch of ids
+  (plan=eq.pro, subscription_end_date=lte.now), so a renewal that landed in
+  the meantime is never undone.
+- The index is reloaded every EXPIRY_RELOAD_INTERVAL seconds to pick up end
+  dates written by other processes (reconcile.py, manual edits).
+- Purchases (gumroad_handler, payments) clear subscription_end_date and forget
+  the user here, so buying again after a lapse is not downgraded by the old date.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import database
+from metrics import metrics
+from session_tokens import new_token_version, note_token_version
+
+# Config
+EXPIRY_ENABLED = os.getenv("EXPIRY_ENABLED", "1") == "1"
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+EXPIRY_RELOAD_INTERVAL = float(os.getenv("EXPIRY_RELOAD_INTERVAL", "3600"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "200"))
+EXPIRY_PAGE_SIZE = 1000
+
+USER_COLUMNS = "id,email,ip_address,subscription_end_date"
+
+
+def _timestamp(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def load_expiring_users(request: Callable = None) -> List[dict]:
+    """Every pro user with an end date, paged in id order."""
+    request = request or database.supabase_request
+    rows, offset = [], 0
+    while True:
+        page = request("GET", "users", params={
+            "select": USER_COLUMNS, "plan": "eq.pro", "subscription_end_date": "not.is.null",
+            "order": "id", "limit": EXPIRY_PAGE_SIZE, "offset": offset})
+        if page is None:
+            raise RuntimeError("could not load subscription end dates")
+        rows.extend(page)
+        if len(page) < EXPIRY_PAGE_SIZE:
+            return rows
+        offset += EXPIRY_PAGE_SIZE
+
+
+def fetch_users(ids: List[str], request: Callable = None) -> Optional[List[dict]]:
+    request = request or database.supabase_request
+    return request("GET", "users", params={"select": USER_COLUMNS + ",plan", "id": f"in.({','.join(ids)})"})
+
+
+def downgrade_expired(ids: List[str], now: float, version: int, request: Callable = None) -> Optional[List[dict]]:
+    """One conditional PATCH; returns the rows it actually downgraded, or None on failure."""
+    request = request or database.supabase_request
+    return request("PATCH", "users", params={
+        "id": f"in.({','.join(ids)})", "plan": "eq.pro", "subscription_end_date": f"lte.{_iso(now)}",
+    }, data={"plan": "free", "token_version": version})
+
+
+class ExpiryIndex:
+    """
+    Min-heap of (end, user id) with lazy deletion: a user's current end date lives
+    in _users, and heap entries that no longer match it are skipped when popped.
+    """
+
+    def __init__(self, load: Callable[[], List[dict]] = load_expiring_users,
+                 downgrade: Callable[[List[str], float, int], Optional[List[dict]]] = downgrade_expired,
+                 fetch: Callable[[List[str]], Optional[List[dict]]] = fetch_users,
+                 sweep_interval: float = EXPIRY_SWEEP_INTERVAL, reload_interval: float = EXPIRY_RELOAD_INTERVAL,
+                 batch_size: int = EXPIRY_BATCH_SIZE, clock: Callable[[], float] = time.time):
+        self._load = load
+        self._downgrade = downgrade
+        self._fetch = fetch
+        self.sweep_interval = sweep_interval
+        self.reload_interval = reload_interval
+        self.batch_size = batch_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        # user id -> (end, identifiers)
+        self._users: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+        # email / IP -> end
+        self._ends: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loaded_at = 0.0
+        self.sweeps = 0
+        self.downgraded = 0
+        self.renewed = 0
+        self.failures = 0
+
+    # --- Index --------------------------------------------------------------
+
+    def track(self, user: dict):
+        """Adds or moves a user's end date; a user without one is dropped."""
+        end = _timestamp(user.get("subscription_end_date"))
+        identifiers = tuple(i for i in (user.get("email"), user.get("ip_address")) if i)
+        with self._lock:
+            self._forget(user["id"])
+            if end is None:
+                return
+            self._users[user["id"]] = (end, identifiers)
+            for identifier in identifiers:
+                self._ends[identifier] = end
+            heapq.heappush(self._heap, (end, user["id"]))
+
+    def forget(self, user_id: str):
+        with self._lock:
+            self._forget(user_id)
+
+    def _forget(self, user_id: str):
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            for identifier in old[1]:
+                if self._ends.get(identifier) == old[0]:
+                    del self._ends[identifier]
+
+    def load(self, users: Iterable[dict] = None):
+        """Rebuilds the index (from the database unless rows are given)."""
+        users = self._load() if users is None else users
+        users_by_id, ends, heap = {}, {}, []
+        for user in users:
+            end = _timestamp(user.get("subscription_end_date"))
+            if end is None:
+                continue
+            identifiers = tuple(i for i in (user.get("email"), user.get("ip_address")) if i)
+            users_by_id[user["id"]] = (end, identifiers)
+            for identifier in identifiers:
+                ends[identifier] = end
+            heap.append((end, user["id"]))
+        heapq.heapify(heap)
+        with self._lock:
+            self._users, self._ends, self._heap = users_by_id, ends, heap
+            self._loaded_at = self._clock()
+        print(f"[expiry] Loaded {len(users_by_id)} subscription end dates")
+
+    def is_active(self, identifier: str) -> bool:
+        """O(1): False only for an identifier whose known end date has passed."""
+        end = self._ends.get(identifier)
+        return end is None or end > self._clock()
+
+    # --- Sweeps -------------------------------------------------------------
+
+    def _pop_due(self, now: float) -> List[str]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                end, user_id = heapq.heappop(self._heap)
+                current = self._users.get(user_id)
+                if current is not None and current[0] == end:
+                    due.append(user_id)
+        return due
+
+    def sweep(self) -> int:
+        """Downgrades every user whose end date has passed. Returns how many were downgraded."""
+        now = self._clock()
+        due = self._pop_due(now)
+        if not due:
+            return 0
+        version = new_token_version()
+        downgraded = 0
+        for i in range(0, len(due), self.batch_size):
+            batch = due[i:i + self.batch_size]
+            rows = self._downgrade(batch, now, version)
+            if rows is None:
+                # Keep them due; the next sweep retries
+                with self._lock:
+                    self.failures += 1
+                    for user_id in batch:
+                        if user_id in self._users:
+                            heapq.heappush(self._heap, (self._users[user_id][0], user_id))
+                continue
+            done = {row["id"] for row in rows}
+            for row in rows:
+                if row.get("email"):
+                    note_token_version(row["email"], version)
+            with self._lock:
+                for user_id in done:
+                    self._forget(user_id)
+                self.downgraded += len(done)
+            downgraded += len(done)
+            skipped = [user_id for user_id in batch if user_id not in done]
+            if skipped:
+                # Renewed, or already downgraded by check_can_chat: take the database's word for it
+                self._refresh(skipped)
+        with self._lock:
+            self.sweeps += 1
+        metrics.incr("subscriptions_expired", downgraded)
+        return downgraded
+
+    def _refresh(self, ids: List[str]):
+        rows = self._fetch(ids) or []
+        with self._lock:
+            self.renewed += sum(1 for row in rows if row.get("plan") == "pro")
+        for row in rows:
+            if row.get("plan") == "pro":
+                self.track(row)
+            else:
+                self.forget(row["id"])
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                if self._clock() - self._loaded_at >= self.reload_interval:
+                    self.load()
+                self.sweep()
+            except Exception as e:
+                print(f"[expiry] Sweep error: {e}")
+
+    def start(self):
+        """Loads the index and starts the sweeper (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.load()
+            self.sweep()
+        except Exception as e:
+            # Start anyway; the sweeper retries the load on its first tick
+            print(f"[expiry] Initial load failed: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="subscription-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            upcoming = [end for end, _ in self._users.values()]
+            return {
+                "tracked": len(self._users),
+                "overdue": sum(1 for end in upcoming if end <= now),
+                "next_expiry_in_s": round(min(upcoming) - now, 1) if upcoming else None,
+                "heap": len(self._heap),
+                "sweeps": self.sweeps,
+                "downgraded": self.downgraded,
+                "renewed": self.renewed,
+                "failures": self.failures,
+            }
+
+
+subscription_expiry = ExpiryIndex()
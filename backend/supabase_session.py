@@ -0,0 +1,144 @@
+"""
+Shared pooled HTTP session for Supabase (REST, RPC and Auth admin calls).
+One requests.Session with a keep-alive connection pool, so calls reuse open
+TCP+TLS connections instead of handshaking every time, plus per-call timeouts
+and retries with jittered backoff.
+
+Used by database.supabase_request, auth.py and the admin scripts
+(reset_ip_credits.py, list_users.py, list_ips.py).
+"""
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Config
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "32"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", "2"))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", "0.1"))
+SUPABASE_DEBUG = os.getenv("SUPABASE_DEBUG", "0") == "1"
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# Safe to resend after the request may have reached the server
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "PATCH", "DELETE"}
+
+
+@lru_cache(maxsize=8)
+def supabase_headers(key: str, prefer: Optional[str] = "return=representation") -> dict:
+    """Auth headers, built once per key."""
+    headers = {
+        "apikey": key,
+        "Authorization": f"Bearer {key}",
+        "Content-Type": "application/json",
+    }
+    if prefer:
+        headers["Prefer"] = prefer
+    return headers
+
+
+class SupabaseSession:
+    """
+    Thread-safe pooled client. requests.Session keeps up to pool_size idle
+    connections per host alive between calls.
+
+    Retries: failures to connect are retried for every method (the request never
+    left). Other connection errors, timeouts and 429/502/503/504 are only retried
+    for idempotent methods, so a POST insert or quota RPC is never applied twice.
+    """
+
+    def __init__(self, pool_size: int = SUPABASE_POOL_SIZE,
+                 connect_timeout: float = SUPABASE_CONNECT_TIMEOUT, read_timeout: float = SUPABASE_READ_TIMEOUT,
+                 retries: int = SUPABASE_RETRIES, backoff: float = SUPABASE_RETRY_BACKOFF, verify=True):
+        self.pool_size = pool_size
+        # CA bundle path or bool, passed per call (Session.verify loses to REQUESTS_CA_BUNDLE)
+        self.verify = verify
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+
+    def _sleep_before_retry(self, attempt: int):
+        # Full jitter: spreads retries from many callers instead of syncing them up
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def request(self, method: str, url: str, key: str, params=None, json=None,
+                prefer: Optional[str] = "return=representation", timeout=None) -> requests.Response:
+        """Sends one call, retrying per the class rules. Raises the last error if all attempts fail."""
+        method = method.upper()
+        headers = supabase_headers(key, prefer)
+        with self._lock:
+            self.calls += 1
+        if SUPABASE_DEBUG:
+            print(f"Supabase Request: {method} {url}")
+
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(method, url, headers=headers, params=params, json=json,
+                                            timeout=timeout or self.timeout, verify=self.verify)
+                if resp.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS and attempt < self.retries:
+                    resp.close()
+                    raise _RetryableStatus(resp.status_code)
+                if SUPABASE_DEBUG:
+                    print(f"Supabase Response: {resp.status_code}")
+                return resp
+            except (requests.ConnectionError, requests.Timeout, _RetryableStatus) as e:
+                resend_safe = method in IDEMPOTENT_METHODS or _never_sent(e)
+                if attempt >= self.retries or not resend_safe:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                with self._lock:
+                    self.retried += 1
+                self._sleep_before_retry(attempt)
+                attempt += 1
+
+    def open_connections(self) -> int:
+        """Connections opened so far across the pool (each one cost a TCP+TLS handshake)."""
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.pool_size,
+            "calls": self.calls,
+            "retried": self.retried,
+            "failures": self.failures,
+            "connections_opened": self.open_connections(),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def _never_sent(error: Exception) -> bool:
+    """True if the request failed before a connection existed."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+supabase_session = SupabaseSession()
@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import io
+import time
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+import async_database as db
+import auth
+import database
+from mock_supabase import MockSupabase
+
+
+@contextlib.contextmanager
+def mock_database(**kwargs):
+    server = MockSupabase(**kwargs).start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield server
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def test_typed_helpers_round_trip():
+    async def run(server):
+        created = await db.create_user({"email": "a@example.com", "plan": "free"})
+        assert created["id"] and created["msg_count"] == 0
+        await db.update_user_by_email("a@example.com", {"plan": "pro"})
+        assert (await db.get_user_by_email("a@example.com", columns="plan")) == {"plan": "pro"}
+        server.fail_next = 1          # GET is retried past one 503
+        assert await db.get_user_by_ip("8.8.8.8") is None
+
+        await db.create_transaction({"user_ip": "8.8.8.8", "razorpay_order_id": "order_1", "status": "created"})
+        await db.update_transactions("razorpay_order_id", "order_1", {"status": "paid"})
+        assert [t["status"] for t in await db.get_transactions("8.8.8.8")] == ["paid"]
+
+        assert await db.increment_global_stats(3) == 3
+        assert (await db.get_global_stats())["total_requests"] == 3
+
+        saved = await db.save_contact_submission("Ann", "a@example.com", "hi", ip_address="8.8.8.8")
+        assert saved["success"] and saved["id"]
+
+    with mock_database() as server:
+        asyncio.run(run(server))
+        assert len(server.tables["contact_submissions"]) == 1
+
+
+def test_independent_queries_run_in_parallel():
+    async def run():
+        start = time.perf_counter()
+        for i in range(5):
+            await db.get_user_by_ip(f"10.0.0.{i}")
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await db.gather(*(db.get_user_by_ip(f"10.0.0.{i}") for i in range(5)))
+        return sequential, time.perf_counter() - start
+
+    with mock_database(latency=0.05):
+        sequential, parallel = asyncio.run(run())
+    assert sequential >= 0.25
+    assert parallel < 0.15
+
+
+def test_connection_limit_caps_concurrent_requests():
+    client = db.AsyncSupabase(max_connections=3)
+
+    async def run():
+        results = await asyncio.gather(*(client.rest("GET", "users") for _ in range(12)))
+        await client.aclose()
+        return results
+
+    with mock_database(latency=0.02) as server:
+        results = asyncio.run(run())
+    assert all(r == [] for r in results)
+    assert server.max_in_flight <= 3
+
+
+def test_login_does_not_block_the_event_loop():
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await auth.login(auth.UserLogin(email="b@example.com", password="password123"), Response())
+        done.set()
+        await task
+        return ticks
+
+    with mock_database(latency=0.1) as server:
+        server.auth_users["b@example.com"] = {"id": "u1", "password": "password123"}
+        ticks = asyncio.run(run())
+    # login waits ~0.1s on Supabase (token grant and plan lookup in parallel)
+    assert ticks >= 5
+
+
+def test_auth_endpoints_against_fake():
+    app = FastAPI()
+    app.include_router(auth.router)
+    with mock_database() as server, TestClient(app) as client:
+        body = {"email": "c@example.com", "password": "password123"}
+        assert client.post("/auth/signup", json=body).json()["user"]["plan"] == "free"
+        assert client.post("/auth/signup", json=body).status_code == 400
+        assert client.post("/auth/login", json={**body, "password": "wrong-password"}).status_code == 400
+
+        assert client.post("/auth/login", json=body).status_code == 200
+        assert client.get("/auth/me").json()["plan"] == "free"
+
+        server.insert("users", {"ip_address": "testclient", "plan": "pro"})
+        assert client.post("/auth/migrate-premium", json={"email": "c@example.com"}).json()["success"]
+        assert client.get("/auth/me").json()["plan"] == "pro"
+
+
+if __name__ == "__main__":
+    test_typed_helpers_round_trip()
+    test_independent_queries_run_in_parallel()
+    test_connection_limit_caps_concurrent_requests()
+    test_login_does_not_block_the_event_loop()
+    test_auth_endpoints_against_fake()
+    print("ALL PASS")
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from chat_pipeline import ChatLimiter, ChatOverloaded, run_chat, to_async
+
+# Stub provider latency (roughly a short Groq completion)
+STUB_LATENCY = 0.05
+TOTAL_CHATS = 400
+
+
+async def stub_provider(system_prompt, user_message, rules):
+    """Async stub: yields the event loop while 'generating'."""
+    await asyncio.sleep(STUB_LATENCY)
+    return f"reply to {user_message}"
+
+
+def blocking_provider(system_prompt, user_message, rules):
+    """Old behaviour: a sync call made directly inside the async handler."""
+    time.sleep(STUB_LATENCY)
+    return f"reply to {user_message}"
+
+
+async def _load(concurrency: int, total: int, provider) -> float:
+    limiter = ChatLimiter(max_concurrent=concurrency, queue_timeout=60)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_chat(provider, "system", f"q{i}", {}, limiter=limiter) for i in range(total)
+    ])
+    elapsed = time.perf_counter() - start
+    assert limiter.completed == total
+    return total / elapsed
+
+
+async def _blocking_load(total: int) -> float:
+    async def handler(i):
+        # Mirrors the old /chat: sync call inside an async def
+        return blocking_provider("system", f"q{i}", {})
+    start = time.perf_counter()
+    await asyncio.gather(*[handler(i) for i in range(total)])
+    return total / (time.perf_counter() - start)
+
+
+def test_throughput_scales_with_concurrency():
+    results = {}
+    for concurrency in (1, 10, 100, 400):
+        total = 40 if concurrency == 1 else TOTAL_CHATS
+        results[concurrency] = asyncio.run(_load(concurrency, total, stub_provider))
+        print(f"concurrency={concurrency:<4} throughput={results[concurrency]:8.1f} chats/s")
+
+    # Serial ceiling is 1 / STUB_LATENCY = 20 chats/s
+    assert results[1] < 25
+    assert results[100] > results[10] * 5
+    assert results[400] > results[1] * 100
+
+
+def test_blocking_provider_serializes():
+    blocking = asyncio.run(_blocking_load(20))
+    threaded = asyncio.run(_load(20, 20, to_async(blocking_provider)))
+    print(f"blocking in handler: {blocking:6.1f} chats/s | to_async: {threaded:6.1f} chats/s")
+    assert blocking < 25
+    # Default thread pool is min(32, cpu + 4) workers, so gains depend on core count
+    assert threaded > blocking * 2
+
+
+def test_limiter_rejects_when_queue_times_out():
+    async def scenario():
+        limiter = ChatLimiter(max_concurrent=2, queue_timeout=0.01)
+        results = await asyncio.gather(*[
+            run_chat(stub_provider, "system", f"q{i}", {}, limiter=limiter) for i in range(5)
+        ], return_exceptions=True)
+        return limiter, results
+
+    limiter, results = asyncio.run(scenario())
+    rejected = [r for r in results if isinstance(r, ChatOverloaded)]
+    assert len(rejected) == 3
+    assert limiter.stats()["rejected"] == 3
+    assert limiter.stats()["in_flight"] == 0
+
+
+if __name__ == "__main__":
+    print("--- Chat pipeline load test (stub provider) ---")
+    test_throughput_scales_with_concurrency()
+    test_blocking_provider_serializes()
+    test_limiter_rejects_when_queue_times_out()
+    print("ALL PASS")
@@ -0,0 +1,127 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+from comfyui_handler import ComfyUIClient, build_prompt, default_workflow, workflow_template
+from mock_comfyui import MockComfyUI
+
+
+def run_chats(server, messages, **kwargs):
+    async def main():
+        client = ComfyUIClient(address=server.address, **kwargs)
+        try:
+            replies = await asyncio.gather(*(client.chat(m) for m in messages))
+            return replies, client.stats()
+        finally:
+            await client.aclose()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(main())
+
+
+def test_prompts_multiplexed_over_one_websocket():
+    server = MockComfyUI(run_time=0.005).start()
+    try:
+        messages = [f"question {i}" for i in range(40)]
+        replies, stats = run_chats(server, messages)
+        assert replies == [f"[comfyui] reply to: {m}" for m in messages]
+        assert server.ws_connections == 1
+        assert server.requests == {("POST", "/prompt"): 40}   # no history polling
+        assert stats["completed"] == 40 and stats["in_flight"] == 0 and stats["history_fetches"] == 0
+    finally:
+        server.stop()
+
+
+def test_cached_outputs_errors_and_rejections():
+    server = MockComfyUI().start()
+    try:
+        server.cached = True
+        replies, stats = run_chats(server, ["a", "b"])
+        assert replies == ["[comfyui] reply to: a", "[comfyui] reply to: b"]
+        assert stats["history_fetches"] == 2
+        server.cached = False
+
+        server.error_next = 1
+        replies, stats = run_chats(server, ["boom"])
+        assert replies == ["Error: ComfyUI simulated failure."] and stats["errors"] == 1
+
+        server.fail_next = 1
+        replies, _ = run_chats(server, ["down"])
+        assert replies[0].startswith("Error: ComfyUI prompt rejected")
+
+        server.fail_next, server.plain_errors = 1, True
+        replies, _ = run_chats(server, ["proxy"])
+        assert replies == ["Error: ComfyUI prompt rejected: HTTP 503."]
+    finally:
+        server.stop()
+
+
+def test_reconnect_recovers_prompts_finished_while_disconnected():
+    server = MockComfyUI(run_time=0.3, workers=5).start()
+    try:
+        async def main():
+            client = ComfyUIClient(address=server.address, reconnect_backoff=0.6)
+            try:
+                chats = asyncio.gather(*(client.chat(f"q{i}") for i in range(5)))
+                while client.stats()["submitted"] < 5:
+                    await asyncio.sleep(0.01)
+                # All five finish while the socket is down; their events are lost
+                server.drop_connections()
+                return await chats, client.stats()
+            finally:
+                await client.aclose()
+        with contextlib.redirect_stdout(io.StringIO()):
+            replies, stats = asyncio.run(main())
+        assert replies == [f"[comfyui] reply to: q{i}" for i in range(5)]
+        assert stats["connects"] == 2 and stats["history_fetches"] == 5
+    finally:
+        server.stop()
+
+
+def test_timeout():
+    server = MockComfyUI(run_time=1.0).start()
+    try:
+        replies, stats = run_chats(server, ["slow"], timeout=0.1)
+        assert replies == ["Error: Timeout waiting for ComfyUI or no output captured."]
+        assert stats["timeouts"] == 1 and stats["history_fetches"] == 1
+    finally:
+        server.stop()
+
+
+def test_workflow_template_is_cached():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "workflow_api.json")
+        workflow = default_workflow()
+        with open(path, "w") as f:
+            json.dump(workflow, f)
+        first = workflow_template(path)
+        assert first == workflow and workflow_template(path) is first
+
+        prompt = build_prompt("hello", first)
+        assert prompt["3"]["inputs"]["user_message"] == "hello"
+        assert first["3"]["inputs"]["user_message"] == "" and prompt["4"] is first["4"]
+
+        # A new export is picked up by mtime
+        workflow["4"]["inputs"]["model_name"] = "llama3"
+        with open(path, "w") as f:
+            json.dump(workflow, f)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000))
+        assert workflow_template(path)["4"]["inputs"]["model_name"] == "llama3"
+
+        # UI save format (nodes array) can't be queued: fall back to the built-in workflow
+        with open(path, "w") as f:
+            json.dump({"nodes": [], "links": []}, f)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 2_000_000))
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert workflow_template(path) == default_workflow()
+
+
+if __name__ == "__main__":
+    test_prompts_multiplexed_over_one_websocket()
+    test_cached_outputs_errors_and_rejections()
+    test_reconnect_recovers_prompts_finished_while_disconnected()
+    test_timeout()
+    test_workflow_template_is_cached()
+    print("ALL PASS")
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from geolocation import GeoCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingLookup:
+    def __init__(self, answers, delay=0.0):
+        self.answers = answers
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, ip):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.answers.get(ip)
+
+
+def test_one_lookup_gives_country_and_provider():
+    lookup = CountingLookup({"49.36.1.1": "IN", "8.8.8.8": "US"})
+    cache = GeoCache(lookup=lookup)
+    india = cache.resolve("49.36.1.1")
+    assert (india.country, india.payment_provider, india.is_india) == ("IN", "razorpay", True)
+    assert cache.resolve("8.8.8.8").payment_provider == "gumroad"
+    for _ in range(5):
+        cache.resolve("49.36.1.1")
+    assert lookup.calls == 2
+    assert cache.stats()["hits"] == 5
+
+
+def test_failures_cached_for_negative_ttl_only():
+    clock = FakeClock()
+    lookup = CountingLookup({})
+    cache = GeoCache(lookup=lookup, ttl=3600, negative_ttl=60, clock=clock)
+    assert cache.resolve("1.2.3.4").country is None
+    assert cache.resolve("1.2.3.4").payment_provider == "gumroad"
+    assert lookup.calls == 1 and cache.stats()["negative_hits"] == 1
+    clock.now = 61
+    lookup.answers["1.2.3.4"] = "IN"
+    assert cache.resolve("1.2.3.4").country == "IN"      # retried after the short TTL
+    clock.now = 61 + 3599
+    assert cache.resolve("1.2.3.4").country == "IN" and lookup.calls == 2
+
+
+def test_concurrent_misses_share_one_lookup():
+    lookup = CountingLookup({"5.5.5.5": "DE"}, delay=0.05)
+    cache = GeoCache(lookup=lookup)
+    with ThreadPoolExecutor(10) as pool:
+        results = list(pool.map(cache.resolve, ["5.5.5.5"] * 10))
+    assert {r.country for r in results} == {"DE"}
+    assert lookup.calls == 1
+    assert cache.stats()["coalesced"] + cache.stats()["hits"] == 9
+
+    async def burst():
+        return await asyncio.gather(*(cache.resolve_async("6.6.6.6") for _ in range(10)))
+    asyncio.run(burst())
+    assert lookup.calls == 2
+
+
+def test_lru_bound_and_lookup_errors():
+    def broken(ip):
+        raise RuntimeError("ipapi down")
+    cache = GeoCache(lookup=broken, max_entries=2)
+    for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+        assert cache.resolve(ip).country is None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1 and stats["lookup_failures"] == 3
+
+
+if __name__ == "__main__":
+    test_one_lookup_gives_country_and_provider()
+    test_failures_cached_for_negative_ttl_only()
+    test_concurrent_misses_share_one_lookup()
+    test_lru_bound_and_lookup_errors()
+    print("ALL PASS")
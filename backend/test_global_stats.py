@@ -0,0 +1,93 @@
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from database import GlobalStatsCounter
+from mock_supabase import MockSupabase
+
+RPC = ("POST", "/rest/v1/rpc/increment_global_stats")
+
+
+@contextlib.contextmanager
+def mock_database(**kwargs):
+    server = MockSupabase(**kwargs).start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield server
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def today_total(server):
+    return server.select("global_stats", {"date": f"eq.{database.get_today_str()}"})[0]["total_requests"]
+
+
+def test_concurrent_increments_are_batched_and_never_lost():
+    with mock_database(latency=0.002) as server:
+        counter = GlobalStatsCounter(flush_interval=0.02)
+        with ThreadPoolExecutor(20) as pool:
+            list(pool.map(lambda _: counter.increment(), range(500)))
+        counter.flush()
+        assert today_total(server) == 500
+        assert server.requests[RPC] < 50
+
+
+def test_cap_check_reads_local_approximation():
+    with mock_database() as server:
+        server.insert("global_stats", {"total_requests": 995})
+        counter = GlobalStatsCounter(flush_interval=60, max_age=60)
+        assert counter.approximate_total() == 995     # first read syncs once
+        for _ in range(5):
+            counter.increment()
+        assert counter.approximate_total() == 1000     # no request: local pending counts
+        assert server.requests[RPC] == 1
+
+
+def test_stale_total_resyncs_and_failed_flush_keeps_pending():
+    clock = [0.0]
+    with mock_database() as server:
+        counter = GlobalStatsCounter(flush_interval=60, max_age=5, clock=lambda: clock[0])
+        counter.approximate_total()
+        server.select("global_stats", {})[0]["total_requests"] = 40   # other workers flushed
+        clock[0] = 6
+        assert counter.approximate_total() == 40
+
+        server.fail_next = 1
+        counter.increment(3)
+        counter.flush()
+        assert counter.flush_failures == 1
+        assert counter.approximate_total() == 43
+
+
+def test_missing_rpc_falls_back_to_get_and_patch():
+    clock = [0.0]
+    with mock_database() as server:
+        del server.rpcs["increment_global_stats"]
+        counter = GlobalStatsCounter(flush_interval=60, max_age=5, clock=lambda: clock[0])
+        assert counter.approximate_total() == 0                          # creates today's row
+        for _ in range(4):
+            counter.increment()
+        counter.flush()
+        assert today_total(server) == 4 and counter.flush_failures == 0
+        assert counter.approximate_total() == 4
+        assert server.requests[RPC] == 1                                 # not asked again per flush
+        assert server.requests[("PATCH", "/rest/v1/global_stats")] == 1
+
+        # Migration applied later: picked up after the recheck interval
+        server.rpcs["increment_global_stats"] = server.rpc_increment_global_stats
+        clock[0] = database.GLOBAL_STATS_RPC_RECHECK
+        counter.increment(2)
+        counter.flush()
+        assert today_total(server) == 6 and server.requests[RPC] == 2
+
+
+if __name__ == "__main__":
+    test_concurrent_increments_are_batched_and_never_lost()
+    test_cap_check_reads_local_approximation()
+    test_stale_total_resyncs_and_failed_flush_keeps_pending()
+    test_missing_rpc_falls_back_to_get_and_patch()
+    print("ALL PASS")
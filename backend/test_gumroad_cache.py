@@ -0,0 +1,86 @@
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import gumroad_handler
+from gumroad_handler import SaleCache, get_sale_email, invalidate_sale, is_sale_refunded, verify_sale
+from mock_gumroad import MockGumroad
+
+SALE_GET = ("GET", "/v2/sales")
+
+
+@contextlib.contextmanager
+def mock_gumroad(**kwargs):
+    server = MockGumroad(**kwargs).start()
+    saved = gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache
+    gumroad_handler.GUMROAD_API_URL = f"{server.url}/v2"
+    gumroad_handler.GUMROAD_ACCESS_TOKEN = server.access_token
+    gumroad_handler.sale_cache = SaleCache()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield server
+    finally:
+        gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache = saved
+        server.stop()
+
+
+def test_helpers_share_one_fetch():
+    with mock_gumroad() as server:
+        server.add_sale("sale_1", "buyer@example.com")
+        assert verify_sale("sale_1")["email"] == "buyer@example.com"
+        assert get_sale_email("sale_1") == "buyer@example.com"
+        assert is_sale_refunded("sale_1") is False
+        assert server.requests[SALE_GET] == 1
+
+
+def test_unknown_sale_cached_briefly_and_errors_not_cached():
+    with mock_gumroad() as server:
+        assert verify_sale("nope") is None
+        assert verify_sale("nope") is None
+        assert server.requests[SALE_GET] == 1
+
+        server.add_sale("sale_2", "b@example.com")
+        server.fail_next = 1
+        assert verify_sale("sale_2") is None               # 503: no answer, nothing cached
+        assert verify_sale("sale_2")["email"] == "b@example.com"
+        assert gumroad_handler.sale_cache.stats()["errors"] == 1
+
+
+def test_concurrent_fetches_are_deduplicated():
+    with mock_gumroad(latency=0.05) as server:
+        server.add_sale("sale_3", "c@example.com")
+        with ThreadPoolExecutor(10) as pool:
+            emails = list(pool.map(get_sale_email, ["sale_3"] * 10))
+        assert emails == ["c@example.com"] * 10
+        assert server.requests[SALE_GET] == 1
+
+
+def test_refund_webhook_invalidates():
+    with mock_gumroad() as server:
+        server.add_sale("sale_4", "d@example.com")
+        assert is_sale_refunded("sale_4") is False
+        server.sales["sale_4"]["refunded"] = True
+        assert is_sale_refunded("sale_4") is False         # cached record
+        invalidate_sale("sale_4")
+        assert is_sale_refunded("sale_4") is True
+        assert server.requests[SALE_GET] == 2
+
+
+def test_slow_gumroad_times_out():
+    with mock_gumroad(latency=0.5) as server:
+        server.add_sale("sale_5", "e@example.com")
+        saved = gumroad_handler.GUMROAD_READ_TIMEOUT
+        gumroad_handler.GUMROAD_READ_TIMEOUT = 0.1
+        try:
+            assert verify_sale("sale_5") is None
+        finally:
+            gumroad_handler.GUMROAD_READ_TIMEOUT = saved
+
+
+if __name__ == "__main__":
+    test_helpers_share_one_fetch()
+    test_unknown_sale_cached_briefly_and_errors_not_cached()
+    test_concurrent_fetches_are_deduplicated()
+    test_refund_webhook_invalidates()
+    test_slow_gumroad_times_out()
+    print("ALL PASS")
@@ -0,0 +1,97 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import ip_country_db
+from ip_country_db import IPCountryDB, build
+
+CSV = """ip_start,ip_end,country
+1.0.0.0,1.0.0.255,AU
+8.8.8.0,8.8.8.255,US
+49.36.0.0,49.36.127.255,IN
+49.36.128.0,49.36.255.255,IN
+10.0.0.0,10.255.255.255,ZZ
+2001:4860::,2001:4860:ffff:ffff:ffff:ffff:ffff:ffff,US
+2401:4900::,2401:4900:ffff:ffff:ffff:ffff:ffff:ffff,IN
+"""
+
+
+@contextlib.contextmanager
+def built(csv_text=CSV):
+    with tempfile.TemporaryDirectory() as tmp:
+        src, out = os.path.join(tmp, "ranges.csv"), os.path.join(tmp, "ip_country.bin")
+        with open(src, "w") as f:
+            f.write(csv_text)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ip_country_db.main(["build", src, "-o", out])
+        db = IPCountryDB(out)
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+def test_ipv4_ranges_and_boundaries():
+    with built() as db:
+        assert db.lookup("8.8.8.8") == "US"
+        assert db.lookup("8.8.8.0") == "US" and db.lookup("8.8.8.255") == "US"
+        assert db.lookup("8.8.9.0") is None             # gap
+        assert db.lookup("0.0.0.1") is None             # before the first range
+        assert db.lookup("10.1.2.3") is None            # ZZ rows are skipped
+        assert db.lookup("49.36.200.1") == "IN"
+        assert db.ranges == (3, 2)                      # touching IN ranges merged
+
+
+def test_ipv6_and_mapped_ipv4():
+    with built() as db:
+        assert db.lookup("2401:4900:1c2a::1") == "IN"
+        assert db.lookup("2001:4860:4860::8888") == "US"
+        assert db.lookup("2a00::1") is None
+        assert db.lookup("::ffff:49.36.1.1") == "IN"
+        assert db.lookup("fe80::1%eth0") is None
+        assert db.lookup("not-an-ip") is None
+
+
+def test_ipv6_ranges_sharing_high_half():
+    with built("2001:db8::,2001:db8::ff,DE\n2001:db8::200,2001:db8::2ff,FR\n2001:db9::,2001:db9::ffff,GB\n") as db:
+        assert db.lookup("2001:db8::7f") == "DE"
+        assert db.lookup("2001:db8::100") is None       # gap inside one /64
+        assert db.lookup("2001:db8::2ff") == "FR"
+        assert db.lookup("2001:db8::300") is None
+        assert db.lookup("2001:db8:0:1::") is None      # next /64, past the FR range
+        assert db.lookup("2001:db9::1") == "GB"
+
+
+def test_integer_rows_and_overlap_rejected():
+    with built("16777216,16777471,AU\n281470698586368,281470698586623,US\n") as db:
+        # 1.0.0.0/24 as integers; ::ffff:1.1.1.0/24 folded into the IPv4 table
+        assert db.lookup("1.0.0.7") == "AU"
+        assert db.lookup("1.1.1.1") == "US"
+    try:
+        with built("1.0.0.0,1.0.0.255,AU\n1.0.0.128,1.0.1.0,CN\n"):
+            pass
+        assert False, "overlap accepted"
+    except ValueError:
+        pass
+
+
+def test_lookup_matches_expected_ranges():
+    rows = [(i * 1000, i * 1000 + 499, False, "IN" if i % 2 else "US") for i in range(2000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "db.bin")
+        build(rows, path)
+        db = IPCountryDB(path)
+        for value in range(0, 2_000_000, 137):
+            expected = ("IN" if (value // 1000) % 2 else "US") if value % 1000 < 500 else None
+            assert db.lookup_int(value, False) == expected
+        db.close()
+
+
+if __name__ == "__main__":
+    test_ipv4_ranges_and_boundaries()
+    test_ipv6_and_mapped_ipv4()
+    test_ipv6_ranges_sharing_high_half()
+    test_integer_rows_and_overlap_rejected()
+    test_lookup_matches_expected_ranges()
+    print("ALL PASS")
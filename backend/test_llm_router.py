@@ -0,0 +1,149 @@
+import asyncio
+import random
+import time
+
+from llm_router import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HedgeBudget, LLMRouter, ProviderUnavailable
+from mock_providers import MockProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_many(router, n):
+    async def scenario():
+        return [await router("system", f"q{i}", {}) for i in range(n)]
+    return asyncio.run(scenario())
+
+
+def test_routes_to_fastest_healthy_provider():
+    fast = MockProvider("groq", latency=0.002, seed=1)
+    slow = MockProvider("claude", latency=0.02, seed=2)
+    router = LLMRouter({"claude": slow, "groq": fast})
+    replies = run_many(router, 40)
+    # Each provider is measured once, then the fast one takes the traffic
+    assert slow.calls == 1
+    assert fast.calls == 39
+    assert all(r.startswith("[groq]") or r.startswith("[claude]") for r in replies)
+    stats = router.stats()
+    assert stats["groq"]["p50_ms"] < stats["claude"]["p50_ms"]
+
+
+def test_failing_provider_trips_and_traffic_fails_over():
+    clock = FakeClock()
+    broken = MockProvider("groq", latency=0.001, error_rate=1.0, fail_mode="raise", seed=3)
+    backup = MockProvider("ollama", latency=0.005, seed=4)
+    router = LLMRouter({"groq": broken, "ollama": backup},
+                       breaker_factory=lambda: CircuitBreaker(error_rate=0.5, min_calls=3, cooldown=10, clock=clock))
+    replies = run_many(router, 20)
+    assert all(r.startswith("[ollama]") for r in replies)
+    assert router.stats()["groq"]["state"] == OPEN
+    assert broken.calls == 3
+
+    # After the cooldown one trial call goes through; it fails and re-opens the breaker
+    clock.now = 11
+    run_many(router, 5)
+    assert broken.calls == 4
+    assert router.stats()["groq"]["state"] == OPEN
+    assert router.stats()["groq"]["trips"] == 2
+
+
+def test_half_open_success_closes_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=2, cooldown=5, clock=clock)
+    breaker.record(False, 1.0, 2)
+    assert breaker.state == OPEN and not breaker.allow()
+    clock.now = 6
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()          # only one trial at a time
+    breaker.record(True, 0.0, 1)
+    assert breaker.state == CLOSED
+
+
+def test_error_text_counts_as_failure_and_all_tripped_raises():
+    clock = FakeClock()
+    bad = MockProvider("groq", error_rate=1.0, seed=5)
+    router = LLMRouter({"groq": bad},
+                       breaker_factory=lambda: CircuitBreaker(min_calls=2, cooldown=60, clock=clock))
+    replies = run_many(router, 2)
+    assert all(r.startswith("Error") for r in replies)
+    try:
+        run_many(router, 1)
+        assert False, "expected ProviderUnavailable"
+    except ProviderUnavailable:
+        pass
+
+
+def test_timeouts_count_as_errors():
+    hung = MockProvider("huggingface", latency=1.0, seed=6)
+    ok = MockProvider("groq", latency=0.001, seed=7)
+    router = LLMRouter({"huggingface": hung, "groq": ok}, timeout=0.02)
+    reply = run_many(router, 1)[0]
+    assert reply.startswith("[groq]")
+    assert router.stats()["huggingface"]["errors"] == 1
+
+
+def _tail_latency(seed, slow_every=30):
+    """Mostly 5ms, but about 1 in N calls takes 200ms (a tail beyond p95)."""
+    rng = random.Random(seed)
+    return lambda: 0.2 if rng.randrange(slow_every) == 0 else 0.005
+
+
+# Tests run in milliseconds, so drop the production delay floor and sample minimum
+FAST_HEDGE = {"hedge_min_delay_ms": 1, "hedge_min_samples": 10}
+
+
+def _timed_run(router, n):
+    async def scenario():
+        timings = []
+        for i in range(n):
+            start = time.perf_counter()
+            await router("system", f"q{i}", {})
+            timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)
+    return asyncio.run(scenario())
+
+
+def test_hedging_cuts_tail_latency_and_cancels_loser():
+    plain = LLMRouter({"groq": MockProvider("groq", latency=_tail_latency(8), seed=8)})
+    primary = MockProvider("groq", latency=_tail_latency(8), seed=8)
+    secondary = MockProvider("claude", latency=0.02, seed=9)
+    hedged = LLMRouter({"groq": primary, "claude": secondary}, hedging=True, hedge_budget=HedgeBudget(20),
+                       **FAST_HEDGE)
+    # Measure claude once so groq is ranked first afterwards
+    asyncio.run(hedged.call_provider("claude", "s", "warmup", {}))
+
+    base = _timed_run(plain, 300)
+    fast = _timed_run(hedged, 300)
+    p99 = lambda t: t[int(len(t) * 0.99) - 1]
+    print(f"p99 without hedging: {p99(base):.1f}ms | with hedging: {p99(fast):.1f}ms | {hedged.stats()['hedging']}")
+    assert p99(fast) < p99(base) / 2
+    assert hedged.stats()["hedging"]["hedge_wins"] > 0
+    assert primary.cancelled > 0
+
+
+def test_hedge_budget_caps_extra_load():
+    primary = MockProvider("groq", latency=_tail_latency(10, slow_every=10), seed=10)
+    secondary = MockProvider("ollama", latency=0.02, seed=11)
+    router = LLMRouter({"groq": primary, "ollama": secondary}, hedging=True, hedge_budget=HedgeBudget(1, burst=1),
+                       **FAST_HEDGE)
+    asyncio.run(router.call_provider("ollama", "s", "warmup", {}))
+    _timed_run(router, 300)
+    hedging = router.stats()["hedging"]
+    assert hedging["hedges"] <= 300 * 0.01 + 1
+    assert hedging["denied"] > 0
+
+
+if __name__ == "__main__":
+    test_routes_to_fastest_healthy_provider()
+    test_failing_provider_trips_and_traffic_fails_over()
+    test_half_open_success_closes_breaker()
+    test_error_text_counts_as_failure_and_all_tripped_raises()
+    test_timeouts_count_as_errors()
+    test_hedging_cuts_tail_latency_and_cancels_loser()
+    test_hedge_budget_caps_extra_load()
+    print("ALL PASS")
@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import io
+
+from fastapi import Response
+
+import auth
+import database
+from mock_supabase import MockSupabase
+from password_hasher import HasherOverloaded, PasswordHasher, password_context, password_hasher
+
+
+def test_hash_and_verify_in_pool():
+    hasher = PasswordHasher(workers=1, rounds=1000)
+
+    async def run():
+        hashed = await hasher.hash("password123")
+        return hashed, await hasher.verify("password123", hashed), await hasher.verify("wrong", hashed)
+
+    try:
+        hashed, good, bad = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    assert hashed.startswith("$pbkdf2-sha256$1000$")
+    assert good and not bad
+
+
+def test_cost_change_rehashes():
+    old = password_context(1000).hash("password123")
+    hasher = PasswordHasher(workers=1, rounds=2000)
+    assert hasher.needs_update(old)
+    try:
+        valid, new_hash = asyncio.run(hasher.verify_and_update("password123", old))
+    finally:
+        hasher.shutdown()
+    assert valid and new_hash.startswith("$pbkdf2-sha256$2000$")
+    assert not hasher.needs_update(new_hash)
+
+
+def test_rejects_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=1, rounds=200_000)
+
+    async def run():
+        return await asyncio.gather(*(hasher.hash("pw") for _ in range(4)), return_exceptions=True)
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    # one running, one waiting, the rest turned away
+    assert sum(isinstance(r, HasherOverloaded) for r in results) == 2
+    assert hasher.stats()["rejected"] == 2
+
+
+def test_event_loop_keeps_running_while_hashing():
+    hasher = PasswordHasher(workers=1, rounds=300_000)
+
+    async def run():
+        ticks = 0
+        task = asyncio.ensure_future(hasher.hash("pw"))
+        while not task.done():
+            ticks += 1
+            await asyncio.sleep(0.005)
+        return ticks
+
+    try:
+        assert asyncio.run(run()) >= 5
+    finally:
+        hasher.shutdown()
+
+
+def test_login_upgrades_stored_hash():
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        server.auth_users["d@example.com"] = {"id": "u1", "password": "password123"}
+        server.insert("users", {"email": "d@example.com", "password_hash": password_context(1000).hash("password123")})
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(auth.login(auth.UserLogin(email="d@example.com", password="password123"), Response()))
+        stored = server.select("users", {"email": "eq.d@example.com"})[0]["password_hash"]
+        assert not password_hasher.needs_update(stored)
+        assert password_context().verify("password123", stored)
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        password_hasher.shutdown()
+        server.stop()
+
+
+def test_login_keeps_hashes_in_other_formats():
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    stored = {
+        "bcrypt@example.com": "$2b$12$abcdefghijklmnopqrstuu5Hq3QaO6EHwZmQKfZ7YVIQCkGCV7s3m",
+        "legacy@example.com": "password123",
+        "malformed@example.com": "$pbkdf2-sha256$xx",
+    }
+    try:
+        for email, password_hash in stored.items():
+            server.auth_users[email] = {"id": email, "password": "password123"}
+            server.insert("users", {"email": email, "plan": "free", "password_hash": password_hash})
+            assert not password_hasher.needs_update(password_hash)
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = asyncio.run(auth.login(auth.UserLogin(email=email, password="password123"), Response()))
+            assert result["user"] == {"email": email, "plan": "free"}
+            assert server.select("users", {"email": f"eq.{email}"})[0]["password_hash"] == password_hash
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        password_hasher.shutdown()
+        server.stop()
+
+
+if __name__ == "__main__":
+    test_hash_and_verify_in_pool()
+    test_cost_change_rehashes()
+    test_rejects_when_queue_is_full()
+    test_event_loop_keeps_running_while_hashing()
+    test_login_upgrades_stored_hash()
+    test_login_keeps_hashes_in_other_formats()
+    print("ALL PASS")
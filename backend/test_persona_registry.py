@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import time
+
+from persona_registry import PersonaRegistry
+from personas import PERSONA_PROMPTS
+
+
+def write_config(path, config):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    # Make sure the mtime moves even on coarse filesystem clocks
+    stamp = time.time() + write_config.bump
+    write_config.bump += 1
+    os.utime(path, (stamp, stamp))
+
+
+write_config.bump = 1
+
+
+def make_registry(config):
+    path = os.path.join(tempfile.mkdtemp(), "persona.json")
+    write_config(path, config)
+    return path, PersonaRegistry(path=path, reload_interval=0)
+
+
+def test_each_persona_gets_its_own_rules():
+    _, registry = make_registry({"max_words": 150, "forbidden_phrases": ["delve"]})
+    elon = registry.get("elon")
+    jobs = registry.get("jobs")
+    assert elon.max_words == 120                       # "Maximum 120 words" in the prompt
+    assert "delve" in elon.forbidden_phrases           # shared baseline
+    assert "we could add" in jobs.forbidden_phrases
+    assert "we could add" not in elon.forbidden_phrases
+    assert elon.system_prompt == PERSONA_PROMPTS["elon"]
+    assert elon.rules["max_words"] == 120
+    assert elon.forbidden_pattern.sub("", "Let me DELVE in") == "Let me  in"
+
+
+def test_unknown_persona_falls_back_to_default():
+    _, registry = make_registry({})
+    assert registry.get("nobody").id == "elon"
+    assert not registry.exists("nobody")
+
+
+def test_hot_reload_on_mtime_change():
+    path, registry = make_registry({"forbidden_phrases": ["delve"]})
+    before = registry.get("naval")
+    write_config(path, {"forbidden_phrases": ["delve", "tapestry"], "personas": {"naval": {"max_words": 60}}})
+    after = registry.get("naval")
+    assert after.max_words == 60
+    assert "tapestry" in after.forbidden_phrases
+    assert after.fingerprint != before.fingerprint
+    assert registry.get("elon").max_words == 120       # overrides are per persona
+
+
+def test_broken_file_keeps_last_good_config():
+    path, registry = make_registry({"forbidden_phrases": ["delve"]})
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{ not json")
+    os.utime(path, (time.time() + 100, time.time() + 100))
+    assert "delve" in registry.get("elon").forbidden_phrases
+
+
+def test_persona_is_immutable():
+    _, registry = make_registry({})
+    persona = registry.get("elon")
+    for mutate in (lambda: setattr(persona, "max_words", 1), lambda: persona.rules.__setitem__("max_words", 1)):
+        try:
+            mutate()
+            assert False, "persona should be read-only"
+        except (AttributeError, TypeError):
+            pass
+
+
+if __name__ == "__main__":
+    test_each_persona_gets_its_own_rules()
+    test_unknown_persona_falls_back_to_default()
+    test_hot_reload_on_mtime_change()
+    test_broken_file_keeps_last_good_config()
+    test_persona_is_immutable()
+    print("ALL PASS")
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_supabase import MockSupabase
+from quota_cache import QuotaCache
+
+LIMIT = 10
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(server, **kwargs):
+    """Cache wired straight to the mock's RPC twins (no HTTP)."""
+    def load(identifier):
+        with server.lock:
+            return server.rpc_check_can_chat({"p_identifier": identifier, "p_daily_limit": LIMIT})
+
+    def flush(increments):
+        with server.lock:
+            return server.rpc_apply_quota_increments({"p_increments": increments})
+
+    kwargs.setdefault("flush_interval", 60)
+    return QuotaCache(load=load, flush=flush, daily_limit=LIMIT, global_cap=1000, **kwargs)
+
+
+def msg_count(server, ip):
+    return server.select("users", {"ip_address": f"eq.{ip}"})[0]["msg_count"]
+
+
+def test_repeat_checks_stay_local_and_flush_in_one_batch():
+    server = MockSupabase()
+    cache = make_cache(server, max_pending=5)
+    for ip in ("1.1.1.1", "2.2.2.2"):
+        cache.check(ip)                     # miss: RPC charges and seeds the entry
+    for ip in ("1.1.1.1", "2.2.2.2") * 3:
+        assert cache.check(ip)["allowed"]   # local
+    assert cache.stats()["misses"] == 2 and cache.stats()["pending"] == 6
+
+    assert cache.flush() == 6
+    assert msg_count(server, "1.1.1.1") == 4
+    assert server.tables["global_stats"][0]["total_requests"] == 8
+    assert cache.stats()["flushes"] == 1
+
+
+def test_never_over_admits_in_one_process():
+    server = MockSupabase()
+    cache = make_cache(server)
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(cache.check, ["9.9.9.9"] * 50))
+    cache.flush()
+    assert sum(r["allowed"] for r in results) == LIMIT
+    assert msg_count(server, "9.9.9.9") == LIMIT
+    assert cache.check("9.9.9.9")["reason"] == "daily_limit_reached"
+
+
+def test_crash_loses_at_most_max_pending():
+    server = MockSupabase()
+    cache = make_cache(server, max_pending=3)
+    admitted = sum(cache.check("7.7.7.7")["allowed"] for _ in range(LIMIT))
+    assert admitted == LIMIT
+    # Process dies without flushing: what the server never saw can be re-admitted
+    unflushed = cache.stats()["pending"]
+    assert unflushed <= 3
+    fresh = make_cache(server)
+    extra = sum(fresh.check("7.7.7.7")["allowed"] for _ in range(LIMIT))
+    assert extra == unflushed
+
+
+def test_expired_entry_and_failed_flush():
+    server = MockSupabase()
+    clock = FakeClock()
+    cache = make_cache(server, clock=clock, entry_ttl=30)
+    cache.check("3.3.3.3")
+    cache.check("3.3.3.3")
+    server.tables["users"][0]["plan"] = "pro"
+    clock.now = 31
+    assert cache.check("3.3.3.3")["plan"] == "pro"   # stale entry re-read through the RPC
+
+    failing = make_cache(server)
+    failing._flush = lambda batch: None
+    failing.check("4.4.4.4")
+    failing.check("4.4.4.4")
+    assert failing.flush() == 0
+    assert failing.stats()["pending"] == 1 and failing.stats()["flush_failures"] == 1
+
+
+def test_pro_chats_count_globally_not_against_msg_count():
+    server = MockSupabase()
+    server.insert("users", {"email": "pro@example.com", "plan": "pro"})
+    cache = make_cache(server, is_active=lambda identifier: True)
+    for _ in range(12):
+        assert cache.check("pro@example.com")["plan"] == "pro"
+    assert cache.stats()["pending"] == 11
+    assert cache.flush() == 11
+    user = server.tables["users"][0]
+    assert not user.get("msg_count")
+    assert server.tables["global_stats"][0]["total_requests"] == 12
+
+    # Downgraded mid-day: the free quota is untouched by the pro chats
+    user["plan"] = "free"
+    fresh = make_cache(server)
+    assert fresh.check("pro@example.com")["remaining"] == LIMIT - 1
+
+
+def test_background_flusher_writes_behind():
+    server = MockSupabase()
+    cache = make_cache(server, flush_interval=0.01)
+    cache.start()
+    cache.check("5.5.5.5")
+    cache.check("5.5.5.5")
+    cache.stop()
+    assert msg_count(server, "5.5.5.5") == 2
+    assert cache.stats()["pending"] == 0
+
+
+if __name__ == "__main__":
+    test_repeat_checks_stay_local_and_flush_in_one_batch()
+    test_never_over_admits_in_one_process()
+    test_crash_loses_at_most_max_pending()
+    test_expired_entry_and_failed_flush()
+    test_pro_chats_count_globally_not_against_msg_count()
+    test_background_flusher_writes_behind()
+    print("ALL PASS")
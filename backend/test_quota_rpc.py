@@ -0,0 +1,81 @@
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from mock_supabase import MockSupabase
+
+
+@contextlib.contextmanager
+def mock_database(**kwargs):
+    server = MockSupabase(**kwargs).start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        # supabase_request logs every call
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield server
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def test_one_round_trip_per_check():
+    with mock_database() as server:
+        first = database.check_can_chat("1.2.3.4")
+        assert first == {"allowed": True, "plan": "free", "remaining": database.DAILY_FREE_LIMIT - 1}
+        assert server.round_trips() == 1
+        assert server.tables["users"][0]["ip_address"] == "1.2.3.4"
+        assert server.tables["global_stats"][0]["total_requests"] == 1
+
+
+def test_daily_limit_day_reset_and_pro():
+    with mock_database() as server:
+        for _ in range(database.DAILY_FREE_LIMIT):
+            assert database.check_can_chat("a@b.co")["allowed"]
+        assert database.check_can_chat("a@b.co")["reason"] == "daily_limit_reached"
+
+        server.tables["users"][0]["last_active_date"] = "2000-01-01"
+        assert database.check_can_chat("a@b.co")["remaining"] == database.DAILY_FREE_LIMIT - 1
+
+        server.tables["users"][0]["plan"] = "pro"
+        assert database.check_can_chat("a@b.co") == {"allowed": True, "plan": "pro", "remaining": 9999}
+
+
+def test_global_cap_blocks_free_but_not_pro():
+    with mock_database(global_cap=3) as server:
+        saved = database.GLOBAL_SAFETY_CAP
+        database.GLOBAL_SAFETY_CAP = 3
+        try:
+            for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+                assert database.check_can_chat(ip)["allowed"]
+            assert database.check_can_chat("4.4.4.4")["reason"] == "global_cap_reached"
+            server.insert("users", {"email": "pro@x.co", "plan": "pro"})
+            assert database.check_can_chat("pro@x.co")["allowed"]
+        finally:
+            database.GLOBAL_SAFETY_CAP = saved
+
+
+def test_concurrent_checks_never_over_admit():
+    with mock_database(latency=0.002) as server:
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(database.check_can_chat, ["9.9.9.9"] * 40))
+        assert sum(r["allowed"] for r in results) == database.DAILY_FREE_LIMIT
+        assert len(server.tables["users"]) == 1
+        assert server.tables["global_stats"][0]["total_requests"] == database.DAILY_FREE_LIMIT
+
+
+def test_falls_back_to_rest_chain_without_rpc():
+    with mock_database() as server:
+        server.rpcs.clear()
+        assert database.check_can_chat("5.5.5.5")["allowed"]
+        assert server.round_trips() > 1
+
+
+if __name__ == "__main__":
+    test_one_round_trip_per_check()
+    test_daily_limit_day_reset_and_pro()
+    test_global_cap_blocks_free_but_not_pro()
+    test_concurrent_checks_never_over_admit()
+    test_falls_back_to_rest_chain_without_rpc()
+    print("ALL PASS")
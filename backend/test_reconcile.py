@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+from datetime import datetime, timedelta, timezone
+
+import database
+import gumroad_handler
+import payments
+import reconcile
+from mock_gumroad import MockGumroad
+from mock_razorpay import MockRazorpay
+from mock_supabase import MockSupabase
+from reconcile import Purchase, diff
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+def purchase(ref, email, provider="gumroad", refunded=False, active=None, **kwargs):
+    return Purchase(provider, ref, email, refunded, not refunded if active is None else active, 699,
+                    kwargs.pop("created_at", NOW), **kwargs)
+
+
+@contextlib.contextmanager
+def mock_sources(page_size=10):
+    gumroad = MockGumroad(page_size=page_size).start()
+    razorpay = MockRazorpay().start()
+    supabase = MockSupabase().start()
+    saved = (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, reconcile.RAZORPAY_API_URL,
+             payments.KEY_ID, payments.KEY_SECRET, database.SUPABASE_URL, database.SUPABASE_KEY)
+    gumroad_handler.GUMROAD_API_URL = f"{gumroad.url}/v2"
+    gumroad_handler.GUMROAD_ACCESS_TOKEN = gumroad.access_token
+    reconcile.RAZORPAY_API_URL = f"{razorpay.url}/v1"
+    payments.KEY_ID, payments.KEY_SECRET = razorpay.key_id, razorpay.key_secret
+    database.SUPABASE_URL, database.SUPABASE_KEY = supabase.url, "test-key"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield gumroad, razorpay, supabase
+    finally:
+        (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, reconcile.RAZORPAY_API_URL,
+         payments.KEY_ID, payments.KEY_SECRET, database.SUPABASE_URL, database.SUPABASE_KEY) = saved
+        for server in (gumroad, razorpay, supabase):
+            server.stop()
+
+
+def run(**kwargs):
+    return asyncio.run(reconcile.reconcile(**kwargs))
+
+
+def test_diff_upgrades_downgrades_and_fixes_transactions():
+    users = [
+        {"id": "u1", "email": "Paid@example.com", "plan": "free"},
+        {"id": "u2", "email": "refunded@example.com", "plan": "pro", "gumroad_sale_id": "s2",
+         "payment_provider": "gumroad"},
+        {"id": "u3", "email": "manual@example.com", "plan": "pro"},
+        {"id": "u4", "email": "also-paid@example.com", "plan": "free"},
+    ]
+    transactions = [{"id": "t2", "gumroad_sale_id": "s2", "status": "paid"},
+                    {"id": "t5", "razorpay_order_id": "order_5", "status": "created"}]
+    purchases = [purchase("s1", "paid@example.com"), purchase("s2", "refunded@example.com", refunded=True),
+                 purchase("pay_4", "also-paid@example.com", provider="razorpay"),
+                 purchase("pay_5", "nobody@example.com", provider="razorpay", order_id="order_5")]
+    changes = diff(purchases, users, transactions, version=7)
+
+    assert changes.counts["users_upgraded"] == 2 and changes.counts["users_downgraded"] == 1
+    assert changes.counts["pro_without_purchase"] == 1             # u3: reported, never touched
+    assert changes.counts["purchases_without_account"] == 1
+    groups = {body: ids for body, ids in changes.user_patches.items()}
+    assert groups['{"gumroad_sale_id": null, "plan": "free", "token_version": 7}'] == ["u2"]
+    assert groups['{"payment_provider": "razorpay", "plan": "pro", "token_version": 7}'] == ["u4"]
+    assert changes.transaction_patches['{"status": "refunded"}'] == ["t2"]
+    assert changes.transaction_patches['{"razorpay_payment_id": "pay_5", "status": "paid"}'] == ["t5"]
+    assert {r.get("gumroad_sale_id") or r["razorpay_payment_id"] for r in changes.transaction_inserts} == {"s1", "pay_4"}
+
+
+def test_diff_is_quiet_when_everything_matches():
+    users = [{"id": "u1", "email": "a@example.com", "plan": "pro", "gumroad_sale_id": "s1",
+              "subscription_end_date": (NOW + timedelta(days=30)).isoformat()}]
+    transactions = [{"id": "t1", "gumroad_sale_id": "s1", "status": "paid"}]
+    changes = diff([purchase("s1", "a@example.com", ends_at=NOW + timedelta(days=30))], users, transactions)
+    assert not changes.user_patches and not changes.transaction_patches and not changes.transaction_inserts
+
+    # A lapsed subscription is not refunded: the transaction stays paid, the user goes free
+    changes = diff([purchase("s1", "a@example.com", active=False, ends_at=NOW)], users, transactions)
+    assert not changes.transaction_patches and changes.counts["users_downgraded"] == 1
+
+
+def test_one_off_purchase_clears_a_lapsed_end_date():
+    lapsed = (NOW - timedelta(days=3)).isoformat()
+    users = [{"id": "u1", "email": "a@example.com", "plan": "pro", "payment_provider": "razorpay",
+              "subscription_end_date": lapsed},
+             {"id": "u2", "email": "b@example.com", "plan": "pro", "gumroad_sale_id": "s2",
+              "subscription_end_date": lapsed}]
+    transactions = [{"id": "t1", "razorpay_payment_id": "pay_1", "status": "paid"},
+                    {"id": "t2", "gumroad_sale_id": "s2", "status": "paid"}]
+    purchases = [purchase("pay_1", "a@example.com", provider="razorpay"),
+                 purchase("s2", "b@example.com"),
+                 purchase("s_old", "b@example.com", ends_at=NOW - timedelta(days=3))]
+    changes = diff(purchases, users, transactions)
+    assert changes.user_patches == {'{"subscription_end_date": null}': ["u1", "u2"]}
+    assert changes.counts["users_end_date"] == 2
+
+
+def test_source_not_read_is_not_downgraded():
+    users = [{"id": "u1", "email": "a@example.com", "plan": "pro", "payment_provider": "razorpay"}]
+    changes = diff([purchase("s1", "a@example.com", refunded=True)], users, [], providers=("gumroad",))
+    assert not changes.user_patches
+
+
+def test_end_to_end_against_fakes():
+    with mock_sources(page_size=3) as (gumroad, razorpay, supabase):
+        for i in range(20):
+            gumroad.add_sale(f"sale_{i}", f"g{i}@example.com", refunded=i % 5 == 0,
+                             created_at=(NOW - timedelta(days=i * 7)).isoformat())
+            supabase.insert("users", {"email": f"g{i}@example.com", "plan": "pro" if i % 5 == 0 else "free",
+                                      "payment_provider": "gumroad"})
+        for i in range(250):
+            razorpay.add_payment(f"pay_{i}", f"r{i}@example.com", order_id=f"order_{i}",
+                                 created_at=int((NOW - timedelta(hours=i)).timestamp()))
+            supabase.insert("users", {"email": f"r{i}@example.com", "plan": "free"})
+        supabase.insert("transactions", {"razorpay_order_id": "order_0", "status": "created"})
+
+        since, until = NOW - timedelta(days=200), NOW
+        dry = run(since=since, until=until, concurrency=4)
+        assert dry["gumroad_sales"] == 20 and dry["razorpay_payments"] == 250
+        assert dry["users_upgraded"] == 16 + 250 and dry["users_downgraded"] == 4
+        assert dry["transactions_missing"] == 269 and dry["transactions_linked"] == 1
+        assert dry["write_requests"] == 0 and len(supabase.tables["transactions"]) == 1
+        assert gumroad.requests[("GET", "/v2/sales")] >= 7     # shards walked page by page
+
+        applied = run(since=since, until=until, concurrency=4, write=True)
+        # 540 row changes: 3 shared user PATCHes, 16 per-user PATCHes (sale id links; an upsert
+        # would trip user_identifier_check), 1 transaction upsert (payment link), 3 inserts
+        assert applied["write_requests"] == 23
+        assert supabase.requests[("POST", "/rest/v1/users")] == 0
+        plans = {u["email"]: u["plan"] for u in supabase.tables["users"]}
+        assert supabase.select("users", {"email": "eq.g1@example.com"})[0]["gumroad_sale_id"] == "sale_1"
+        assert plans["g1@example.com"] == "pro" and plans["g5@example.com"] == "free"
+        assert plans["r249@example.com"] == "pro"
+        statuses = sorted(t["status"] for t in supabase.tables["transactions"])
+        assert statuses.count("refunded") == 4 and len(statuses) == 270
+
+        again = run(since=since, until=until, concurrency=4, write=True)
+        assert again["write_requests"] == 0
+
+
+if __name__ == "__main__":
+    test_diff_upgrades_downgrades_and_fixes_transactions()
+    test_diff_is_quiet_when_everything_matches()
+    test_one_off_purchase_clears_a_lapsed_end_date()
+    test_source_not_read_is_not_downgraded()
+    test_end_to_end_against_fakes()
+    print("ALL PASS")
@@ -0,0 +1,97 @@
+import asyncio
+
+from chat_pipeline import ChatLimiter, generate_reply, is_error_reply
+from huggingface_handler import error_message
+from response_cache import ResponseCache, make_cache_key, normalize_message
+
+PARAMS = {"model": "llama-3.3-70b-versatile", "temperature": 0.9, "max_tokens": 300, "top_p": 0.95}
+
+# Starter questions from test_backend.py
+STARTERS = [
+    "Should I add AI features to my MVP?",
+    "What do you think about my idea?",
+    "I'm scared to launch because it's not perfect.",
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalization_and_keys():
+    assert normalize_message("  Should I add AI   features to my MVP? ") == "should i add ai features to my mvp"
+    a = make_cache_key("elon", STARTERS[0], PARAMS, "prompt")
+    assert a == make_cache_key("elon", "should i add ai features to my mvp", PARAMS, "prompt")
+    assert a != make_cache_key("naval", STARTERS[0], PARAMS, "prompt")
+    assert a != make_cache_key("elon", STARTERS[0], {**PARAMS, "max_tokens": 200}, "prompt")
+    assert a != make_cache_key("elon", STARTERS[0], PARAMS, "edited prompt")
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = ResponseCache(ttl=60, clock=clock)
+    cache.put("k", "answer")
+    clock.now = 59
+    assert cache.get("k") == "answer"
+    clock.now = 61
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_lru_eviction_by_bytes():
+    value = "x" * 1000
+    entry = ResponseCache._entry_size("k0", value)
+    cache = ResponseCache(max_bytes=entry * 3)
+    for i in range(3):
+        cache.put(f"k{i}", value)
+    cache.get("k0")            # k1 is now least recently used
+    cache.put("k3", value)
+    assert cache.get("k1") is None
+    assert cache.get("k0") == value
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= entry * 3
+
+
+def test_hit_skips_provider_and_errors_are_not_cached():
+    calls = []
+
+    async def provider(system_prompt, user_message, rules):
+        calls.append(user_message)
+        return "Error calling Groq: boom" if "fail" in user_message else "Ship it."
+
+    async def scenario():
+        cache = ResponseCache()
+        limiter = ChatLimiter(4, 1)
+        for persona in ("elon", "naval"):
+            for q in STARTERS * 3:
+                key = make_cache_key(persona, q, PARAMS)
+                await generate_reply(provider, "s", q, {}, cache_key=key, cache=cache, limiter=limiter)
+        for _ in range(2):
+            key = make_cache_key("elon", "please fail", PARAMS)
+            await generate_reply(provider, "s", "please fail", {}, cache_key=key, cache=cache, limiter=limiter)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert len(calls) == 2 * len(STARTERS) + 2
+    stats = cache.stats()
+    assert stats["hits"] == 2 * len(STARTERS) * 2
+    print(f"cache stats: {stats}")
+
+
+def test_provider_failure_texts_count_as_errors():
+    # Never cached, and counted as failures by the router's breakers
+    for status in (429, 503, 500):
+        assert is_error_reply(error_message(status)), status
+
+if __name__ == "__main__":
+    test_normalization_and_keys()
+    test_ttl_expiry()
+    test_lru_eviction_by_bytes()
+    test_hit_skips_provider_and_errors_are_not_cached()
+    test_provider_failure_texts_count_as_errors()
+    print("ALL PASS")
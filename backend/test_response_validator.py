@@ -0,0 +1,67 @@
+import asyncio
+
+import llm_handler
+from response_validator import StreamGuard, compile_phrases, validate_response
+
+
+def test_removes_phrases_in_any_case():
+    rules = {"max_words": 50, "forbidden_phrases": ["As an AI", "delve"]}
+    out = validate_response("as an ai I will DELVE into it. As An AI, no.", rules)
+    assert "as an ai" not in out.lower()
+    assert "delve" not in out.lower()
+
+
+def test_overlapping_phrases_prefer_longest():
+    rules = {"max_words": 50, "forbidden_phrases": ["great", "great question"]}
+    assert validate_response("Great question, really.", rules) == ", really."
+
+
+def test_truncates_before_stripping():
+    rules = {"max_words": 3, "forbidden_phrases": ["delve"]}
+    assert validate_response("one two delve three four", rules) == "one two ..."
+
+
+def test_text_whose_lowercase_changes_length():
+    # "İ".lower() is two characters, so the matcher falls back to a case-insensitive scan
+    rules = {"max_words": 50, "forbidden_phrases": ["delve"]}
+    assert validate_response("İstanbul, DELVE here", rules) == "İstanbul,  here"
+
+
+def test_compiled_pattern_is_shared():
+    assert compile_phrases(["a", "b"]) is compile_phrases(("a", "b"))
+    assert compile_phrases([]) is None
+
+
+def test_stream_guard_matches_batch_validator():
+    rules = {"max_words": 200, "forbidden_phrases": ["as an AI", "at the end of the day"]}
+    text = "At the end of the day AS AN AI I say ship it now and fix it later"
+    guard = StreamGuard(rules)
+    streamed = "".join(guard.feed(text[i:i + 4]) for i in range(0, len(text), 4)) + guard.flush()
+    assert streamed.split() == validate_response(text, rules).split()
+
+
+def test_ollama_replies_follow_persona_rules():
+    class FakeOllama:
+        async def chat(self, model, messages, options=None):
+            return {"message": {"content": "Let me delve into it: " + "word " * 40}}
+
+    saved = llm_handler.async_client
+    llm_handler.async_client = FakeOllama()
+    try:
+        rules = {"max_words": 10, "forbidden_phrases": ["delve"]}
+        reply = asyncio.run(llm_handler.call_ollama_async("s", "q", rules))
+    finally:
+        llm_handler.async_client = saved
+    assert reply == validate_response("Let me delve into it: " + "word " * 40, rules)
+    assert "delve" not in reply and len(reply.split()) <= 10
+
+
+if __name__ == "__main__":
+    test_removes_phrases_in_any_case()
+    test_overlapping_phrases_prefer_longest()
+    test_truncates_before_stripping()
+    test_text_whose_lowercase_changes_length()
+    test_compiled_pattern_is_shared()
+    test_stream_guard_matches_batch_validator()
+    test_ollama_replies_follow_persona_rules()
+    print("ALL PASS")
@@ -0,0 +1,121 @@
+import asyncio
+
+import numpy as np
+
+from chat_pipeline import ChatLimiter, generate_reply
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache, VectorIndex, embed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_embeddings_are_unit_length_and_deterministic():
+    a = embed("Should I add AI features to my MVP?")
+    assert a.dtype == np.float32
+    assert abs(float(np.linalg.norm(a)) - 1.0) < 1e-5
+    assert np.array_equal(a, embed("Should I add AI features to my MVP?"))
+
+
+def test_rewordings_match_and_unrelated_questions_do_not():
+    cache = SemanticCache()
+    cache.insert("elon", "Should I add AI features to my MVP?", "Only if it removes a step for the user.")
+    cache.insert("elon", "how do I raise a seed round", "Get revenue first.")
+
+    for same in ("should i add ai feature to the mvp", "SHOULD I ADD AI FEATURES TO MY MVP"):
+        assert cache.lookup("elon", same) == "Only if it removes a step for the user."
+    assert cache.lookup("elon", "should I remove AI from my MVP") is None
+    assert cache.lookup("elon", "should I quit my job") is None
+    # Indexes are per persona
+    assert cache.lookup("naval", "should I add AI features to my MVP") is None
+
+
+def test_negation_antonyms_and_word_order_never_hit():
+    # Low threshold: the word-by-word check has to reject these, not the cosine score
+    cache = SemanticCache(threshold=0.5)
+    pairs = [
+        ("should I hire him", "should I fire him"),
+        ("should I quit", "should I not quit"),
+        ("should I raise prices", "should I not raise prices"),
+        ("should I increase prices", "should I decrease prices"),
+        ("is Python better than Go", "is Go better than Python"),
+        ("should my cofounder buy me out", "should I buy my cofounder out"),
+    ]
+    for i, (stored, asked) in enumerate(pairs):
+        cache.insert(f"p{i}", stored, f"answer to: {stored}")
+        assert cache.lookup(f"p{i}", asked) is None, asked
+        assert cache.lookup(f"p{i}", stored) == f"answer to: {stored}"
+    assert cache.stats()["rejected"] >= 4    # most of them clear the cosine threshold
+
+
+def test_expired_entries_are_ignored():
+    clock = FakeClock()
+    cache = SemanticCache(threshold=0.8, ttl=10, clock=clock)
+    cache.insert("elon", "should I add AI features to my MVP", "answer")
+    assert cache.lookup("elon", "should i add ai feature to the mvp") == "answer"
+    clock.now = 11
+    assert cache.lookup("elon", "should i add ai feature to the mvp") is None
+
+
+def test_index_grows_then_overwrites_oldest():
+    index = VectorIndex(dim=8, max_entries=4, initial_capacity=2)
+    for i in range(6):
+        vector = np.zeros(8, dtype=np.float32)
+        vector[i % 8] = 1.0
+        index.add(vector, f"v{i}", expires_at=100)
+    assert index.count == 4
+    probe = np.zeros(8, dtype=np.float32)
+    probe[0] = 1.0
+    assert index.search(probe, now=0)[1] is None      # v0 was overwritten by v4
+    probe[0], probe[5] = 0.0, 1.0
+    assert index.search(probe, now=0)[1] == "v5"
+
+
+def test_stale_namespaces_are_evicted():
+    cache = SemanticCache(max_namespaces=2)
+    cache.insert("elon:v1", "should I raise a seed round", "old answer")
+    cache.insert("naval:v1", "how do I get leverage", "naval answer")
+    cache.lookup("elon:v1", "should I raise a seed round")          # elon:v1 is now the most recent
+    cache.insert("naval:v2", "how do I get leverage", "reloaded")    # persona.json reload
+    stats = cache.stats()
+    assert stats["namespaces"] == 2 and stats["evicted_namespaces"] == 1
+    assert cache.lookup("elon:v1", "should I raise a seed round") == "old answer"
+    assert cache.lookup("naval:v1", "how do I get leverage") is None
+    assert cache.stats()["namespaces"] == 2                          # lookups never create indexes
+
+
+def test_near_duplicate_skips_provider():
+    calls = []
+
+    async def provider(system_prompt, user_message, rules):
+        calls.append(user_message)
+        return "Cut the AI. Ship the core loop."
+
+    async def scenario():
+        semantic = SemanticCache(threshold=0.8)
+        cache = ResponseCache()
+        limiter = ChatLimiter(4, 1)
+        for q in ("Should I add AI features to my MVP?", "should i add ai feature to the mvp"):
+            await generate_reply(provider, "s", q, {}, cache_key=q, cache=cache, limiter=limiter,
+                                 semantic_namespace="elon", semantic=semantic)
+        return semantic
+
+    semantic = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert semantic.stats()["hits"] == 1
+
+
+if __name__ == "__main__":
+    test_embeddings_are_unit_length_and_deterministic()
+    test_rewordings_match_and_unrelated_questions_do_not()
+    test_negation_antonyms_and_word_order_never_hit()
+    test_expired_entries_are_ignored()
+    test_index_grows_then_overwrites_oldest()
+    test_stale_namespaces_are_evicted()
+    test_near_duplicate_skips_provider()
+    print("ALL PASS")
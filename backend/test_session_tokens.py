@@ -0,0 +1,83 @@
+import contextlib
+import io
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import auth
+import database
+from gumroad_handler import grant_premium_access, revoke_premium_access
+from middleware.auth_middleware import get_user_identifier
+from mock_supabase import MockSupabase
+
+USERS_GET = ("GET", "/rest/v1/users")
+
+
+@contextlib.contextmanager
+def logged_in(email):
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    app = FastAPI()
+    app.include_router(auth.router)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), TestClient(app) as client:
+            client.post("/auth/signup", json={"email": email, "password": "password123"})
+            yield server, client
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def test_me_answers_from_token():
+    with logged_in("a@example.com") as (server, client):
+        server.requests.clear()
+        for _ in range(3):
+            assert client.get("/auth/me").json() == {"email": "a@example.com", "plan": "free",
+                                                     "subscription_end_date": None}
+        assert server.round_trips() == 0
+
+
+def test_expired_access_token_is_refreshed():
+    with logged_in("b@example.com") as (server, client):
+        client.cookies.delete("auth_token")          # access cookie lapsed
+        server.requests.clear()
+        assert client.get("/auth/me").json()["email"] == "b@example.com"
+        assert server.requests[USERS_GET] == 1
+        assert client.cookies.get("auth_token")
+        server.requests.clear()
+        client.get("/auth/me")
+        assert server.round_trips() == 0
+
+
+def test_plan_change_retires_old_access_token():
+    with logged_in("c@example.com") as (server, client):
+        assert client.get("/auth/me").json()["plan"] == "free"
+        supabase = database.get_supabase_client()
+        assert grant_premium_access("c@example.com", "sale_1", supabase)
+        assert client.get("/auth/me").json()["plan"] == "pro"       # stale token -> re-read
+        assert len(server.tables["transactions"]) == 1
+
+        assert revoke_premium_access("sale_1", supabase)
+        assert client.get("/auth/me").json()["plan"] == "free"
+
+
+def test_logout_revokes_refresh_token():
+    with logged_in("d@example.com") as (server, client):
+        refresh_token = client.cookies.get("refresh_token")
+        request = SimpleNamespace(cookies={"refresh_token": refresh_token}, client=SimpleNamespace(host="1.2.3.4"))
+        assert get_user_identifier(request) == "d@example.com"     # no access token: refresh names the user
+
+        client.post("/auth/logout")
+        client.cookies.set("refresh_token", refresh_token)
+        assert client.post("/auth/refresh").status_code == 401
+        assert get_user_identifier(request) == "1.2.3.4"
+
+
+if __name__ == "__main__":
+    test_me_answers_from_token()
+    test_expired_access_token_is_refreshed()
+    test_plan_change_retires_old_access_token()
+    test_logout_revokes_refresh_token()
+    print("ALL PASS")
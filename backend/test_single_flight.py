@@ -0,0 +1,82 @@
+import asyncio
+
+from chat_pipeline import ChatLimiter, generate_reply
+from response_cache import ResponseCache, make_cache_key
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+
+SPIKE = 200
+
+
+def test_identical_concurrent_requests_share_one_call():
+    calls = []
+
+    async def provider(system_prompt, user_message, rules):
+        calls.append(user_message)
+        await asyncio.sleep(0.05)
+        return "Build the monopoly."
+
+    async def scenario():
+        flight = SingleFlight()
+        limiter = ChatLimiter(16, 5)
+        key = make_cache_key("thiel", "What should I build?", {})
+        replies = await asyncio.gather(*[
+            generate_reply(provider, "s", "What should I build?", {}, cache_key=key,
+                           cache=ResponseCache(), semantic=SemanticCache(), flight=flight, limiter=limiter)
+            for _ in range(SPIKE)
+        ])
+        return flight, replies
+
+    flight, replies = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert set(replies) == {"Build the monopoly."}
+    stats = flight.stats()
+    assert stats["coalesced"] == SPIKE - 1
+    assert stats["in_flight"] == 0
+    print(f"single-flight stats: {stats}")
+
+
+def test_errors_reach_every_waiter_and_are_not_sticky():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    async def scenario():
+        flight = SingleFlight()
+        first = await asyncio.gather(*[flight.do("k", flaky) for _ in range(5)], return_exceptions=True)
+        second = await flight.do("k", flaky)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in first)
+    assert second == "ok"
+    assert len(attempts) == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        flight = SingleFlight()
+        leader = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+
+
+if __name__ == "__main__":
+    test_identical_concurrent_requests_share_one_call()
+    test_errors_reach_every_waiter_and_are_not_sticky()
+    test_cancelled_leader_does_not_cancel_followers()
+    print("ALL PASS")
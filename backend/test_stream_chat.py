@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from chat_pipeline import ChatLimiter, stream_chat
+from response_validator import StreamGuard
+
+RULES = {"max_words": 12, "forbidden_phrases": ["as an AI", "delve"]}
+REPLY = ("Wrong question. As an AI model I won't delve into feelings. "
+         "The constraint is cost per unit, so cut it by ten and ship next week or die trying")
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def parse(events):
+    parsed = []
+    for raw in events:
+        lines = raw.strip().split("\n")
+        parsed.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return parsed
+
+
+def test_guard_strips_phrases_split_across_chunks():
+    for size in (1, 3, 7, 50):
+        guard = StreamGuard({"max_words": 200, "forbidden_phrases": ["as an AI"]})
+        out = "".join(guard.feed(c) for c in chunked("I am As an ai built thing", size)) + guard.flush()
+        assert "as an ai" not in out.lower(), (size, out)
+        assert out.split() == ["I", "am", "built", "thing"]
+
+
+def test_guard_caps_words_and_marks_done():
+    guard = StreamGuard(RULES)
+    out = ""
+    for c in chunked(REPLY, 5):
+        out += guard.feed(c)
+        if guard.done:
+            break
+    assert guard.done
+    assert len(out.replace("...", "").split()) == RULES["max_words"]
+    assert out.endswith("...")
+
+
+def test_stream_cancels_upstream_at_cap():
+    state = {"sent": 0, "closed": False}
+
+    async def fake_stream(system_prompt, user_message):
+        try:
+            for c in chunked(REPLY * 5, 4):
+                state["sent"] += 1
+                await asyncio.sleep(0)
+                yield c
+        finally:
+            state["closed"] = True
+
+    async def collect():
+        return [e async for e in stream_chat(fake_stream, "system", "q", RULES, limiter=ChatLimiter(4, 1))]
+
+    events = parse(asyncio.run(collect()))
+    assert state["closed"]
+    assert state["sent"] < len(chunked(REPLY * 5, 4)) // 2
+    assert events[-1][0] == "done"
+    assert events[-1][1]["capped"] is True
+    assert events[-1][1]["ttft_ms"] is not None
+    text = "".join(data["text"] for name, data in events if name == "token")
+    assert "delve" not in text.lower()
+
+
+if __name__ == "__main__":
+    test_guard_strips_phrases_split_across_chunks()
+    test_guard_caps_words_and_marks_done()
+    test_stream_cancels_upstream_at_cap()
+    print("ALL PASS")
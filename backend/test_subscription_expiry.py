@@ -0,0 +1,164 @@
+import contextlib
+import io
+import time
+from datetime import datetime, timedelta, timezone
+
+import database
+from gumroad_handler import grant_premium_access
+from mock_supabase import MockSupabase
+from payments import grant_razorpay_access
+from quota_cache import QuotaCache
+from subscription_expiry import ExpiryIndex, subscription_expiry
+
+T0 = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = T0.timestamp()
+
+    def __call__(self):
+        return self.now
+
+
+def at(hours: float) -> str:
+    return (T0 + timedelta(hours=hours)).isoformat()
+
+
+def test_sweep_downgrades_due_users_in_batches():
+    clock = FakeClock()
+    calls = []
+
+    def downgrade(ids, now, version):
+        calls.append(list(ids))
+        return [{"id": i, "email": f"{i}@example.com"} for i in ids]
+
+    index = ExpiryIndex(load=lambda: [], downgrade=downgrade, fetch=lambda ids: [], batch_size=2, clock=clock)
+    with contextlib.redirect_stdout(io.StringIO()):
+        index.load([{"id": f"u{i}", "email": f"u{i}@example.com", "subscription_end_date": at(i)}
+                    for i in range(1, 6)] + [{"id": "lifetime", "email": "l@example.com"}])
+    assert index.stats()["tracked"] == 5
+    assert index.sweep() == 0 and calls == []
+
+    clock.now += 3 * 3600
+    assert index.is_active("u4@example.com") and not index.is_active("u2@example.com")
+    assert index.is_active("l@example.com") and index.is_active("unknown@example.com")
+    assert index.sweep() == 3
+    assert calls == [["u1", "u2"], ["u3"]]
+    assert index.stats()["tracked"] == 2 and index.is_active("u2@example.com")   # forgotten once downgraded
+
+    # Moving an end date: the stale heap entry is skipped
+    index.track({"id": "u4", "email": "u4@example.com", "subscription_end_date": at(100)})
+    clock.now += 2 * 3600
+    assert index.sweep() == 1 and calls[-1] == ["u5"]
+
+
+def test_renewed_users_are_refreshed_not_downgraded():
+    clock = FakeClock()
+    index = ExpiryIndex(load=lambda: [], downgrade=lambda ids, now, version: [],
+                        fetch=lambda ids: [{"id": "u1", "email": "a@example.com", "plan": "pro",
+                                            "subscription_end_date": at(24 * 30)}], clock=clock)
+    index.track({"id": "u1", "email": "a@example.com", "subscription_end_date": at(1)})
+    clock.now += 2 * 3600
+    assert not index.is_active("a@example.com")
+    assert index.sweep() == 0
+    assert index.is_active("a@example.com") and index.stats()["renewed"] == 1
+
+
+def test_against_supabase_rest():
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        now = datetime.now(timezone.utc)
+        server.insert("users", {"email": "lapsed@example.com", "plan": "pro",
+                                "subscription_end_date": (now + timedelta(seconds=0.2)).isoformat()})
+        server.insert("users", {"email": "renews@example.com", "plan": "pro",
+                                "subscription_end_date": (now + timedelta(seconds=0.2)).isoformat()})
+        server.insert("users", {"email": "lifetime@example.com", "plan": "pro"})
+        server.insert("users", {"email": "free@example.com", "plan": "free",
+                                "subscription_end_date": (now - timedelta(days=1)).isoformat()})
+        index = ExpiryIndex()
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.load()
+        assert index.stats()["tracked"] == 2
+
+        # Renewed in the database after the index was loaded
+        server.select("users", {"email": "eq.renews@example.com"})[0]["subscription_end_date"] = \
+            (now + timedelta(days=30)).isoformat()
+        time.sleep(0.25)
+        assert index.sweep() == 1
+        plans = {u["email"]: u["plan"] for u in server.tables["users"]}
+        assert plans == {"lapsed@example.com": "free", "renews@example.com": "pro",
+                         "lifetime@example.com": "pro", "free@example.com": "free"}
+        assert index.is_active("renews@example.com") and index.stats()["tracked"] == 1
+        assert server.requests[("PATCH", "/rest/v1/users")] == 1
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def test_quota_path_checks_expiry_in_memory():
+    server = MockSupabase()
+    clock = FakeClock()
+    index = ExpiryIndex(load=lambda: [], clock=clock)
+    end = datetime.now(timezone.utc) + timedelta(hours=1)
+    server.insert("users", {"email": "pro@example.com", "plan": "pro", "subscription_end_date": end.isoformat()})
+    index.track({"id": "u1", "email": "pro@example.com", "subscription_end_date": end.isoformat()})
+
+    def load(identifier):
+        with server.lock:
+            return server.rpc_check_can_chat({"p_identifier": identifier, "p_daily_limit": 10})
+
+    cache = QuotaCache(load=load, flush=lambda batch: None, daily_limit=10, global_cap=1000,
+                       flush_interval=60, is_active=index.is_active)
+    for _ in range(5):
+        assert cache.check("pro@example.com")["plan"] == "pro"
+    assert cache.stats()["misses"] == 1                      # 4 local answers, no DB reads
+
+    # The end date passes: the next chat goes to the RPC, which downgrades it
+    clock.now = end.timestamp() + 1
+    server.tables["users"][0]["subscription_end_date"] = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    result = cache.check("pro@example.com")
+    assert result["plan"] == "free" and result["allowed"]
+    assert server.tables["users"][0]["plan"] == "free"
+    assert cache.stats()["misses"] == 2
+
+
+def test_buying_again_after_expiry_stays_pro():
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    lapsed = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    try:
+        supabase = database.get_supabase_client()
+        for email, grant in (("g@example.com", lambda: grant_premium_access("g@example.com", "sale_2", supabase)),
+                             ("r@example.com", lambda: grant_razorpay_access("r@example.com", {"id": "pay_1"}, supabase))):
+            user = server.insert("users", {"email": email, "plan": "free", "subscription_end_date": lapsed})[0]
+            subscription_expiry.track(user)     # still indexed from before the lapse
+            with contextlib.redirect_stdout(io.StringIO()):
+                assert grant()
+            row = server.select("users", {"email": f"eq.{email}"})[0]
+            assert row["plan"] == "pro" and row["subscription_end_date"] is None
+            assert subscription_expiry.is_active(email)
+            with server.lock:
+                assert server.rpc_check_can_chat({"p_identifier": email, "p_daily_limit": 10})["plan"] == "pro"
+
+        # Neither a sweep nor a reload brings the old end date back
+        assert subscription_expiry.sweep() == 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            subscription_expiry.load()
+        assert subscription_expiry.stats()["tracked"] == 0
+        assert {u["plan"] for u in server.tables["users"]} == {"pro"}
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+if __name__ == "__main__":
+    test_sweep_downgrades_due_users_in_batches()
+    test_renewed_users_are_refreshed_not_downgraded()
+    test_against_supabase_rest()
+    test_quota_path_checks_expiry_in_memory()
+    test_buying_again_after_expiry_stays_pro()
+    print("ALL PASS")
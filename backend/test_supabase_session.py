@@ -0,0 +1,62 @@
+import requests
+
+from mock_supabase import MockSupabase
+from supabase_session import SupabaseSession
+
+
+def test_sequential_calls_reuse_one_connection():
+    server = MockSupabase().start()
+    session = SupabaseSession(pool_size=4)
+    try:
+        for i in range(20):
+            assert session.request("GET", f"{server.url}/rest/v1/users", "k", params={"id": f"eq.{i}"}).json() == []
+        assert server.connections == 1
+        assert session.stats()["connections_opened"] == 1
+    finally:
+        server.stop()
+
+
+def test_idempotent_calls_retry_unavailable():
+    server = MockSupabase().start()
+    session = SupabaseSession(retries=2, backoff=0.001)
+    try:
+        server.fail_next = 2
+        assert session.request("GET", f"{server.url}/rest/v1/users", "k").status_code == 200
+        assert session.retried == 2
+
+        # Out of retries: the last 503 is returned to the caller
+        server.fail_next = 3
+        assert session.request("PATCH", f"{server.url}/rest/v1/users", "k", json={}).status_code == 503
+    finally:
+        server.stop()
+
+
+def test_post_is_not_resent_after_reaching_server():
+    server = MockSupabase().start()
+    session = SupabaseSession(retries=2, backoff=0.001)
+    try:
+        server.fail_next = 1
+        resp = session.request("POST", f"{server.url}/rest/v1/rpc/check_can_chat", "k", json={"p_identifier": "1.1.1.1"})
+        assert resp.status_code == 503
+        assert session.retried == 0
+        assert server.tables["users"] == []
+    finally:
+        server.stop()
+
+
+def test_connect_failures_retry_then_raise():
+    session = SupabaseSession(retries=1, backoff=0.001)
+    try:
+        session.request("POST", "http://127.0.0.1:9/rest/v1/users", "k", json={})
+        assert False, "expected ConnectionError"
+    except requests.ConnectionError:
+        pass
+    assert session.retried == 1 and session.failures == 1
+
+
+if __name__ == "__main__":
+    test_sequential_calls_reuse_one_connection()
+    test_idempotent_calls_retry_unavailable()
+    test_post_is_not_resent_after_reaching_server()
+    test_connect_failures_retry_then_raise()
+    print("ALL PASS")
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import time
+
+from chat_pipeline import ChatLimiter, stream_chat
+from metrics import metrics
+from persona_registry import persona_registry
+from token_budget import BASELINE_MAX_TOKENS, MIN_MAX_TOKENS, estimate_max_tokens, record_generation
+
+WORD = "first "
+
+
+def test_budget_follows_word_cap():
+    assert estimate_max_tokens(120) == 194
+    assert estimate_max_tokens(120) < BASELINE_MAX_TOKENS
+    assert estimate_max_tokens(1000) == BASELINE_MAX_TOKENS
+    assert estimate_max_tokens(1) == MIN_MAX_TOKENS
+
+
+def test_personas_carry_budget_in_rules():
+    elon = persona_registry.get("elon")
+    assert elon.max_tokens == estimate_max_tokens(elon.max_words)
+    assert elon.rules["max_tokens"] == elon.max_tokens
+
+
+def test_only_early_stops_count_as_saved():
+    before = metrics.snapshot()["counters"].get("tokens_saved", 0)
+    assert record_generation(194, 150, stopped_early=False, elapsed_ms=1500) == 0
+    assert record_generation(194, 194, stopped_early=True, elapsed_ms=1940) == BASELINE_MAX_TOKENS - 194
+    assert metrics.snapshot()["counters"]["tokens_saved"] - before == BASELINE_MAX_TOKENS - 194
+
+
+def _paced_stream(tokens, delay):
+    """One word per delta, like a real token stream, at a fixed decode speed."""
+    async def stream(system_prompt, user_message):
+        for _ in range(tokens):
+            await asyncio.sleep(delay)
+            yield WORD
+    return stream
+
+
+def _run(rules):
+    async def collect():
+        start = time.perf_counter()
+        events = [e async for e in stream_chat(_paced_stream(BASELINE_MAX_TOKENS, 0.001), "s", "q", rules,
+                                               limiter=ChatLimiter(4, 1))]
+        return events, time.perf_counter() - start
+    events, elapsed = asyncio.run(collect())
+    lines = events[-1].strip().split("\n")
+    return json.loads(lines[1][len("data: "):]), elapsed
+
+
+def test_stream_stops_at_cap_and_reports_savings():
+    uncapped, slow = _run({"max_words": 10_000})
+    capped, fast = _run({"max_words": 60, "max_tokens": estimate_max_tokens(60)})
+    assert uncapped["tokens_saved"] == 0 and not uncapped["capped"]
+    assert capped["capped"] and capped["tokens_saved"] > 0
+    assert fast < slow / 2
+    assert metrics.snapshot()["latency_ms"]["chat_latency_saved_ms"]["count"] > 0
+
+
+if __name__ == "__main__":
+    test_budget_follows_word_cap()
+    test_personas_carry_budget_in_rules()
+    test_only_early_stops_count_as_saved()
+    test_stream_stops_at_cap_and_reports_savings()
+    print("ALL PASS")
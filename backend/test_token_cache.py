@@ -0,0 +1,73 @@
+import time
+from types import SimpleNamespace
+
+import jwt
+
+from middleware import auth_middleware
+from middleware.auth_middleware import JWT_ALGORITHM, SECRET_KEY, VerifiedTokenCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def make_token(email="a@example.com", exp=None, secret=SECRET_KEY):
+    exp = exp or time.time() + 600
+    return jwt.encode({"email": email, "exp": exp}, secret, algorithm=JWT_ALGORITHM)
+
+
+def fake_request(token=None, host="1.2.3.4"):
+    return SimpleNamespace(cookies={"auth_token": token} if token else {}, client=SimpleNamespace(host=host))
+
+
+def test_second_decode_is_a_hit_until_exp():
+    clock = FakeClock()
+    cache = VerifiedTokenCache(clock=clock)
+    token = make_token(exp=clock.now + 60)
+    assert cache.decode(token)["email"] == "a@example.com"
+    assert cache.decode(token)["email"] == "a@example.com"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    clock.now += 61     # past exp for the cache; jwt.decode still sees real time
+    cache.decode(token)
+    assert cache.stats()["misses"] == 2
+
+
+def test_bad_tokens_are_not_cached():
+    cache = VerifiedTokenCache()
+    assert cache.decode(make_token(secret="someone-else")) is None
+    assert cache.decode("not-a-jwt") is None
+    assert cache.decode(make_token(exp=1)) is None     # expired
+    assert cache.stats()["entries"] == 0 and cache.stats()["rejected"] == 3
+
+
+def test_lru_is_bounded():
+    cache = VerifiedTokenCache(max_entries=2)
+    tokens = [make_token(f"u{i}@example.com") for i in range(3)]
+    cache.decode(tokens[0])
+    cache.decode(tokens[1])
+    cache.decode(tokens[0])          # u0 now most recent
+    cache.decode(tokens[2])          # evicts u1
+    assert cache.stats()["entries"] == 2
+    cache.decode(tokens[1])
+    assert cache.stats()["misses"] == 4
+
+
+def test_revoked_token_falls_back_to_ip():
+    token = make_token()
+    assert auth_middleware.get_user_identifier(fake_request(token)) == "a@example.com"
+    auth_middleware.verified_tokens.revoke(token)
+    assert auth_middleware.get_user_identifier(fake_request(token)) == "1.2.3.4"
+    assert auth_middleware.get_user_identifier(fake_request()) == "1.2.3.4"
+
+
+if __name__ == "__main__":
+    test_second_decode_is_a_hit_until_exp()
+    test_bad_tokens_are_not_cached()
+    test_lru_is_bounded()
+    test_revoked_token_falls_back_to_ip()
+    print("ALL PASS")
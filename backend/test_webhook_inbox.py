@@ -0,0 +1,279 @@
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+import time
+
+import database
+import gumroad_handler
+import payments
+from gumroad_handler import (SaleCache, apply_gumroad_event, grant_premium_access, ping_event_id, parse_ping,
+                             revoke_premium_access)
+from mock_gumroad import MockGumroad
+from mock_supabase import MockSupabase
+from webhook_inbox import WebhookInbox
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@contextlib.contextmanager
+def inbox(**kwargs):
+    with tempfile.TemporaryDirectory() as tmp:
+        box = WebhookInbox(os.path.join(tmp, "inbox.db"), **kwargs)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield box
+        finally:
+            box.close()
+
+
+def test_redeliveries_are_applied_once():
+    applied = []
+    with inbox(handlers={"razorpay": applied.append}) as box:
+        assert box.enqueue("razorpay", "evt_1", b'{"n": 1}') is True
+        assert box.enqueue("razorpay", "evt_1", b'{"n": 1}') is False
+        assert box.drain() == 1
+        assert box.enqueue("razorpay", "evt_1", b'{"n": 1}') is False   # after it was applied
+        assert box.drain() == 0
+        assert applied == [b'{"n": 1}']
+        stats = box.stats()
+        assert stats["replays"] == 2 and stats["replays_total"] == 2
+        assert stats["by_status"] == {"done": 1} and stats["backlog"] == 0
+
+
+def test_failures_back_off_then_fail_and_can_be_replayed():
+    clock = Clock()
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) < 4:
+            raise RuntimeError("supabase down")
+        return True
+
+    with inbox(handlers={"gumroad": flaky}, max_attempts=3, backoff=2, clock=clock) as box:
+        box.enqueue("gumroad", "sale_1:sale", b"sale_id=sale_1")
+        assert box.drain() == 1
+        assert box.drain() == 0                 # backing off for 2s
+        clock.now += 2
+        assert box.drain() == 1
+        clock.now += 4
+        assert box.drain() == 1
+        stats = box.stats()
+        assert stats["by_status"] == {"failed": 1} and stats["retries"] == 2 and stats["failed"] == 1
+
+        assert box.replay("gumroad", "sale_1:sale") is True
+        assert box.drain() == 1
+        assert len(calls) == 4 and box.stats()["by_status"] == {"done": 1}
+
+
+def test_crashed_claim_is_retaken_after_lease():
+    clock = Clock()
+    applied = []
+    with inbox(handlers={"razorpay": applied.append}, lease=60, clock=clock) as box:
+        box.enqueue("razorpay", "evt_2", b"{}")
+        assert box._claim() is not None         # a worker took it and died
+        assert box.drain() == 0
+        assert box.stats()["backlog"] == 1
+        clock.now += 61
+        assert box.drain() == 1 and applied == [b"{}"]
+
+
+def test_events_survive_restart_and_workers_apply_them():
+    applied = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inbox.db")
+        first = WebhookInbox(path)
+        first.enqueue("razorpay", "evt_3", b"{}")
+        first.close()
+
+        second = WebhookInbox(path, handlers={"razorpay": applied.append}, workers=2, poll_interval=0.05)
+        second.start()
+        second.enqueue("razorpay", "evt_4", b"{}")
+        deadline = time.time() + 5
+        while len(applied) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        stats = second.stats()
+        second.close()
+        assert len(applied) == 2 and stats["applied"] == 2 and stats["backlog"] == 0
+
+
+def test_razorpay_signature():
+    saved = payments.WEBHOOK_SECRET
+    payments.WEBHOOK_SECRET = "whsec"
+    try:
+        body = b'{"event": "payment.captured"}'
+        good = hmac.new(b"whsec", body, hashlib.sha256).hexdigest()
+        assert payments.verify_signature(body, good) is True
+        assert payments.verify_signature(body + b" ", good) is False
+        assert payments.verify_signature(body, "") is False
+    finally:
+        payments.WEBHOOK_SECRET = saved
+
+
+def test_gumroad_ping_grants_then_refund_revokes():
+    gumroad = MockGumroad().start()
+    supabase = MockSupabase().start()
+    saved = (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache,
+             database.SUPABASE_URL, database.SUPABASE_KEY)
+    gumroad_handler.GUMROAD_API_URL = f"{gumroad.url}/v2"
+    gumroad_handler.GUMROAD_ACCESS_TOKEN = gumroad.access_token
+    gumroad_handler.sale_cache = SaleCache()
+    database.SUPABASE_URL, database.SUPABASE_KEY = supabase.url, "test-key"
+    try:
+        supabase.insert("users", {"email": "buyer@example.com", "plan": "free"})
+        gumroad.add_sale("sale_9", "buyer@example.com")
+        with inbox(handlers={"gumroad": apply_gumroad_event}) as box:
+            sale = b"sale_id=sale_9&email=buyer%40example.com&refunded=false"
+            assert ping_event_id(parse_ping(sale)) == "sale_9:sale"
+            box.enqueue("gumroad", ping_event_id(parse_ping(sale)), sale)
+            box.enqueue("gumroad", ping_event_id(parse_ping(sale)), sale)
+            assert box.drain() == 1
+            assert supabase.select("users", {"email": "eq.buyer@example.com"})[0]["plan"] == "pro"
+            assert len(supabase.select("transactions", {"gumroad_sale_id": "eq.sale_9"})) == 1
+
+            gumroad.sales["sale_9"]["refunded"] = True
+            refund = json.dumps({"sale_id": "sale_9", "refunded": True}).encode()
+            box.enqueue("gumroad", ping_event_id(parse_ping(refund)), refund)
+            assert box.drain() == 1
+            assert supabase.select("users", {"email": "eq.buyer@example.com"})[0]["plan"] == "free"
+            assert box.stats()["by_status"] == {"done": 2}
+    finally:
+        (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache,
+         database.SUPABASE_URL, database.SUPABASE_KEY) = saved
+        gumroad.stop()
+        supabase.stop()
+
+
+def test_forged_gumroad_pings_cannot_grant_or_revoke():
+    gumroad = MockGumroad().start()
+    supabase = MockSupabase().start()
+    saved = (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache,
+             database.SUPABASE_URL, database.SUPABASE_KEY)
+    gumroad_handler.GUMROAD_API_URL = f"{gumroad.url}/v2"
+    gumroad_handler.GUMROAD_ACCESS_TOKEN = gumroad.access_token
+    gumroad_handler.sale_cache = SaleCache()
+    database.SUPABASE_URL, database.SUPABASE_KEY = supabase.url, "test-key"
+    clock = Clock()
+    plan = lambda email: supabase.select("users", {"email": f"eq.{email}"})[0]["plan"]
+    try:
+        for email in ("buyer@example.com", "attacker@example.com", "other@example.com"):
+            supabase.insert("users", {"email": email, "plan": "free"})
+        gumroad.add_sale("sale_9", "buyer@example.com")
+        gumroad.add_sale("sale_other", "other@example.com", product_permalink="another-product")
+        with inbox(handlers={"gumroad": apply_gumroad_event}, max_attempts=2, backoff=1, clock=clock) as box:
+            # The ping's email is ignored: access goes to the buyer on the record
+            forged = b"sale_id=sale_9&email=attacker%40example.com&refunded=false"
+            box.enqueue("gumroad", ping_event_id(parse_ping(forged)), forged)
+            assert box.drain() == 1
+            assert plan("buyer@example.com") == "pro" and plan("attacker@example.com") == "free"
+
+            # Sales of other products are not ours to grant
+            other = b"sale_id=sale_other&refunded=false"
+            box.enqueue("gumroad", ping_event_id(parse_ping(other)), other)
+            assert box.drain() == 1 and plan("other@example.com") == "free"
+
+            # A refund the record doesn't show revokes nothing, and never completes its id
+            refund = b"sale_id=sale_9&refunded=true"
+            box.enqueue("gumroad", "sale_9:refund", refund)
+            assert box.drain() == 1
+            clock.now += 1
+            assert box.drain() == 1
+            assert plan("buyer@example.com") == "pro"
+            assert box.stats()["by_status"] == {"done": 2, "failed": 1}
+
+            # The genuine refund ping arrives later: queued again and applied
+            gumroad.sales["sale_9"]["refunded"] = True
+            assert box.enqueue("gumroad", "sale_9:refund", refund) is True
+            assert box.drain() == 1
+            assert plan("buyer@example.com") == "free"
+            assert box.stats()["by_status"] == {"done": 3}
+    finally:
+        (gumroad_handler.GUMROAD_API_URL, gumroad_handler.GUMROAD_ACCESS_TOKEN, gumroad_handler.sale_cache,
+         database.SUPABASE_URL, database.SUPABASE_KEY) = saved
+        gumroad.stop()
+        supabase.stop()
+
+
+
+
+@contextlib.contextmanager
+def supabase_server():
+    server = MockSupabase().start()
+    saved = database.SUPABASE_URL, database.SUPABASE_KEY
+    database.SUPABASE_URL, database.SUPABASE_KEY = server.url, "test-key"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield server, database.get_supabase_client()
+    finally:
+        database.SUPABASE_URL, database.SUPABASE_KEY = saved
+        server.stop()
+
+
+def test_gumroad_handlers_can_rerun():
+    with supabase_server() as (server, supabase):
+        server.insert("users", {"email": "buyer@example.com", "plan": "free"})
+        # Lease reruns: one transaction per sale, however often the grant runs
+        assert grant_premium_access("buyer@example.com", "sale_5", supabase)
+        assert grant_premium_access("buyer@example.com", "sale_5", supabase)
+        assert len(server.tables["transactions"]) == 1
+
+        assert revoke_premium_access("sale_5", supabase)
+        assert revoke_premium_access("sale_5", supabase)          # already revoked: done, not retried
+        assert server.tables["users"][0]["plan"] == "free"
+        assert server.tables["transactions"][0]["status"] == "refunded"
+
+        # Crashed between the users update and the transaction update
+        server.tables["transactions"][0]["status"] = "paid"
+        assert revoke_premium_access("sale_5", supabase)
+        assert server.tables["transactions"][0]["status"] == "refunded"
+        # Nothing on record at all: Supabase may just not have answered, so retry
+        assert not revoke_premium_access("sale_unknown", supabase)
+
+
+def test_razorpay_capture_retried_after_refund_does_not_regrant():
+    def event(name, payment_id, order_id=None):
+        entity = {"id": payment_id, "order_id": order_id, "email": "rp@example.com", "amount": 9900}
+        return json.dumps({"event": name, "payload": {"payment": {"entity": entity}}}).encode()
+
+    with supabase_server() as (server, supabase):
+        server.insert("users", {"email": "rp@example.com", "plan": "free"})
+        server.insert("transactions", {"razorpay_order_id": "order_1", "amount": 9900, "status": "created"})
+        plan = lambda: server.tables["users"][0]["plan"]
+
+        # Captured failed once, refund was applied, then the capture's retry comes round
+        assert payments.apply_razorpay_event(event("refund.processed", "pay_1", "order_1"))
+        assert payments.apply_razorpay_event(event("payment.captured", "pay_1", "order_1"))
+        assert plan() == "free"
+        assert server.tables["transactions"][0]["status"] == "refunded"
+
+        # Same without a create_order row: the refund leaves one behind
+        assert payments.apply_razorpay_event(event("refund.processed", "pay_2"))
+        assert payments.apply_razorpay_event(event("payment.captured", "pay_2"))
+        assert plan() == "free"
+
+        # In order, a new payment still grants
+        assert payments.apply_razorpay_event(event("payment.captured", "pay_3"))
+        assert plan() == "pro"
+
+
+if __name__ == "__main__":
+    test_redeliveries_are_applied_once()
+    test_failures_back_off_then_fail_and_can_be_replayed()
+    test_crashed_claim_is_retaken_after_lease()
+    test_events_survive_restart_and_workers_apply_them()
+    test_razorpay_signature()
+    test_gumroad_ping_grants_then_refund_revokes()
+    test_forged_gumroad_pings_cannot_grant_or_revoke()
+    test_gumroad_handlers_can_rerun()
+    test_razorpay_capture_retried_after_refund_does_not_regrant()
+    print("ALL PASS")
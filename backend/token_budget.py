@@ -0,0 +1,59 @@
+"""
+Token budget for persona replies.
+Every persona caps its replies at max_words, so asking the model for more tokens
+than that only buys text validate_response throws away. This sizes max_tokens
+from the word cap and records what stopping early saved.
+"""
+import math
+import os
+from typing import Optional
+
+from metrics import metrics
+
+# Config
+# The fixed max_tokens every call used before budgets; savings are measured against it
+BASELINE_MAX_TOKENS = int(os.getenv("BASELINE_MAX_TOKENS", "300"))
+# Llama-3 tokenizer on English prose averages ~1.3 tokens per word; keep a little extra
+TOKENS_PER_WORD = float(os.getenv("TOKENS_PER_WORD", "1.4"))
+# Extra room so the model can finish the sentence it is on at the cap
+TOKEN_BUDGET_HEADROOM = float(os.getenv("TOKEN_BUDGET_HEADROOM", "0.15"))
+MIN_MAX_TOKENS = 32
+
+
+def estimate_max_tokens(max_words: int, tokens_per_word: float = TOKENS_PER_WORD,
+                        headroom: float = TOKEN_BUDGET_HEADROOM) -> int:
+    """max_tokens for a reply of at most max_words, never above the old fixed limit."""
+    tokens = math.ceil(max_words * tokens_per_word * (1 + headroom))
+    return max(MIN_MAX_TOKENS, min(BASELINE_MAX_TOKENS, tokens))
+
+
+def estimate_tokens(text: str, tokens_per_word: float = TOKENS_PER_WORD) -> int:
+    """Rough token count for text we did not get a usage report for."""
+    return math.ceil(len(text.split()) * tokens_per_word)
+
+
+def record_generation(max_tokens: int, generated_tokens: int, stopped_early: bool,
+                      elapsed_ms: Optional[float] = None, words: Optional[int] = None) -> int:
+    """
+    Records one finished generation and returns the tokens saved.
+
+    A generation only saves tokens if it was stopped early: it hit the budgeted
+    max_tokens, or a stream was cancelled at the word cap. It could then have run
+    on to BASELINE_MAX_TOKENS, so the saving is an upper bound. The latency saved
+    is that many tokens at the decode speed this request actually saw.
+    """
+    metrics.incr("tokens_budgeted", max_tokens)
+    metrics.incr("tokens_generated", generated_tokens)
+    if words:
+        metrics.observe_value("tokens_per_word", generated_tokens / words)
+
+    saved = max(0, BASELINE_MAX_TOKENS - generated_tokens) if stopped_early else 0
+    metrics.observe_value("tokens_saved", saved)
+    if not saved:
+        return 0
+
+    metrics.incr("generations_stopped_early")
+    metrics.incr("tokens_saved", saved)
+    if elapsed_ms and generated_tokens:
+        metrics.observe("chat_latency_saved_ms", saved * elapsed_ms / generated_tokens)
+    return saved
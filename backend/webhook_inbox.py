@@ -0,0 +1,272 @@
+"""
+Durable webhook inbox for Razorpay and Gumroad.
+The webhook routes only verify the request, store the raw event in SQLite and
+return 200; a pool of worker threads applies the events afterwards. Slow
+Supabase or Gumroad calls no longer make providers time out and retry.
+
+Each event is keyed by (provider, event_id). A redelivery of a known id is
+counted as a replay and never applied again, unless the stored event has
+failed: then the redelivery (with its payload) is queued again. Workers claim an event inside a
+write transaction, so two workers (or two processes sharing the file) cannot
+take the same one. A claim is a lease: if a worker dies mid-apply, the event
+is re-run after WEBHOOK_LEASE_SECONDS, and the grant/revoke handlers are
+idempotent, so that rerun is safe. Failed applies are retried with
+exponential backoff, up to WEBHOOK_MAX_ATTEMPTS times.
+
+Events are claimed oldest first, but retries mean one payment's events can be
+applied out of order. The handlers check the payment's current state instead
+of trusting the order: a Razorpay capture whose transaction is already
+refunded is skipped, and Gumroad pings are checked against the sale record.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from metrics import metrics
+
+# Config
+WEBHOOK_INBOX_DB = os.getenv("WEBHOOK_INBOX_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "webhook_inbox.db"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+WEBHOOK_RETRY_BACKOFF = float(os.getenv("WEBHOOK_RETRY_BACKOFF", "2"))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "120"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    provider     TEXT NOT NULL,
+    event_id     TEXT NOT NULL,
+    payload      BLOB NOT NULL,
+    received_at  REAL NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',  -- pending | processing | done | failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    claimed_at   REAL,
+    processed_at REAL,
+    deliveries   INTEGER NOT NULL DEFAULT 1,
+    last_error   TEXT,
+    PRIMARY KEY (provider, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_queue ON webhook_events (status, available_at);
+"""
+
+# provider -> fn(payload bytes) -> bool; False or an exception means "retry later"
+Handler = Callable[[bytes], bool]
+
+
+class WebhookInbox:
+    def __init__(self, path: str = WEBHOOK_INBOX_DB, handlers: Optional[Dict[str, Handler]] = None,
+                 workers: int = WEBHOOK_WORKERS, max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+                 backoff: float = WEBHOOK_RETRY_BACKOFF, lease: float = WEBHOOK_LEASE_SECONDS,
+                 poll_interval: float = WEBHOOK_POLL_INTERVAL, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.handlers: Dict[str, Handler] = dict(handlers or {})
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._clock = clock
+        # One connection, serialized by a lock: every statement here is tiny
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._wake = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self.received = 0
+        self.replays = 0
+        self.applied = 0
+        self.retries = 0
+        self.failed = 0
+
+    def register(self, provider: str, handler: Handler):
+        self.handlers[provider] = handler
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=FULL")   # an acked event survives power loss
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    # --- Ingest (webhook routes) ------------------------------------------
+
+    def enqueue(self, provider: str, event_id: str, payload: bytes) -> bool:
+        """
+        Stores the event durably. Returns False for a replay of an id already stored;
+        a redelivery of a failed event replaces it and is queued again (True).
+        """
+        now = self._clock()
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                inserted = db.execute(
+                    "INSERT OR IGNORE INTO webhook_events (provider, event_id, payload, received_at, available_at)"
+                    " VALUES (?, ?, ?, ?, ?)", (provider, event_id, payload, now, now)).rowcount == 1
+                if not inserted:
+                    inserted = db.execute(
+                        "UPDATE webhook_events SET payload = ?, status = 'pending', attempts = 0, available_at = ?,"
+                        " deliveries = deliveries + 1 WHERE provider = ? AND event_id = ? AND status = 'failed'",
+                        (payload, now, provider, event_id)).rowcount == 1
+                if not inserted:
+                    db.execute("UPDATE webhook_events SET deliveries = deliveries + 1"
+                               " WHERE provider = ? AND event_id = ?", (provider, event_id))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self.received += 1
+            if not inserted:
+                self.replays += 1
+        if inserted:
+            with self._wake:
+                self._wake.notify()
+        return inserted
+
+    # --- Workers -------------------------------------------------------------
+
+    def _claim(self) -> Optional[tuple]:
+        now = self._clock()
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT provider, event_id, payload, attempts, received_at FROM webhook_events"
+                    " WHERE (status = 'pending' AND available_at <= ?)"
+                    "    OR (status = 'processing' AND claimed_at < ?)"
+                    " ORDER BY received_at LIMIT 1", (now, now - self.lease)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE webhook_events SET status = 'processing', attempts = attempts + 1,"
+                               " claimed_at = ? WHERE provider = ? AND event_id = ?", (now, row[0], row[1]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return row
+
+    def _finish(self, provider: str, event_id: str, attempts: int, received_at: float, error: Optional[str]):
+        now = self._clock()
+        with self._db_lock:
+            db = self._conn()
+            if error is None:
+                db.execute("UPDATE webhook_events SET status = 'done', processed_at = ?, last_error = NULL"
+                           " WHERE provider = ? AND event_id = ?", (now, provider, event_id))
+                self.applied += 1
+            elif attempts >= self.max_attempts:
+                db.execute("UPDATE webhook_events SET status = 'failed', last_error = ?"
+                           " WHERE provider = ? AND event_id = ?", (error, provider, event_id))
+                self.failed += 1
+            else:
+                retry_at = now + self.backoff * (2 ** (attempts - 1))
+                db.execute("UPDATE webhook_events SET status = 'pending', available_at = ?, last_error = ?"
+                           " WHERE provider = ? AND event_id = ?", (retry_at, error, provider, event_id))
+                self.retries += 1
+        if error is None:
+            metrics.observe("webhook_received_to_applied_ms", (now - received_at) * 1000)
+
+    def process_one(self) -> bool:
+        """Claims and applies one due event. False if there was nothing to do."""
+        row = self._claim()
+        if row is None:
+            return False
+        provider, event_id, payload, attempts, received_at = row
+        attempts += 1
+        handler = self.handlers.get(provider)
+        try:
+            if handler is None:
+                error = f"no handler for {provider}"
+            else:
+                error = None if handler(bytes(payload)) is not False else "handler returned False"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if error:
+            print(f"Webhook {provider}/{event_id} attempt {attempts} failed: {error}")
+        self._finish(provider, event_id, attempts, received_at, error)
+        return True
+
+    def drain(self) -> int:
+        """Applies every event that is due now, on the calling thread (tests, scripts)."""
+        count = 0
+        while self.process_one():
+            count += 1
+        return count
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.process_one():
+                    continue
+            except sqlite3.Error as e:
+                print(f"Webhook inbox error: {e}")
+            with self._wake:
+                self._wake.wait(self.poll_interval)
+
+    def start(self):
+        if self._threads:
+            return
+        self._conn()
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # --- Operations ----------------------------------------------------------
+
+    def replay(self, provider: str, event_id: str) -> bool:
+        """Queues a stored event to be applied again (after a fix, or a failed event)."""
+        with self._db_lock:
+            updated = self._conn().execute(
+                "UPDATE webhook_events SET status = 'pending', attempts = 0, available_at = ?"
+                " WHERE provider = ? AND event_id = ? AND status != 'processing'",
+                (self._clock(), provider, event_id)).rowcount
+        if updated:
+            with self._wake:
+                self._wake.notify()
+        return bool(updated)
+
+    def stats(self) -> dict:
+        now = self._clock()
+        with self._db_lock:
+            db = self._conn()
+            by_status = dict(db.execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall())
+            oldest = db.execute("SELECT MIN(received_at) FROM webhook_events"
+                                " WHERE status IN ('pending', 'processing')").fetchone()[0]
+            redelivered = db.execute("SELECT COALESCE(SUM(deliveries - 1), 0) FROM webhook_events").fetchone()[0]
+        return {
+            "backlog": by_status.get("pending", 0) + by_status.get("processing", 0),
+            "oldest_pending_s": round(now - oldest, 3) if oldest is not None else 0.0,
+            "by_status": by_status,
+            "received": self.received,
+            "replays": self.replays,
+            "replays_total": redelivered,
+            "applied": self.applied,
+            "retries": self.retries,
+            "failed": self.failed,
+            "workers": len(self._threads),
+        }
+
+    def close(self):
+        self.stop()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+webhook_inbox = WebhookInbox()
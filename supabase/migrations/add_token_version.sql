@@ -0,0 +1,5 @@
+-- Session token version per user (see backend/session_tokens.py)
+-- Set to a new, larger value (epoch milliseconds) whenever the plan changes;
+-- access tokens minted under an older version are treated as stale.
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS token_version BIGINT NOT NULL DEFAULT 0;
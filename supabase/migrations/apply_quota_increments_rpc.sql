@@ -0,0 +1,70 @@
+-- Batched write-behind for the in-process quota cache (backend/quota_cache.py)
+-- POST /rest/v1/rpc/apply_quota_increments
+--   {"p_increments": [{"identifier": "1.2.3.4", "count": 3, "date": "2025-01-31"}, ...]}
+-- An item with a null identifier (pro chats) only counts towards global_stats.
+--
+-- Adds each identifier's unflushed chats to users.msg_count (restarting the count
+-- if the row still holds an older day, dropping chats from a day already reset) and the total to global_stats, in one
+-- transaction. Returns the fresh counters so the cache can resync:
+--   {"users": [{"identifier": ..., "plan": ..., "msg_count": ..., "last_active_date": ...}],
+--    "global_total": 123}
+
+CREATE OR REPLACE FUNCTION apply_quota_increments(p_increments JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_item JSONB;
+  v_identifier TEXT;
+  v_count INT;
+  v_date DATE;
+  v_total INT := 0;
+  v_users JSONB := '[]'::JSONB;
+  v_row users%ROWTYPE;
+  v_global INT;
+BEGIN
+  FOR v_item IN SELECT * FROM jsonb_array_elements(p_increments) LOOP
+    v_identifier := v_item->>'identifier';
+    v_count := (v_item->>'count')::INT;
+    v_date := (v_item->>'date')::DATE;
+
+    -- Same row check_can_chat charges (ip_address is not unique)
+    IF v_identifier IS NOT NULL THEN
+      UPDATE users SET
+        msg_count = CASE
+          WHEN last_active_date = v_date THEN coalesce(msg_count, 0) + v_count
+          WHEN last_active_date > v_date THEN msg_count  -- yesterday's chats, flushed after the reset
+          ELSE v_count END,
+        last_active_date = greatest(last_active_date, v_date)
+      WHERE id = (
+        SELECT id FROM users
+        WHERE CASE WHEN position('@' IN v_identifier) > 0
+                   THEN email = v_identifier ELSE ip_address = v_identifier END
+        LIMIT 1
+      )
+      RETURNING * INTO v_row;
+
+      IF FOUND THEN
+        v_users := v_users || jsonb_build_object(
+          'identifier', v_identifier, 'plan', v_row.plan,
+          'msg_count', v_row.msg_count, 'last_active_date', v_row.last_active_date);
+      END IF;
+    END IF;
+    -- Only chats charged today count towards today's safety cap
+    IF v_date = current_date THEN
+      v_total := v_total + v_count;
+    END IF;
+  END LOOP;
+
+  INSERT INTO global_stats (date, total_requests) VALUES (current_date, v_total)
+  ON CONFLICT (date) DO UPDATE SET total_requests = global_stats.total_requests + EXCLUDED.total_requests
+  RETURNING total_requests INTO v_global;
+
+  RETURN jsonb_build_object('users', v_users, 'global_total', v_global);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION apply_quota_increments(JSONB) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION apply_quota_increments(JSONB) TO service_role;
@@ -0,0 +1,98 @@
+-- Atomic quota check for /chat
+-- Replaces the GET/PATCH chain in backend/database.py check_can_chat with one
+-- round trip: POST /rest/v1/rpc/check_can_chat
+--
+-- Resolves (or creates) the user, resets the daily count on a new day, downgrades
+-- a pro user past subscription_end_date, checks the free limit and the global
+-- safety cap, and increments both counters, all in one transaction. Returns the
+-- same JSON shape check_can_chat always did:
+--   {"allowed": true,  "plan": "free", "remaining": 7}
+--   {"allowed": false, "plan": "free", "reason": "daily_limit_reached", "remaining": 0}
+--   {"allowed": false, "plan": "free", "reason": "global_cap_reached"}
+--   {"allowed": true,  "plan": "pro",  "remaining": 9999}
+
+CREATE OR REPLACE FUNCTION check_can_chat(
+  p_identifier TEXT,
+  p_daily_limit INT DEFAULT 10,
+  p_global_cap INT DEFAULT 1000
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_is_email BOOLEAN := position('@' IN p_identifier) > 0;
+  v_today DATE := current_date;
+  v_user users%ROWTYPE;
+  v_total INT;
+  v_count INT;
+BEGIN
+  -- ip_address is not unique, so serialize first-time creation per identifier
+  PERFORM pg_advisory_xact_lock(hashtext(p_identifier));
+
+  IF v_is_email THEN
+    SELECT * INTO v_user FROM users WHERE email = p_identifier LIMIT 1 FOR UPDATE;
+  ELSE
+    SELECT * INTO v_user FROM users WHERE ip_address = p_identifier LIMIT 1 FOR UPDATE;
+  END IF;
+
+  IF NOT FOUND THEN
+    INSERT INTO users (email, ip_address, plan, msg_count, last_active_date, created_at)
+    VALUES (
+      CASE WHEN v_is_email THEN p_identifier END,
+      CASE WHEN v_is_email THEN NULL ELSE p_identifier END,
+      'free', 0, v_today, now()
+    )
+    RETURNING * INTO v_user;
+  END IF;
+
+  -- Reset count if new day
+  IF v_user.last_active_date IS DISTINCT FROM v_today THEN
+    UPDATE users SET msg_count = 0, last_active_date = v_today WHERE id = v_user.id;
+    v_user.msg_count := 0;
+  END IF;
+
+  -- A lapsed subscription is downgraded here, so its first chat after the end date
+  -- already counts as free (the backend's expiry sweeper catches the rest in batches)
+  IF v_user.plan = 'pro' AND v_user.subscription_end_date IS NOT NULL AND v_user.subscription_end_date <= now() THEN
+    UPDATE users SET plan = 'free', token_version = (extract(epoch FROM clock_timestamp()) * 1000)::BIGINT
+    WHERE id = v_user.id;
+    v_user.plan := 'free';
+  END IF;
+
+  INSERT INTO global_stats (date, total_requests) VALUES (v_today, 0)
+  ON CONFLICT (date) DO NOTHING;
+
+  -- Pro users are not subject to the safety cap, but still count towards it
+  IF v_user.plan = 'pro' THEN
+    UPDATE global_stats SET total_requests = total_requests + 1 WHERE date = v_today;
+    RETURN jsonb_build_object('allowed', true, 'plan', 'pro', 'remaining', 9999);
+  END IF;
+
+  SELECT total_requests INTO v_total FROM global_stats WHERE date = v_today;
+  IF v_total >= p_global_cap THEN
+    RETURN jsonb_build_object('allowed', false, 'reason', 'global_cap_reached', 'plan', 'free');
+  END IF;
+
+  IF coalesce(v_user.msg_count, 0) >= p_daily_limit THEN
+    RETURN jsonb_build_object('allowed', false, 'reason', 'daily_limit_reached', 'plan', 'free', 'remaining', 0);
+  END IF;
+
+  -- Conditional increment: concurrent chats can never push the cap past p_global_cap
+  UPDATE global_stats SET total_requests = total_requests + 1
+  WHERE date = v_today AND total_requests < p_global_cap;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('allowed', false, 'reason', 'global_cap_reached', 'plan', 'free');
+  END IF;
+
+  UPDATE users SET msg_count = coalesce(msg_count, 0) + 1 WHERE id = v_user.id
+  RETURNING msg_count INTO v_count;
+
+  RETURN jsonb_build_object('allowed', true, 'plan', 'free', 'remaining', p_daily_limit - v_count);
+END;
+$$;
+
+-- Backend calls it with the service role key
+REVOKE ALL ON FUNCTION check_can_chat(TEXT, INT, INT) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION check_can_chat(TEXT, INT, INT) TO service_role;
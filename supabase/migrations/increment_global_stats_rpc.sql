@@ -0,0 +1,20 @@
+-- Atomic, batched increment of the global safety-cap counter
+-- POST /rest/v1/rpc/increment_global_stats {"p_date": "2025-01-31", "p_amount": 42}
+--
+-- Used by backend/database.py GlobalStatsCounter, which sums chats in memory and
+-- flushes them here about once a second instead of a GET + PATCH per chat.
+-- p_amount = 0 just reads the current total. Returns the new total.
+
+CREATE OR REPLACE FUNCTION increment_global_stats(p_date DATE, p_amount INT DEFAULT 1)
+RETURNS INT
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  INSERT INTO global_stats (date, total_requests) VALUES (p_date, p_amount)
+  ON CONFLICT (date) DO UPDATE SET total_requests = global_stats.total_requests + EXCLUDED.total_requests
+  RETURNING total_requests;
+$$;
+
+REVOKE ALL ON FUNCTION increment_global_stats(DATE, INT) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION increment_global_stats(DATE, INT) TO service_role;
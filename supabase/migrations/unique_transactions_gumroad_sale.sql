@@ -0,0 +1,12 @@
+-- One transactions row per Gumroad sale, so grant_premium_access can upsert on
+-- gumroad_sale_id (backend/gumroad_handler.py) and a re-applied webhook event
+-- never records the sale twice. Rows without a sale id (Razorpay) are unaffected.
+
+-- Drop duplicates left by earlier reruns, keeping the oldest row per sale
+DELETE FROM transactions t
+USING transactions older
+WHERE t.gumroad_sale_id IS NOT NULL
+  AND t.gumroad_sale_id = older.gumroad_sale_id
+  AND (older.created_at, older.id) < (t.created_at, t.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_gumroad_sale_id_key ON transactions (gumroad_sale_id);